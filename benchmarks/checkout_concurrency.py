@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+并发结账压测：多个线程同时购买同一个热门商品，统计吞吐量并校验没有超卖
+
+默认在进程内通过 Flask test_client 调用 POST /api/sales/；
+指定 --url 时通过HTTP请求已启动的服务。
+脚本会改写压测商品的库存并产生销售记录，请只在测试库上运行。
+
+用法:
+    python benchmarks/checkout_concurrency.py --requests 500 --concurrency 32 --stock 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+
+import complete_server as server
+
+BENCH_SKU = 'BENCH-HOT-SKU'
+
+
+def prepare(store_id, stock, price):
+    """创建（或复用）压测商品并重置库存，返回 (product_id, (user_id, role, store_id, token_version))"""
+    conn = server.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT product_id FROM products WHERE sku = %s", (BENCH_SKU,))
+    row = cursor.fetchone()
+    if row:
+        product_id = row[0]
+    else:
+        cursor.execute("INSERT INTO products (sku, name) VALUES (%s, %s) RETURNING product_id",
+                       (BENCH_SKU, '压测商品'))
+        product_id = cursor.fetchone()[0]
+
+    cursor.execute("SELECT 1 FROM inventory WHERE store_id = %s AND product_id = %s", (store_id, product_id))
+    if cursor.fetchone():
+        cursor.execute("UPDATE inventory SET quantity = %s, price = %s WHERE store_id = %s AND product_id = %s",
+                       (stock, price, store_id, product_id))
+    else:
+        cursor.execute("INSERT INTO inventory (store_id, product_id, quantity, price) VALUES (%s, %s, %s, %s)",
+                       (store_id, product_id, stock, price))
+
+    # 优先使用该门店的收银员
+    cursor.execute("""
+        SELECT user_id, role, store_id, token_version FROM users
+        WHERE store_id = %s OR role = 'system_admin'
+        ORDER BY (role = 'cashier') DESC, user_id
+        LIMIT 1
+    """, (store_id,))
+    user = cursor.fetchone()
+    conn.commit()
+    conn.close()
+    if not user:
+        raise SystemExit(f'❌ 门店 {store_id} 没有可用的用户')
+    return product_id, user
+
+
+def sold_since(product_id, store_id, since_sale_id):
+    conn = server.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COALESCE(SUM(si.quantity), 0) FROM sale_items si
+        JOIN sales s ON si.sale_id = s.sale_id
+        WHERE si.product_id = %s AND s.store_id = %s AND s.sale_id > %s
+    """, (product_id, store_id, since_sale_id))
+    sold = cursor.fetchone()[0]
+    cursor.execute("SELECT quantity FROM inventory WHERE store_id = %s AND product_id = %s", (store_id, product_id))
+    remaining = cursor.fetchone()[0]
+    conn.close()
+    return sold, remaining
+
+
+def max_sale_id():
+    conn = server.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(sale_id), 0) FROM sales")
+    value = cursor.fetchone()[0]
+    conn.close()
+    return value
+
+
+def make_poster(args, token):
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+    if args.url:
+        endpoint = args.url.rstrip('/') + '/api/sales/'
+
+        def post(payload):
+            req = urllib.request.Request(endpoint, data=json.dumps(payload).encode('utf-8'), headers=headers)
+            try:
+                with urllib.request.urlopen(req) as resp:
+                    return resp.status
+            except urllib.error.HTTPError as e:
+                return e.code
+        return post
+
+    # test_client 不保证线程安全，每个线程使用各自的client
+    thread_clients = threading.local()
+
+    def post(payload):
+        client = getattr(thread_clients, 'client', None)
+        if client is None:
+            client = thread_clients.client = server.app.test_client()
+        return client.post('/api/sales/', json=payload, headers=headers).status_code
+    return post
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发结账压测')
+    parser.add_argument('--requests', type=int, default=200, help='结账请求总数')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发线程数')
+    parser.add_argument('--stock', type=int, default=100, help='压测前热门商品库存')
+    parser.add_argument('--quantity', type=int, default=1, help='每单购买数量')
+    parser.add_argument('--store-id', type=int, default=1)
+    parser.add_argument('--price', type=float, default=9.9)
+    parser.add_argument('--url', help='压测已启动的服务，例如 http://127.0.0.1:5000')
+    args = parser.parse_args()
+
+    if not args.url:
+        server.db_pool.open()
+    product_id, (user_id, role, user_store_id, token_version) = prepare(args.store_id, args.stock, args.price)
+    with server.app.app_context():
+        token = create_access_token(identity=str(user_id), additional_claims={
+            'role': role, 'store_id': user_store_id, 'ver': token_version
+        })
+    post = make_poster(args, token)
+    payload = {
+        'store_id': args.store_id,
+        'items': [{'product_id': product_id, 'quantity': args.quantity, 'unit_price': args.price}]
+    }
+
+    start_sale_id = max_sale_id()
+    statuses = {}
+    latencies = []
+    counter = iter(range(args.requests))
+    counter_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            t0 = time.perf_counter()
+            status = post(payload)
+            elapsed = time.perf_counter() - t0
+            with counter_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                latencies.append(elapsed)
+
+    print(f"🚀 {args.requests} 个结账请求，{args.concurrency} 并发，商品 {product_id} 初始库存 {args.stock}")
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    sold, remaining = sold_since(product_id, args.store_id, start_sale_id)
+    latencies.sort()
+    ok = statuses.get(201, 0)
+    print(f"⏱️ 用时 {elapsed:.2f}s，{args.requests / elapsed:.1f} 请求/秒，{ok / elapsed:.1f} 成交/秒")
+    print(f"   延迟 p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"   状态码分布: {dict(sorted(statuses.items()))}")
+    print(f"   售出 {sold}，剩余库存 {remaining}")
+
+    expected_sold = min(args.stock // args.quantity, args.requests) * args.quantity
+    problems = []
+    if remaining < 0 or sold + remaining != args.stock:
+        problems.append(f'库存不守恒: 售出 {sold} + 剩余 {remaining} != 初始 {args.stock}')
+    if ok * args.quantity != sold:
+        problems.append(f'成功订单数量 {ok * args.quantity} 与销售明细 {sold} 不一致')
+    if sold != expected_sold:
+        problems.append(f'售出 {sold}，预期 {expected_sold}（存在未售出或超卖）')
+    if statuses.get(500):
+        problems.append(f'{statuses[500]} 个请求返回500')
+
+    if problems:
+        for p in problems:
+            print(f"❌ {p}")
+        sys.exit(1)
+    print("✅ 没有超卖")
+
+
+if __name__ == '__main__':
+    main()
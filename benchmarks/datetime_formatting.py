@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+时间格式化微基准：对比旧的逐行 pytz + strftime、固定时区 format_local_datetime、
+以及由数据库 to_char 直接返回北京时间文本（LOCAL_TIME_IN_SQL）
+
+--db 会连接数据库，用 generate_series 生成时间列，计时包含查询和取回结果，不写入任何数据。
+
+用法:
+    python benchmarks/datetime_formatting.py --rows 50000
+    python benchmarks/datetime_formatting.py --rows 50000 --db
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import complete_server as server
+
+
+def legacy_format(dt):
+    """改造前的 format_datetime_with_timezone：每次调用都查找时区并 strftime"""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = pytz.UTC.localize(dt)
+    beijing_tz = pytz.timezone('Asia/Shanghai')
+    return dt.astimezone(beijing_tz).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def python_cases(rows):
+    now = datetime.now(timezone.utc)
+    values = [now - timedelta(seconds=i * 37) for i in range(rows)]
+    assert [legacy_format(v) for v in values] == [server.format_local_datetime(v) for v in values], '格式化结果不一致'
+    return [
+        ('pytz + strftime（改造前）', lambda: [legacy_format(v) for v in values]),
+        ('format_local_datetime', lambda: [server.format_local_datetime(v) for v in values]),
+    ]
+
+
+def db_cases(rows):
+    conn = server.get_db_connection()
+    cursor = conn.cursor()
+    series_sql = "FROM generate_series(1, %s) g, LATERAL (SELECT now() - g * interval '37 seconds' AS ts) t"
+
+    def fetch_and_format():
+        cursor.execute("SELECT t.ts " + series_sql, (rows,))
+        return [server.format_local_datetime(row[0]) for row in cursor.fetchall()]
+
+    def fetch_localized():
+        cursor.execute(f"SELECT {server.local_time_sql('t.ts')} " + series_sql, (rows,))
+        return [row[0] for row in cursor.fetchall()]
+
+    server.app.config['LOCAL_TIME_IN_SQL'] = True
+    assert fetch_and_format() == fetch_localized(), '数据库格式化结果不一致'
+    return conn, [
+        ('查询 + Python格式化', fetch_and_format),
+        ('查询 + SQL to_char', fetch_localized),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='时间格式化微基准')
+    parser.add_argument('--rows', type=int, default=50000, help='时间值个数')
+    parser.add_argument('--repeat', type=int, default=10, help='重复次数，取最快一次')
+    parser.add_argument('--db', action='store_true', help='同时对比数据库 to_char（需要数据库连接）')
+    args = parser.parse_args()
+
+    cases = python_cases(args.rows)
+    conn = None
+    if args.db:
+        server.db_pool.open()
+        conn, extra = db_cases(args.rows)
+        cases += extra
+
+    print(f"每次格式化 {args.rows} 个时间值")
+    print(f"{'方式':<28}{'耗时(ms)':>10}{'每行(µs)':>10}")
+    try:
+        for name, func in cases:
+            elapsed = best_of(func, args.repeat)
+            print(f"{name:<28}{elapsed * 1000:>10.2f}{elapsed * 1e6 / args.rows:>10.3f}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+热点查询执行计划基线：对 complete_server.py 中的热点查询执行 EXPLAIN，检查是否有大表顺序扫描
+
+SQL 直接取自处理函数共用的查询常量和构建函数（build_inventory_query 等），不在这里另写。
+
+--seed 会向数据库写入规模数据（门店、商品、库存、销售、促销、日志），请只在测试库上运行。
+结果写入 benchmarks/explain_baseline.txt 并随代码提交；修改查询或索引后重新生成并对比。
+计划中任何一个节点顺序扫描 SMALL_TABLES 以外的表（SEQ_SCAN_ALLOWED 逐条列出的除外）即以非0状态退出，
+只要计划里有一处索引扫描并不算通过。
+
+用法:
+    python benchmarks/explain_baseline.py --seed --sales 200000
+    python benchmarks/explain_baseline.py --output benchmarks/explain_baseline.txt
+"""
+
+import argparse
+import datetime
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import complete_server as server
+
+TODAY = server.business_today()
+
+
+def hot_queries(conn):
+    """返回 [(名称, SQL, 参数)]：SQL 由 complete_server.py 中处理函数使用的常量和构建函数生成
+
+    门店、用户、销售单等ID取自当前数据库，搜索关键字取第一个商品SKU的前缀（--seed 写入的是 BENCH 开头的SKU）。
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT (SELECT MIN(store_id) FROM stores),
+               (SELECT MIN(user_id) FROM users WHERE role = 'cashier'),
+               (SELECT MIN(user_id) FROM users WHERE role = 'store_manager'),
+               (SELECT MAX(sale_id) FROM sales),
+               (SELECT MIN(product_id) FROM products),
+               (SELECT sku FROM products ORDER BY product_id LIMIT 1),
+               (SELECT (MIN(inventory_id) + MAX(inventory_id)) / 2 FROM inventory)
+    """)
+    store_id, cashier_id, manager_id, sale_id, product_id, sku, middle_inventory_id = cursor.fetchone()
+    conn.rollback()
+    sku = sku or 'BENCH0000001'
+    page = server.app.config['INVENTORY_PAGE_SIZE']
+    sales_page = server.app.config['SALES_PAGE_SIZE']
+    inventory_cursor = (middle_inventory_id, middle_inventory_id)
+
+    def inventory(filters, limit=None, cursor=None, sort='inventory_id'):
+        return server.build_inventory_query(dict(filters, today=TODAY), sort, 'asc', limit, cursor)
+
+    def sales(filters, cursor=None):
+        return server.build_sales_query(filters, sales_page, cursor)
+
+    def promotions(filters):
+        return server.build_promotions_query(filters, TODAY, server.app.config['PROMOTION_PAGE_SIZE'], 0)
+
+    store_inventory_count = inventory({'store_id': store_id})
+    daily_sql, _, daily_params = server.build_daily_sales_report_query(
+        TODAY - datetime.timedelta(days=6), TODAY, store_id)
+    return [
+        ('库存列表：系统管理员首页', *inventory({}, page)[:2]),
+        ('库存列表：系统管理员游标翻页', *inventory({}, page, inventory_cursor)[:2]),
+        ('库存列表：门店游标翻页', *inventory({'store_id': store_id}, page, inventory_cursor)[:2]),
+        ('库存列表：名称/SKU前缀搜索', *inventory({'keyword': sku[:-2]}, page)[:2]),
+        ('库存列表：门店名称/SKU前缀搜索', *inventory({'store_id': store_id, 'keyword': sku[:-1]})[:2]),
+        ('库存列表：低库存', *inventory({'store_id': store_id, 'low_stock_threshold': 10})[:2]),
+        ('库存列表：门店精确总数',
+         f"SELECT COUNT(*) FROM ({store_inventory_count[2]}) AS c", store_inventory_count[3]),
+        ('收银台增量同步', *server.build_inventory_sync_query(store_id, 2 ** 40, TODAY, TODAY)),
+        ('收银台增量同步（跨营业日）',
+         *server.build_inventory_sync_query(store_id, 2 ** 40, TODAY - datetime.timedelta(days=1), TODAY)),
+        ('结账锁定库存行', server.CHECKOUT_LOCK_INVENTORY_SQL, (store_id, [product_id, product_id + 1, product_id + 2])),
+        ('促销定价索引重建', server.PromotionPricingEngine.RULES_SQL, (TODAY,)),
+        ('促销列表：系统管理员首页', *promotions({})[:2]),
+        ('促销列表：门店有效促销', *promotions({'visible_store_id': store_id, 'status': 'active'})[:2]),
+        ('销售列表：系统管理员首页', *sales({})[:2]),
+        ('销售列表：门店首页', *sales({'store_id': store_id})[:2]),
+        ('销售列表：收银员游标翻页', *sales(
+            {'cashier_id': cashier_id},
+            (datetime.datetime.now(server.BEIJING_TZ) - datetime.timedelta(days=3), 0))[:2]),
+        ('销售明细', server.SALE_ITEMS_SQL, (sale_id,)),
+        ('删除商品前检查销售明细', server.PRODUCT_SALE_ITEMS_COUNT_SQL, (product_id,)),
+        ('仪表盘销售趋势（门店）', *server.build_sales_trend_query(TODAY, store_id)),
+        ('销售日报表', daily_sql, daily_params),
+        ('工作日志最新记录', *server.build_work_logs_query()),
+        ('删除用户前检查日志', server.USER_WORK_LOGS_COUNT_SQL, (cashier_id,)),
+        ('门店经理查看本门店用户', *server.build_users_query(manager_id, 'store_manager', store_id)),
+    ]
+
+
+# 行数很少的表（几十个门店、每店几十个用户），规划器选择顺序扫描是合理的，只记录不报错
+SMALL_TABLES = {'stores', 'users'}
+
+# 驱动表走索引、规划器把整张商品表哈希后连接的查询：压测库只有几千个商品，整表扫描不比逐个主键查找慢
+# （enable_seqscan=off 对比实测相同）。按查询逐条列出，其他查询出现大表顺序扫描仍然报错
+SEQ_SCAN_ALLOWED = {
+    '库存列表：名称/SKU前缀搜索': {'products'},
+    '库存列表：低库存': {'products'},
+}
+
+SEQ_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+
+
+def seed(conn, stores, products, sales, promotions, logs):
+    """用 generate_series 批量写入规模数据"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO stores (name, address)
+        SELECT '压测门店' || g, '压测地址' || g FROM generate_series(1, %s) g
+    """, (stores,))
+    cursor.execute("""
+        INSERT INTO users (username, password_hash, role, store_id)
+        SELECT 'bench_user_' || g, 'x', CASE WHEN g %% 10 = 0 THEN 'store_manager' ELSE 'cashier' END,
+               (SELECT store_id FROM stores ORDER BY store_id OFFSET (g %% %s) LIMIT 1)
+        FROM generate_series(1, %s) g
+    """, (stores, stores * 10))
+    cursor.execute("""
+        INSERT INTO products (sku, name)
+        SELECT 'BENCH' || lpad(g::text, 7, '0'), '压测商品' || g FROM generate_series(1, %s) g
+    """, (products,))
+    cursor.execute("""
+        INSERT INTO inventory (store_id, product_id, quantity, price)
+        SELECT s.store_id, p.product_id, (random() * 200)::int, 1 + (random() * 99)::numeric(10, 2)
+        FROM stores s CROSS JOIN products p
+        WHERE NOT EXISTS (SELECT 1 FROM inventory i WHERE i.store_id = s.store_id AND i.product_id = p.product_id)
+    """)
+    cursor.execute("""
+        INSERT INTO sales (store_id, cashier_id, total_amount, sale_timestamp)
+        SELECT u.store_id, u.user_id, (random() * 500)::numeric(10, 2),
+               now() - (random() * interval '365 days')
+        FROM generate_series(1, %s) g
+        JOIN LATERAL (
+            SELECT user_id, store_id FROM users WHERE store_id IS NOT NULL
+            OFFSET (g %% (SELECT COUNT(*) FROM users WHERE store_id IS NOT NULL)) LIMIT 1
+        ) u ON TRUE
+    """, (sales,))
+    cursor.execute("""
+        INSERT INTO sale_items (sale_id, product_id, quantity, price_per_unit)
+        SELECT s.sale_id, 1 + ((s.sale_id * 7 + k * 13) % (SELECT MAX(product_id) FROM products)), 1 + k, 9.90
+        FROM sales s CROSS JOIN generate_series(0, 2) k
+    """)
+    cursor.execute("""
+        INSERT INTO promotions (name, discount_type, discount_value, start_date, end_date, store_id)
+        SELECT '压测促销' || g, 'percentage', 10, CURRENT_DATE - (g %% 400), CURRENT_DATE - (g %% 400) + 14,
+               CASE WHEN g %% 5 = 0 THEN NULL ELSE (SELECT MIN(store_id) FROM stores) + (g %% %s) END
+        FROM generate_series(1, %s) g
+    """, (stores, promotions))
+    cursor.execute("""
+        INSERT INTO promotion_items (promotion_id, product_id)
+        SELECT pr.promotion_id, 1 + ((pr.promotion_id * 31 + k) % (SELECT MAX(product_id) FROM products))
+        FROM promotions pr CROSS JOIN generate_series(0, 4) k
+        WHERE NOT EXISTS (SELECT 1 FROM promotion_items pi WHERE pi.promotion_id = pr.promotion_id)
+    """)
+    # 移出促销的商品记录：保留期内的历史删除，事务号都早于增量同步的 since
+    cursor.execute("""
+        INSERT INTO promotion_item_tombstones (product_id, store_id, deleted_txid)
+        SELECT 1 + (g * 37) %% (SELECT MAX(product_id) FROM products),
+               CASE WHEN g %% 5 = 0 THEN NULL ELSE (SELECT MIN(store_id) FROM stores) + (g %% %s) END, g
+        FROM generate_series(1, %s) g
+    """, (stores, promotions * 5))
+    cursor.execute("""
+        INSERT INTO work_logs (user_id, action, details, timestamp)
+        SELECT (SELECT MIN(user_id) FROM users) + (g %% 50), 'bench', '压测日志', now() - (g || ' minutes')::interval
+        FROM generate_series(1, %s) g
+    """, (logs,))
+    conn.commit()
+    server.rebuild_sales_rollup(conn)
+
+
+def explain_all(conn):
+    """返回 [(名称, 执行计划文本, 顺序扫描的大表列表, 其中不允许的大表列表)]"""
+    queries = hot_queries(conn)
+    cursor = conn.cursor()
+    results = []
+    for name, sql, params in queries:
+        cursor.execute("EXPLAIN (COSTS OFF) " + sql, params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+        big_scans = sorted({table for table in SEQ_SCAN_RE.findall(plan) if table not in SMALL_TABLES})
+        rejected = [table for table in big_scans if table not in SEQ_SCAN_ALLOWED.get(name, ())]
+        results.append((name, plan, big_scans, rejected))
+    conn.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='热点查询执行计划基线')
+    parser.add_argument('--seed', action='store_true', help='先写入规模数据（只在测试库上使用）')
+    parser.add_argument('--stores', type=int, default=20)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--sales', type=int, default=200000)
+    parser.add_argument('--promotions', type=int, default=2000)
+    parser.add_argument('--logs', type=int, default=100000)
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'explain_baseline.txt'))
+    args = parser.parse_args()
+
+    server.db_pool.open()
+    server.migrate_database()
+    conn = server.get_db_connection()
+    try:
+        if args.seed:
+            print('📦 写入规模数据...')
+            seed(conn, args.stores, args.products, args.sales, args.promotions, args.logs)
+        # 与长期运行的库一致：更新统计信息和可见性映射（刚写入的数据没有可见性映射，规划器不会选择仅索引扫描）
+        conn.set_session(autocommit=True)
+        cursor = conn.cursor()
+        cursor.execute("VACUUM ANALYZE")
+        conn.set_session(autocommit=False)
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM sales), (SELECT COUNT(*) FROM sale_items),
+                   (SELECT COUNT(*) FROM inventory), (SELECT COUNT(*) FROM promotions),
+                   (SELECT COUNT(*) FROM work_logs), version()
+        """)
+        sales, sale_items, inventory, promotions, logs, version = cursor.fetchone()
+        conn.commit()
+        results = explain_all(conn)
+    finally:
+        conn.close()
+
+    lines = [
+        '# 热点查询执行计划基线（benchmarks/explain_baseline.py 生成）',
+        f'# 数据库: {version}',
+        f'# 数据量: sales={sales} sale_items={sale_items} inventory={inventory} '
+        f'promotions={promotions} work_logs={logs}',
+        '',
+    ]
+    for name, plan, big_scans, rejected in results:
+        if rejected:
+            tag = f"[顺序扫描大表: {', '.join(rejected)}]"
+        elif big_scans:
+            tag = f"[允许的顺序扫描: {', '.join(big_scans)}]"
+        else:
+            tag = '[通过]'
+        lines.append(f"== {name} {tag}")
+        lines.append(plan)
+        lines.append('')
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+    failed = [f"{name}（{', '.join(rejected)}）" for name, _, _, rejected in results if rejected]
+    print(f"✅ 已写入 {args.output}，{len(results) - len(failed)}/{len(results)} 条查询通过顺序扫描检查")
+    if failed:
+        print('❌ 顺序扫描大表: ' + '，'.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
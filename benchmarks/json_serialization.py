@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+JSON序列化压测：对比改造前的逐行字典 + pytz/strftime + Flask 默认 JSON 提供器，与 RowSet + FastJSONProvider
+
+使用构造的 /api/inventory/ 和 /api/sales/ 响应数据（不连接数据库），
+计时范围为“查询结果行 -> 响应字节串”，包括行格式化、序列化和生成 Response。
+改造前的路径完整保留在本文件中（legacy_*），不调用 complete_server.py 中已经改写的函数。
+改造后分两列：时间在Python中格式化（关闭 LOCAL_TIME_IN_SQL），以及数据库直接返回时间文本（默认）；
+后者把时区转换移到了数据库，数据库侧的开销见 benchmarks/datetime_formatting.py --db。
+
+用法:
+    python benchmarks/json_serialization.py --rows 5000 --repeat 20
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask.json.provider import DefaultJSONProvider
+
+import complete_server as server
+
+
+def make_rows(count):
+    """构造与数据库查询结果相同类型的行（Decimal 价格、带时区的时间）"""
+    now = datetime.now(timezone.utc)
+    inventory = [
+        (i, i, 1 + i % 20, i % 300, Decimal('12.50') + i % 7, f'商品{i}', f'门店{1 + i % 20}',
+         now - timedelta(minutes=i), f'SKU{i:06d}')
+        for i in range(count)
+    ]
+    prices = [(Decimal('11.25') + i % 7, (i % 50) or None) for i in range(count)]
+    sales = [
+        (i, 1 + i % 20, Decimal('88.80') + i % 13, now - timedelta(seconds=i * 37),
+         f'门店{1 + i % 20}', f'收银员{i % 40}')
+        for i in range(count)
+    ]
+    return inventory, prices, sales
+
+
+def legacy_format_datetime(dt):
+    """改造前的 format_datetime_with_timezone：每次调用都查找时区并 strftime"""
+    if dt is None:
+        return None
+    
+    # 如果datetime对象没有时区信息，假设它是UTC
+    if dt.tzinfo is None:
+        dt = pytz.UTC.localize(dt)
+    
+    # 转换为北京时间
+    beijing_tz = pytz.timezone('Asia/Shanghai')
+    beijing_time = dt.astimezone(beijing_tz)
+    
+    # 格式化为字符串
+    return beijing_time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def legacy_inventory(rows, prices):
+    """改造前的库存行格式化：逐行构建字典并手工转换类型（字段与现在的响应相同）"""
+    return [{
+        'inventory_id': item[0],
+        'product_id': item[1],
+        'store_id': item[2],
+        'quantity': item[3],
+        'original_price': float(item[4]) if item[4] else 0,
+        'price': float(final_price),
+        'has_promotion': promotion_id is not None,
+        'promotion_id': promotion_id,
+        'product_name': item[5],
+        'name': item[5],
+        'product_sku': item[8],
+        'store_name': item[6],
+        'updated_at': legacy_format_datetime(item[7]) if item[7] else None
+    } for item, (final_price, promotion_id) in zip(rows, prices)]
+
+
+def legacy_sales(rows):
+    sales_list = []
+    for sale in rows:
+        timestamp_str = legacy_format_datetime(sale[3])
+        sales_list.append({
+            'sale_id': sale[0],
+            'store_id': sale[1],
+            'total_amount': float(sale[2]) if sale[2] else 0,
+            'sale_date': timestamp_str,
+            'sale_timestamp': timestamp_str,
+            'store_name': sale[4],
+            'user_name': sale[5],
+            'cashier_name': sale[5]
+        })
+    return sales_list
+
+
+def rowset_inventory(rows, prices):
+    """与 format_inventory_rows 相同的行构建，价格已由定价引擎算好
+
+    按关闭 LOCAL_TIME_IN_SQL 的情况计时：时间在Python中格式化（开启时由数据库返回文本）
+    """
+    format_local_datetime = server.format_local_datetime
+    return server.RowSet(server.INVENTORY_COLUMNS, [
+        (item[0], item[1], item[2], item[3], float(item[4] or 0), float(final_price),
+         promotion_id is not None, promotion_id, item[5], item[5], item[8], item[6],
+         format_local_datetime(item[7]) if item[7] else None)
+        for item, (final_price, promotion_id) in zip(rows, prices)
+    ])
+
+
+def rowset_sales(rows):
+    """与 get_sales 相同的行构建（时间在Python中格式化）"""
+    format_local_datetime = server.format_local_datetime
+    return server.RowSet(server.SALES_LIST_COLUMNS, [
+        (sale[0], sale[1], float(sale[2]), (local_time := format_local_datetime(sale[3])), local_time,
+         sale[4], sale[5], sale[5])
+        for sale in rows
+    ])
+
+
+def sql_time_rows(inventory, sales):
+    """开启 LOCAL_TIME_IN_SQL 时数据库返回的行：时间列已是北京时间文本"""
+    return ([item[:7] + (server.format_local_datetime(item[7]),) + item[8:] for item in inventory],
+            [sale[:3] + (server.format_local_datetime(sale[3]),) + sale[4:] for sale in sales])
+
+
+def rowset_inventory_sql_time(rows, prices):
+    """与 format_inventory_rows 完全相同：时间文本原样输出"""
+    return server.RowSet(server.INVENTORY_COLUMNS, [
+        (item[0], item[1], item[2], item[3], float(item[4] or 0), float(final_price),
+         promotion_id is not None, promotion_id, item[5], item[5], item[8], item[6], item[7])
+        for item, (final_price, promotion_id) in zip(rows, prices)
+    ])
+
+
+def rowset_sales_sql_time(rows):
+    return server.RowSet(server.SALES_LIST_COLUMNS, [
+        (sale[0], sale[1], float(sale[2]), sale[3], sale[3], sale[4], sale[5], sale[5])
+        for sale in rows
+    ])
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON序列化压测')
+    parser.add_argument('--rows', type=int, default=5000, help='每个响应的行数')
+    parser.add_argument('--repeat', type=int, default=20, help='重复次数，取最快一次')
+    args = parser.parse_args()
+
+    inventory, prices, sales = make_rows(args.rows)
+    sql_inventory, sql_sales = sql_time_rows(inventory, sales)
+    # 改造前处理函数返回 dict，由 Flask 默认 JSON 提供器生成响应
+    legacy_provider = DefaultJSONProvider(server.app)
+    legacy_response = lambda obj: legacy_provider.response(obj).get_data()
+    fast_response = lambda obj: server.app.json.response(obj).get_data()
+
+    cases = [
+        ('/api/inventory/',
+         lambda: legacy_response({'inventory': legacy_inventory(inventory, prices)}),
+         lambda: fast_response({'inventory': rowset_inventory(inventory, prices)}),
+         lambda: fast_response({'inventory': rowset_inventory_sql_time(sql_inventory, prices)})),
+        ('/api/sales/',
+         lambda: legacy_response({'sales': legacy_sales(sales)}),
+         lambda: fast_response({'sales': rowset_sales(sales)}),
+         lambda: fast_response({'sales': rowset_sales_sql_time(sql_sales)})),
+    ]
+
+    # 三种方式输出的内容必须一致（Flask 默认转义非ASCII字符，比较解析后的对象）
+    for _, legacy, fast, sql_time in cases:
+        expected = server.app.json.loads(legacy())
+        assert expected == server.app.json.loads(fast()) == server.app.json.loads(sql_time()), '序列化结果不一致'
+
+    print(f"JSON后端: {'orjson' if server.orjson is not None else '标准库 json'}，每个响应 {args.rows} 行")
+    print(f"{'响应':<18}{'改造前(ms)':>12}{'Python时间(ms)':>16}{'提升':>8}{'SQL时间(ms)':>14}{'提升':>8}")
+    for name, legacy, fast, sql_time in cases:
+        legacy_time = best_of(legacy, args.repeat)
+        fast_time = best_of(fast, args.repeat)
+        sql_time_time = best_of(sql_time, args.repeat)
+        print(f"{name:<18}{legacy_time * 1000:>12.2f}{fast_time * 1000:>16.2f}{legacy_time / fast_time:>7.1f}x"
+              f"{sql_time_time * 1000:>14.2f}{legacy_time / sql_time_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -5,15 +5,36 @@
 支持用户认证、门店管理、商品管理、库存管理、销售管理等全部功能
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, make_response, has_app_context, has_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 from datetime import timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 import psycopg2
-from datetime import datetime, date
-import pytz
+from psycopg2 import errorcodes
+from datetime import datetime, date, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from functools import wraps
 import sys
+import os
+import random
+import hashlib
+import json
+import csv
+import io
+import base64
+import binascii
+import re
+import queue
+import atexit
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库 json
+    orjson = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'dev-secret-key'
@@ -24,459 +45,928 @@ CORS(app)
 jwt = JWTManager(app)
 
 # 时区转换函数
+# 北京时间固定为 UTC+8（1991年后没有夏令时），全局只创建一次，比 pytz 按日期查表快得多
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+def business_today():
+    """当前营业日期（北京时间），促销生效、销售日汇总、仪表盘统一按它计算"""
+    return datetime.now(BEIJING_TZ).date()
+
+def format_local_datetime(dt):
+    """将时间转换为北京时间并格式化为 YYYY-MM-DD HH:MM:SS，无时区的时间按UTC处理"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(BEIJING_TZ).isoformat(' ', 'seconds')[:19]
+
 def format_datetime_with_timezone(dt):
     """将UTC时间转换为北京时间并格式化"""
     if dt is None:
         return None
-    
-    # 如果datetime对象没有时区信息，假设它是UTC
-    if dt.tzinfo is None:
-        dt = pytz.UTC.localize(dt)
-    
-    # 转换为北京时间
-    beijing_tz = pytz.timezone('Asia/Shanghai')
-    beijing_time = dt.astimezone(beijing_tz)
-    
-    # 格式化为字符串
-    return beijing_time.strftime('%Y-%m-%d %H:%M:%S')
-
-# 数据库连接函数
-def get_db_connection():
-    return psycopg2.connect(
-        host='localhost',
-        port=5432,
-        database='postgres',
-        user='gaussdb',
-        password='Lxh@26957'
-    )
+    return format_local_datetime(dt)
 
-def log_action(user_id, action, details, conn=None):
-    """记录用户操作日志"""
-    try:
-        close_conn = False
-        if conn is None:
-            conn = get_db_connection()
-            close_conn = True
-        
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO work_logs (user_id, action, details) VALUES (%s, %s, %s)",
-            (user_id, action, details)
-        )
-        
-        if close_conn:
-            conn.commit()
+# 列表接口的时间列默认由数据库转换为北京时间文本，关闭后在Python中格式化
+app.config['LOCAL_TIME_IN_SQL'] = os.getenv('LOCAL_TIME_IN_SQL', '1') != '0'
+
+def local_time_sql(column):
+    """时间列的SELECT表达式：数据库直接返回北京时间文本，关闭 LOCAL_TIME_IN_SQL 时返回原列"""
+    if app.config['LOCAL_TIME_IN_SQL']:
+        return f"to_char({column} AT TIME ZONE 'Asia/Shanghai', 'YYYY-MM-DD HH24:MI:SS')"
+    return column
+
+# ==================== JSON序列化 ====================
+class RowSet:
+    """查询结果行 + 列名，序列化为对象列表
+
+    处理函数可以直接返回 RowSet(列名, 行元组列表)，不必逐行构建字典；
+    Decimal、日期时间由 json_default 统一转换。
+    """
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_dicts(self):
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+def fetch_rowset(cursor):
+    """列表接口共用的行格式化：查询结果直接包装为 RowSet，键名取自 SELECT 的列名/别名"""
+    return RowSet(tuple(column[0] for column in cursor.description), cursor.fetchall())
+
+def json_default(obj):
+    """Decimal 转为数值，带时区的时间转为北京时间字符串，日期转为 YYYY-MM-DD"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, datetime):
+        return format_local_datetime(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, RowSet):
+        return obj.to_dicts()
+    raise TypeError(f'无法序列化 {type(obj).__name__} 类型')
+
+if orjson is not None:
+    # 与 Flask 默认行为一致按键排序；时间交给 json_default 按北京时间格式化
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def json_dumps_bytes(obj, indent=False):
+    """序列化为 UTF-8 JSON 字节串（优先使用 orjson）"""
+    if orjson is not None:
+        option = ORJSON_OPTIONS | orjson.OPT_INDENT_2 if indent else ORJSON_OPTIONS
+        return orjson.dumps(obj, default=json_default, option=option)
+    return json.dumps(obj, default=json_default, ensure_ascii=False, sort_keys=True,
+                      indent=2 if indent else None, separators=None if indent else (',', ':')).encode('utf-8')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """处理函数返回的 dict/list 及 jsonify 都经过这里，直接输出字节串"""
+    default = staticmethod(json_default)
+    ensure_ascii = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=json_default, option=ORJSON_OPTIONS).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(json_dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+# 数据库连接参数（可通过环境变量覆盖）
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'port': int(os.getenv('DB_PORT', 5432)),
+    'database': os.getenv('DB_NAME', 'postgres'),
+    'user': os.getenv('DB_USER', 'gaussdb'),
+    'password': os.getenv('DB_PASSWORD', 'Lxh@26957')
+}
+
+# 连接池配置
+app.config['DB_POOL_MIN_SIZE'] = int(os.getenv('DB_POOL_MIN_SIZE', 2))              # 保留的最少空闲连接数
+app.config['DB_POOL_MAX_SIZE'] = int(os.getenv('DB_POOL_MAX_SIZE', 20))             # 最大连接数
+app.config['DB_POOL_MAX_LIFETIME'] = int(os.getenv('DB_POOL_MAX_LIFETIME', 1800))   # 连接最长存活时间（秒）
+app.config['DB_POOL_IDLE_TIMEOUT'] = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))    # 空闲连接回收时间（秒）
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 10))             # 借用连接的最长等待时间（秒）
+app.config['DB_POOL_HEALTH_CHECK_INTERVAL'] = int(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', 30))  # 空闲超过该秒数的连接借出前先探活
+
+class PoolTimeoutError(psycopg2.OperationalError):
+    """连接池已满且在等待时间内没有连接被归还"""
+
+class _PoolEntry:
+    """连接池内部记录：原始连接及其创建/最近使用时间"""
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+class PooledConnection:
+    """从连接池借出的连接，close() 时归还给连接池而不是断开"""
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._return(entry)
+
+    @property
+    def closed(self):
+        return self._entry is None or bool(self._entry.conn.closed)
+
+    @property
+    def returned(self):
+        """是否已经归还连接池（底层连接断开但未 close() 时仍占用连接池名额）"""
+        return self._entry is None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._entry is None:
+            raise psycopg2.InterfaceError('连接已归还连接池')
+        return getattr(self._entry.conn, name)
+
+class ConnectionPool:
+    """线程安全的 psycopg2 连接池
+
+    支持最小/最大连接数、连接最长存活时间、空闲回收和借出前健康检查，
+    stats() 返回的计数用于评估连接池大小是否合适。
+    """
+
+    def __init__(self, connect_kwargs, min_size=2, max_size=20, max_lifetime=1800,
+                 idle_timeout=300, timeout=10, health_check_interval=30):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('连接池大小配置无效')
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._idle = []  # 后进先出，多余的空闲连接自然老化回收
+        self._size = 0   # 已打开的连接数（空闲 + 借出）
+        self._counters = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_ms': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'max_in_use': 0
+        }
+
+    def open(self):
+        """预先建立 min_size 个连接"""
+        with self._cond:
+            needed = max(0, self.min_size - self._size)
+            self._size += needed
+        entries = []
+        try:
+            for _ in range(needed):
+                entries.append(self._connect())
+        finally:
+            with self._cond:
+                self._size -= needed - len(entries)
+                self._idle.extend(entries)
+                self._cond.notify_all()
+
+    def getconn(self):
+        """借出一个连接；连接池已满时最多等待 timeout 秒"""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        wait_started = None
+        while True:
+            with self._cond:
+                stale = self._prune_locked()
+                entry = None
+                reserved = False
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        reserved = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeoutError(f'数据库连接池已耗尽（max_size={self.max_size}）')
+                    if not waited:
+                        waited = True
+                        wait_started = time.monotonic()
+                        self._counters['waits'] += 1
+                    self._cond.wait(remaining)
+            self._close_entries(stale)
+
+            if reserved:
+                try:
+                    entry = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._check(entry):
+                self._discard(entry)
+                continue
+
+            entry.last_used = time.monotonic()
+            with self._cond:
+                self._counters['checkouts'] += 1
+                if waited:
+                    self._counters['wait_time_ms'] += (time.monotonic() - wait_started) * 1000
+                in_use = self._size - len(self._idle)
+                if in_use > self._counters['max_in_use']:
+                    self._counters['max_in_use'] = in_use
+            return PooledConnection(self, entry)
+
+    def stats(self):
+        """连接池运行状态"""
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size
+            })
+        stats['wait_time_ms'] = round(stats['wait_time_ms'], 2)
+        return stats
+
+    def close_all(self):
+        """关闭所有空闲连接（借出的连接归还时会重新入池）"""
+        with self._cond:
+            entries, self._idle = self._idle, []
+            self._size -= len(entries)
+        self._close_entries(entries)
+
+    def reset_after_fork(self):
+        """在 fork 出的子进程（如 gunicorn worker）中调用，重置锁和计数
+
+        父进程应在 fork 前 close_all()：从父进程继承的连接与父进程共用套接字，
+        子进程不能使用也不能关闭它们，这里只丢弃引用。
+        """
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._counters = dict.fromkeys(self._counters, 0)
+        self._counters['wait_time_ms'] = 0.0
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._cond:
+            self._counters['connections_created'] += 1
+        return _PoolEntry(conn)
+
+    def _expired(self, entry, now):
+        return self.max_lifetime > 0 and now - entry.created_at >= self.max_lifetime
+
+    def _check(self, entry):
+        """借出前检查：已断开或超过存活时间的连接丢弃，空闲较久的连接先执行 SELECT 1 探活"""
+        now = time.monotonic()
+        if entry.conn.closed or self._expired(entry, now):
+            return False
+        if now - entry.last_used < self.health_check_interval:
+            return True
+        try:
+            cursor = entry.conn.cursor()
+            cursor.execute('SELECT 1')
             cursor.close()
+            entry.conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._counters['health_check_failures'] += 1
+            return False
+
+    def _return(self, entry):
+        conn = entry.conn
+        try:
+            if not conn.closed:
+                # 归还前回滚未提交的事务，保证下一个借用者拿到干净的连接
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+        except psycopg2.Error:
+            pass
+        if conn.closed or self._expired(entry, time.monotonic()):
+            self._discard(entry)
+            return
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def _discard(self, entry):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        self._close_entries([entry])
+
+    def _prune_locked(self):
+        """取出需要回收的空闲连接（超过存活时间，或空闲超时且连接数多于 min_size）"""
+        now = time.monotonic()
+        keep, stale = [], []
+        for entry in self._idle:
+            idle_too_long = (self.idle_timeout > 0 and now - entry.last_used >= self.idle_timeout
+                             and self._size - len(stale) > self.min_size)
+            if self._expired(entry, now) or idle_too_long:
+                stale.append(entry)
+            else:
+                keep.append(entry)
+        if stale:
+            self._idle = keep
+            self._size -= len(stale)
+        return stale
+
+    def _close_entries(self, entries):
+        for entry in entries:
+            try:
+                entry.conn.close()
+            except psycopg2.Error:
+                pass
+        if entries:
+            with self._cond:
+                self._counters['connections_closed'] += len(entries)
+
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    min_size=app.config['DB_POOL_MIN_SIZE'],
+    max_size=app.config['DB_POOL_MAX_SIZE'],
+    max_lifetime=app.config['DB_POOL_MAX_LIFETIME'],
+    idle_timeout=app.config['DB_POOL_IDLE_TIMEOUT'],
+    timeout=app.config['DB_POOL_TIMEOUT'],
+    health_check_interval=app.config['DB_POOL_HEALTH_CHECK_INTERVAL']
+)
+
+# 数据库连接函数（从连接池借出，conn.close() 即归还）
+def get_db_connection(outlive_request=False):
+    """从连接池借出连接，用完必须 close() 归还
+
+    请求中借出的连接记录在 g.db_checkouts，请求结束时 release_db 归还其中未归还的连接并打印出来；
+    响应发送期间还要使用的连接（流式导出）传 outlive_request=True，由调用方负责归还。
+    """
+    conn = db_pool.getconn()
+    if not outlive_request and has_app_context():
+        where = f"{request.method} {request.path}" if has_request_context() else '应用上下文'
+        g.setdefault('db_checkouts', []).append((conn, where))
+    return conn
+
+def get_db():
+    """获取当前请求绑定的数据库连接
+
+    同一请求内的处理函数共用这一个连接，请求结束时由
+    release_db() 统一归还连接池，未提交的事务会被回滚。
+    """
+    conn = g.get('db_conn')
+    if conn is None:
+        conn = g.db_conn = db_pool.getconn()
+    return conn
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    """请求结束：把请求连接归还连接池（未提交的事务由连接池回滚），并归还处理函数忘记 close() 的连接"""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        conn.close()
+    for conn, where in g.pop('db_checkouts', []):
+        if not conn.returned:
+            app.logger.warning("%s 借出的数据库连接没有 close()，请求结束时自动归还", where)
             conn.close()
-    except Exception as e:
-        print(f"记录日志失败: {str(e)}")
 
-# 初始化所有数据库表
-def init_all_tables():
-    """创建所有必要的数据库表"""
-    conn = get_db_connection()
+def _insert_work_logs(conn, logs):
+    """一条多行INSERT写入日志，logs 为 (user_id, action, details, timestamp)"""
     cursor = conn.cursor()
-    
-    tables_sql = """
-    -- 门店表 (stores)
-    CREATE TABLE IF NOT EXISTS stores (
-        store_id SERIAL PRIMARY KEY,
-        name VARCHAR(100) NOT NULL,
-        address VARCHAR(255),
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    -- 用户表 (users)
-    CREATE TABLE IF NOT EXISTS users (
-        user_id SERIAL PRIMARY KEY,
-        username VARCHAR(50) UNIQUE NOT NULL,
-        password_hash VARCHAR(255) NOT NULL,
-        role VARCHAR(20) NOT NULL CHECK (role IN ('system_admin', 'store_manager', 'cashier')),
-        store_id INT,
-        FOREIGN KEY (store_id) REFERENCES stores(store_id)
-    );
-    
-    -- 员工工作日志表 (work_logs)
-    CREATE TABLE IF NOT EXISTS work_logs (
-        log_id SERIAL PRIMARY KEY,
-        user_id INT NOT NULL,
-        action VARCHAR(100) NOT NULL,
-        details TEXT,
-        timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    );
-    
-    -- 商品分类表 (product_categories)
-    CREATE TABLE IF NOT EXISTS product_categories (
-        category_id SERIAL PRIMARY KEY,
-        name VARCHAR(100) NOT NULL UNIQUE,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    -- 供应商表 (suppliers)
-    CREATE TABLE IF NOT EXISTS suppliers (
-        supplier_id SERIAL PRIMARY KEY,
-        name VARCHAR(100) NOT NULL,
-        contact_info TEXT,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    -- 商品表 (products)
-    CREATE TABLE IF NOT EXISTS products (
-        product_id SERIAL PRIMARY KEY,
-        sku VARCHAR(50) UNIQUE NOT NULL,
-        name VARCHAR(100) NOT NULL,
-        description TEXT,
-        category_id INT,
-        supplier_id INT,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (category_id) REFERENCES product_categories(category_id),
-        FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id)
-    );
-    
-    -- 库存表 (inventory)
-    CREATE TABLE IF NOT EXISTS inventory (
-        inventory_id SERIAL PRIMARY KEY,
-        product_id INT NOT NULL,
-        store_id INT NOT NULL,
-        quantity INT NOT NULL CHECK (quantity >= 0),
-        price DECIMAL(10, 2) NOT NULL,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (product_id) REFERENCES products(product_id),
-        FOREIGN KEY (store_id) REFERENCES stores(store_id),
-        UNIQUE (product_id, store_id)
-    );
-    
-    -- 促销活动表 (promotions)
-    CREATE TABLE IF NOT EXISTS promotions (
-        promotion_id SERIAL PRIMARY KEY,
-        name VARCHAR(100) NOT NULL,
-        description TEXT,
-        discount_type VARCHAR(20) NOT NULL CHECK (discount_type IN ('percentage', 'fixed')),
-        discount_value DECIMAL(10, 2) NOT NULL,
-        start_date DATE NOT NULL,
-        end_date DATE NOT NULL,
-        store_id INT,
-        created_by INT,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (store_id) REFERENCES stores(store_id),
-        FOREIGN KEY (created_by) REFERENCES users(user_id)
-    );
-    
-    -- 促销商品关联表 (promotion_items)
-    CREATE TABLE IF NOT EXISTS promotion_items (
-        id SERIAL PRIMARY KEY,
-        promotion_id INT NOT NULL,
-        product_id INT NOT NULL,
-        FOREIGN KEY (promotion_id) REFERENCES promotions(promotion_id),
-        FOREIGN KEY (product_id) REFERENCES products(product_id)
-    );
-    
-    -- 销售单主表 (sales)
-    CREATE TABLE IF NOT EXISTS sales (
-        sale_id SERIAL PRIMARY KEY,
-        store_id INT NOT NULL,
-        cashier_id INT NOT NULL,
-        sale_timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        total_amount DECIMAL(10, 2) NOT NULL,
-        FOREIGN KEY (store_id) REFERENCES stores(store_id),
-        FOREIGN KEY (cashier_id) REFERENCES users(user_id)
-    );
-    
-    -- 销售单详情表 (sale_items)
-    CREATE TABLE IF NOT EXISTS sale_items (
-        item_id SERIAL PRIMARY KEY,
-        sale_id INT NOT NULL,
-        product_id INT NOT NULL,
-        quantity INT NOT NULL,
-        price_per_unit DECIMAL(10, 2) NOT NULL,
-        FOREIGN KEY (sale_id) REFERENCES sales(sale_id),
-        FOREIGN KEY (product_id) REFERENCES products(product_id)
-    );
-    """
-    
-    cursor.execute(tables_sql)
-    
-    # 为现有表添加时间字段（如果不存在）
-    alter_tables_sql = """
-    -- 为stores表添加时间字段
-    DO $$ 
-    BEGIN 
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='stores' AND column_name='created_at') THEN
-            ALTER TABLE stores ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='stores' AND column_name='updated_at') THEN
-            ALTER TABLE stores ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-    END $$;
-    
-    -- 为product_categories表添加时间字段
-    DO $$ 
-    BEGIN 
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='product_categories' AND column_name='created_at') THEN
-            ALTER TABLE product_categories ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='product_categories' AND column_name='updated_at') THEN
-            ALTER TABLE product_categories ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-    END $$;
-    
-    -- 为suppliers表添加时间字段
-    DO $$ 
-    BEGIN 
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='suppliers' AND column_name='created_at') THEN
-            ALTER TABLE suppliers ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='suppliers' AND column_name='updated_at') THEN
-            ALTER TABLE suppliers ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-    END $$;
-    
-    -- 为products表添加时间字段
-    DO $$ 
-    BEGIN 
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='created_at') THEN
-            ALTER TABLE products ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='updated_at') THEN
-            ALTER TABLE products ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-    END $$;
-    
-    -- 为inventory表添加时间字段
-    DO $$ 
-    BEGIN 
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='inventory' AND column_name='created_at') THEN
-            ALTER TABLE inventory ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='inventory' AND column_name='updated_at') THEN
-            ALTER TABLE inventory ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-    END $$;
-    
-    -- 为promotions表添加门店和创建者字段
-    DO $$ 
-    BEGIN 
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotions' AND column_name='store_id') THEN
-            ALTER TABLE promotions ADD COLUMN store_id INT;
-        END IF;
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotions' AND column_name='created_by') THEN
-            ALTER TABLE promotions ADD COLUMN created_by INT;
-        END IF;
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotions' AND column_name='created_at') THEN
-            ALTER TABLE promotions ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-    END $$;
+    cursor.execute(
+        "INSERT INTO work_logs (user_id, action, details, timestamp) VALUES "
+        + ','.join(cursor.mogrify('(%s, %s, %s, %s)', log).decode('utf-8') for log in logs)
+    )
+
+def values_list(cursor, template, rows):
+    """把多行参数渲染为 VALUES 列表，供一条语句批量读写使用
+
+    返回的SQL片段已转义 %，可以直接拼接进还带有其他 %s 参数的语句。
     """
-    
-    cursor.execute(alter_tables_sql)
-    
-    # 修复现有用户的门店ID问题
-    fix_users_sql = """
-    -- 为没有门店ID的用户分配默认门店ID（1）
-    UPDATE users SET store_id = 1 WHERE store_id IS NULL AND role IN ('cashier', 'store_manager', 'system_admin');
+    return ','.join(cursor.mogrify(template, row).decode('utf-8') for row in rows).replace('%', '%%')
+
+# 事务重试配置：序列化失败和死锁时回滚后指数退避重试
+app.config['DB_RETRY_ATTEMPTS'] = int(os.getenv('DB_RETRY_ATTEMPTS', 3))
+app.config['DB_RETRY_BACKOFF'] = float(os.getenv('DB_RETRY_BACKOFF', 0.02))        # 首次重试等待（秒）
+app.config['DB_RETRY_BACKOFF_MAX'] = float(os.getenv('DB_RETRY_BACKOFF_MAX', 0.5))  # 单次等待上限（秒）
+
+RETRYABLE_PGCODES = {errorcodes.SERIALIZATION_FAILURE, errorcodes.DEADLOCK_DETECTED}
+
+class CheckoutConflict(Exception):
+    """结账时实际扣减的库存行数与购物车不一致（库存在加锁后仍被并发修改），回滚后整单重试"""
+
+def run_in_transaction(work, *args):
+    """在请求连接上执行 work(conn, *args)，序列化失败/死锁/结账冲突时回滚并有限次重试
+
+    work 负责提交事务；抛出异常时这里统一回滚。重试次数用完后抛出最后一次的异常。
     """
-    
-    cursor.execute(fix_users_sql)
-    
-    # 修复work_logs表结构问题
-    fix_work_logs_sql = """
-    -- 检查并修复work_logs表结构
-    DO $$ 
-    BEGIN 
-        -- 如果action字段不存在，则添加它
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='work_logs' AND column_name='action') THEN
-            ALTER TABLE work_logs ADD COLUMN action VARCHAR(100);
-        END IF;
-        
-        -- 如果details字段不存在，则添加它
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='work_logs' AND column_name='details') THEN
-            ALTER TABLE work_logs ADD COLUMN details TEXT;
-        END IF;
-        
-        -- 如果timestamp字段不存在，则添加它
-        IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='work_logs' AND column_name='timestamp') THEN
-            ALTER TABLE work_logs ADD COLUMN timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
-        END IF;
-    END $$;
+    conn = get_db()
+    attempts = max(1, app.config['DB_RETRY_ATTEMPTS'])
+    for attempt in range(attempts):
+        try:
+            return work(conn, *args)
+        except (psycopg2.Error, CheckoutConflict) as e:
+            conn.rollback()
+            if isinstance(e, CheckoutConflict):
+                app.logger.warning("结账冲突（第%s/%s次）: %s", attempt + 1, attempts, e)
+                retryable = True
+            else:
+                retryable = e.pgcode in RETRYABLE_PGCODES or isinstance(e, psycopg2.extensions.TransactionRollbackError)
+            if not retryable or attempt == attempts - 1:
+                raise
+            delay = min(app.config['DB_RETRY_BACKOFF'] * (2 ** attempt), app.config['DB_RETRY_BACKOFF_MAX'])
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+# ==================== 操作日志 ====================
+app.config['AUDIT_LOG_QUEUE_SIZE'] = int(os.getenv('AUDIT_LOG_QUEUE_SIZE', 10000))          # 内存队列上限（条）
+app.config['AUDIT_LOG_BATCH_SIZE'] = int(os.getenv('AUDIT_LOG_BATCH_SIZE', 200))            # 攒够该条数立即写入
+app.config['AUDIT_LOG_FLUSH_INTERVAL_MS'] = int(os.getenv('AUDIT_LOG_FLUSH_INTERVAL_MS', 500))  # 最长攒批时间
+app.config['AUDIT_LOG_ENQUEUE_TIMEOUT_MS'] = int(os.getenv('AUDIT_LOG_ENQUEUE_TIMEOUT_MS', 0))  # 队列满时最多等待，0为直接丢弃
+app.config['AUDIT_LOG_MAX_RETRIES'] = int(os.getenv('AUDIT_LOG_MAX_RETRIES', 5))            # 数据库不可用时一批日志的重试次数
+
+class AuditLogWriter:
+    """后台批量写入操作日志
+
+    请求线程只把日志放入有界队列；后台线程每攒够 batch_size 条或每隔
+    flush_interval_ms 用一条多行INSERT写入。队列满时按 enqueue_timeout_ms
+    等待（背压），仍满则丢弃并计数。线程按进程懒启动，fork 后的子进程会
+    重新创建队列和线程；进程退出时尽量写完剩余日志。
     """
-    
-    cursor.execute(fix_work_logs_sql)
-    
-    # 删除工作日志功能和仪表盘功能（如果存在）
-    delete_features_sql = """
-    -- 删除工作日志功能和仪表盘功能
-    DELETE FROM role_permissions WHERE feature_id IN (
-        SELECT feature_id FROM system_features WHERE feature_code IN ('work_log_management', 'dashboard_view')
-    );
-    DELETE FROM system_features WHERE feature_code IN ('work_log_management', 'dashboard_view');
+
+    def __init__(self, queue_size, batch_size, flush_interval_ms, enqueue_timeout_ms, max_retries):
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.enqueue_timeout = enqueue_timeout_ms / 1000.0
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopping = None
+        self._counters = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped_queue_full': 0,
+            'dropped_write_failed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0
+        }
+        self._last_drop_warning = 0.0
+
+    def submit(self, user_id, action, details):
+        """放入一条日志，不访问数据库；返回是否成功入队"""
+        self._ensure_started()
+        record = (user_id, action, details, datetime.now(timezone.utc))
+        try:
+            if self.enqueue_timeout > 0:
+                self._queue.put(record, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._counters['dropped_queue_full'] += 1
+                warn = time.monotonic() - self._last_drop_warning > 10
+                if warn:
+                    self._last_drop_warning = time.monotonic()
+            if warn:
+                app.logger.warning("操作日志队列已满，丢弃日志: %s", action)
+            return False
+        with self._lock:
+            self._counters['enqueued'] += 1
+        return True
+
+    def flush(self, timeout=5.0):
+        """等待队列中已有的日志写完（用于退出前和脚本）"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout=5.0):
+        """停止后台线程，退出前写完剩余日志"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+        data['queue_depth'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        data['queue_size'] = self.queue_size
+        return data
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        log_queue, stopping = self._queue, self._stopping
+        while True:
+            try:
+                batch = [log_queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if stopping.is_set():
+                    return
+                continue
+            # 攒批：凑够 batch_size 条或到达刷新间隔
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or stopping.is_set():
+                    try:
+                        batch.append(log_queue.get_nowait())
+                        continue
+                    except queue.Empty:
+                        break
+                try:
+                    batch.append(log_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch, stopping)
+            for _ in batch:
+                log_queue.task_done()
+
+    def _write(self, batch, stopping):
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                self._insert(batch)
+                with self._lock:
+                    self._counters['written'] += len(batch)
+                    self._counters['flushes'] += 1
+                    self._counters['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                return
+            except psycopg2.IntegrityError:
+                # 个别日志违反约束（如用户已删除），逐条写入并丢弃坏数据
+                self._insert_each(batch)
+                return
+            except Exception as e:
+                with self._lock:
+                    self._counters['flush_errors'] += 1
+                app.logger.warning("写入操作日志失败（第%s次）: %s", attempt + 1, e)
+                if stopping.is_set() or attempt == self.max_retries:
+                    break
+                time.sleep(min(0.5 * (2 ** attempt), 10))
+        with self._lock:
+            self._counters['dropped_write_failed'] += len(batch)
+
+    def _insert(self, batch):
+        conn = get_db_connection()
+        try:
+            _insert_work_logs(conn, batch)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _insert_each(self, batch):
+        written = failed = 0
+        for record in batch:
+            try:
+                self._insert([record])
+                written += 1
+            except Exception as e:
+                failed += 1
+                app.logger.error("丢弃无法写入的操作日志: %s", e)
+        with self._lock:
+            self._counters['written'] += written
+            self._counters['dropped_write_failed'] += failed
+            self._counters['flushes'] += 1
+
+audit_log_writer = AuditLogWriter(
+    queue_size=app.config['AUDIT_LOG_QUEUE_SIZE'],
+    batch_size=app.config['AUDIT_LOG_BATCH_SIZE'],
+    flush_interval_ms=app.config['AUDIT_LOG_FLUSH_INTERVAL_MS'],
+    enqueue_timeout_ms=app.config['AUDIT_LOG_ENQUEUE_TIMEOUT_MS'],
+    max_retries=app.config['AUDIT_LOG_MAX_RETRIES']
+)
+atexit.register(audit_log_writer.close)
+
+def log_action(user_id, action, details, conn=None):
+    """记录用户操作日志
+
+    传入 conn 时日志随调用方的事务一起提交；否则交给后台写入线程，
+    不占用请求线程的数据库时间。
     """
+    try:
+        if conn is not None:
+            _insert_work_logs(conn, [(user_id, action, details, datetime.now(timezone.utc))])
+        else:
+            audit_log_writer.submit(user_id, action, details)
+    except Exception as e:
+        print(f"记录日志失败: {str(e)}")
+
+# 令牌版本缓存配置（秒）：角色/门店变更最迟在该时间后对其他进程生效
+app.config['TOKEN_VERSION_CACHE_TTL'] = int(os.getenv('TOKEN_VERSION_CACHE_TTL', 30))
+
+_token_versions = {}  # user_id -> (token_version, 过期时间)
+
+def get_token_version(user_id):
+    """获取用户当前的token_version（短时缓存，用户不存在时返回None）"""
+    now = time.monotonic()
+    cached = _token_versions.get(user_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
     
-    cursor.execute(delete_features_sql)
-    
-    # 创建功能权限管理表
-    permission_tables_sql = """
-    -- 系统功能表 (system_features)
-    CREATE TABLE IF NOT EXISTS system_features (
-        feature_id SERIAL PRIMARY KEY,
-        feature_code VARCHAR(50) UNIQUE NOT NULL,
-        feature_name VARCHAR(100) NOT NULL,
-        description TEXT,
-        module VARCHAR(50) NOT NULL,
-        is_active BOOLEAN DEFAULT TRUE,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    -- 角色权限表 (role_permissions)
-    CREATE TABLE IF NOT EXISTS role_permissions (
-        permission_id SERIAL PRIMARY KEY,
-        role VARCHAR(20) NOT NULL,
-        feature_id INT NOT NULL,
-        can_view BOOLEAN DEFAULT FALSE,
-        can_create BOOLEAN DEFAULT FALSE,
-        can_edit BOOLEAN DEFAULT FALSE,
-        can_delete BOOLEAN DEFAULT FALSE,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (feature_id) REFERENCES system_features(feature_id),
-        UNIQUE (role, feature_id)
-    );
+    cursor = get_db().cursor()
+    cursor.execute("SELECT token_version FROM users WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    version = row[0] if row else None
+    _token_versions[user_id] = (version, now + app.config['TOKEN_VERSION_CACHE_TTL'])
+    return version
+
+def invalidate_token_version(user_id):
+    """用户角色/门店变更或被删除后清除本进程缓存"""
+    _token_versions.pop(user_id, None)
+
+@jwt.token_in_blocklist_loader
+def is_token_revoked(jwt_header, jwt_payload):
+    """缺少角色声明的旧令牌，或令牌版本与服务端不一致时视为失效"""
+    if 'role' not in jwt_payload or 'ver' not in jwt_payload:
+        return True
+    return get_token_version(int(jwt_payload['sub'])) != jwt_payload['ver']
+
+@jwt.revoked_token_loader
+def revoked_token_response(jwt_header, jwt_payload):
+    return jsonify({'message': '登录状态已失效，请重新登录'}), 401
+
+def get_current_user():
+    """从JWT声明中读取当前用户 (user_id, role, store_id)，不查询数据库"""
+    claims = get_jwt()
+    return int(get_jwt_identity()), claims['role'], claims.get('store_id')
+
+# 权限位：role_permissions 的四个布尔列压缩为一个位掩码
+PERMISSION_BITS = {'view': 1, 'create': 2, 'edit': 4, 'delete': 8}
+
+class PermissionMatrix:
+    """进程内缓存的权限矩阵：角色 x 功能代码 -> 权限位掩码
+
+    每次检查先读 role_permissions / system_features 的版本号（见 migrations/0010_permission_versions.sql），
+    版本号未变时直接查字典；任一进程修改权限后版本号递增，所有进程的下一次检查重新加载。
     """
-    
-    cursor.execute(permission_tables_sql)
-    
-    # 初始化系统功能数据
-    init_features_sql = """
-    -- 插入系统功能数据（如果不存在）
-    DO $$
-    BEGIN
-        -- 插入系统功能
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'user_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('user_management', '用户管理', '管理系统用户账号', 'user');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'store_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('store_management', '门店管理', '管理门店信息', 'store');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'category_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('category_management', '分类管理', '管理商品分类', 'category');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'supplier_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('supplier_management', '供应商管理', '管理供应商信息', 'supplier');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'product_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('product_management', '商品管理', '管理商品信息', 'product');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'inventory_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('inventory_management', '库存管理', '管理商品库存', 'inventory');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'promotion_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('promotion_management', '促销管理', '管理促销活动', 'promotion');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'sales_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('sales_management', '销售管理', '查看销售记录', 'sales');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'pos_system') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('pos_system', '收银系统', '收银台操作', 'pos');
-        END IF;
-        
-        IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'permission_management') THEN
-            INSERT INTO system_features (feature_code, feature_name, description, module) 
-            VALUES ('permission_management', '权限管理', '管理角色权限', 'permission');
-        END IF;
-    END $$;
-    
-    -- 为system_admin角色初始化所有权限
-    INSERT INTO role_permissions (role, feature_id, can_view, can_create, can_edit, can_delete)
-    SELECT 'system_admin', feature_id, TRUE, TRUE, TRUE, TRUE
-    FROM system_features
-    WHERE NOT EXISTS (
-        SELECT 1 FROM role_permissions 
-        WHERE role = 'system_admin' AND feature_id = system_features.feature_id
-    );
-    
-    -- 为store_manager角色初始化基本权限
-    INSERT INTO role_permissions (role, feature_id, can_view, can_create, can_edit, can_delete)
-    SELECT 'store_manager', sf.feature_id, 
-        CASE 
-            WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
-            WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
-            ELSE TRUE
-        END,
-        CASE 
-            WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
-            WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
-            WHEN sf.feature_code IN ('sales_management', 'promotion_management') THEN FALSE
-            ELSE TRUE
-        END,
-        CASE 
-            WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
-            WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
-            WHEN sf.feature_code IN ('sales_management', 'promotion_management') THEN FALSE
-            ELSE TRUE
-        END,
-        CASE 
-            WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
-            WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
-            WHEN sf.feature_code IN ('sales_management', 'promotion_management') THEN FALSE
-            WHEN sf.feature_code IN ('product_management') THEN FALSE
-            ELSE TRUE
-        END
-    FROM system_features sf
-    WHERE NOT EXISTS (
-        SELECT 1 FROM role_permissions 
-        WHERE role = 'store_manager' AND feature_id = sf.feature_id
-    );
-    
-    -- 为cashier角色初始化基本权限
-    INSERT INTO role_permissions (role, feature_id, can_view, can_create, can_edit, can_delete)
-    SELECT 'cashier', sf.feature_id,
-        CASE 
-            WHEN sf.feature_code IN ('pos_system', 'inventory_management', 'product_management') THEN TRUE
-            ELSE FALSE
-        END,
-        CASE 
-            WHEN sf.feature_code IN ('pos_system') THEN TRUE
-            ELSE FALSE
-        END,
-        CASE 
-            WHEN sf.feature_code IN ('inventory_management') THEN TRUE
-            ELSE FALSE
-        END,
-        FALSE
-    FROM system_features sf
-    WHERE NOT EXISTS (
-        SELECT 1 FROM role_permissions 
-        WHERE role = 'cashier' AND feature_id = sf.feature_id
-    );
+
+    VERSIONS_SQL = "SELECT table_name, version FROM table_versions WHERE table_name IN ('role_permissions', 'system_features')"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._versions = None
+
+    def _load(self, cursor):
+        cursor.execute("""
+            SELECT rp.role, sf.feature_code, rp.can_view, rp.can_create, rp.can_edit, rp.can_delete
+            FROM role_permissions rp
+            JOIN system_features sf ON rp.feature_id = sf.feature_id
+            WHERE sf.is_active = TRUE
+        """)
+        matrix = {}
+        for role, feature_code, can_view, can_create, can_edit, can_delete in cursor.fetchall():
+            mask = ((PERMISSION_BITS['view'] if can_view else 0)
+                    | (PERMISSION_BITS['create'] if can_create else 0)
+                    | (PERMISSION_BITS['edit'] if can_edit else 0)
+                    | (PERMISSION_BITS['delete'] if can_delete else 0))
+            matrix.setdefault(role, {})[feature_code] = mask
+        return matrix
+
+    def get(self):
+        cursor = get_db().cursor()
+        cursor.execute(self.VERSIONS_SQL)
+        versions = dict(cursor.fetchall())
+        matrix = self._matrix
+        if matrix is not None and versions == self._versions:
+            return matrix
+        with self._lock:
+            # 并发未命中只加载一次；先读版本号再读矩阵，两次查询之间的修改只会让下一次检查再加载一次
+            if self._matrix is None or versions != self._versions:
+                self._matrix = self._load(cursor)
+                self._versions = versions
+            return self._matrix
+
+    def has_permission(self, role, feature_code, action):
+        bit = PERMISSION_BITS.get(action)
+        if bit is None:
+            return False
+        return bool(self.get().get(role, {}).get(feature_code, 0) & bit)
+
+permission_matrix = PermissionMatrix()
+
+def require_permission(feature_code, action, message='您没有权限执行此操作'):
+    """路由装饰器：按权限矩阵检查当前用户角色，需放在 @jwt_required() 之后"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                allowed = permission_matrix.has_permission(get_jwt()['role'], feature_code, action)
+            except Exception as e:
+                return {'message': f'权限检查失败: {str(e)}'}, 500
+            if not allowed:
+                return {'message': message}, 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# 由 table_versions 表维护版本号的表（语句级触发器在每次写入后递增，见 migrations/0003_table_versions.sql）
+VERSIONED_TABLES = ('stores', 'product_categories', 'suppliers', 'products', 'promotions', 'promotion_items')
+
+def get_table_versions(tables):
+    """读取各表的版本号和最后修改时间，返回 ({表名: 版本号}, 最后修改时间)"""
+    cursor = get_db().cursor()
+    cursor.execute(
+        "SELECT table_name, version, updated_at FROM table_versions WHERE table_name = ANY(%s)",
+        (list(tables),)
+    )
+    rows = cursor.fetchall()
+    versions = {row[0]: row[1] for row in rows}
+    last_modified = max((row[2] for row in rows if row[2] is not None), default=None)
+    return versions, last_modified
+
+def conditional_get(*tables):
+    """路由装饰器：用相关表的版本号生成ETag/Last-Modified，客户端缓存仍有效时直接返回304
+
+    校验只读一行版本号，不查询也不序列化数据行。
     """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                versions, last_modified = get_table_versions(tables)
+            except Exception as e:
+                app.logger.warning("读取表版本失败: %s", e)
+                return fn(*args, **kwargs)
+            
+            raw = f"{request.path}?{request.query_string.decode('utf-8')}|" + \
+                ','.join(f"{table}:{versions.get(table, 0)}" for table in tables)
+            etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+            
+            # Last-Modified 只精确到秒，客户端带回的是截断后的时间：最后一次写入严格早于该时间才算未修改，
+            # 同一秒内稍后的写入不会被当成已缓存
+            not_modified = request.if_none_match.contains(etag) if request.if_none_match else (
+                last_modified is not None and request.if_modified_since is not None
+                and last_modified < request.if_modified_since
+            )
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified.replace(microsecond=0)
+            # 浏览器每次都带上校验信息重新验证
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+# 初始化所有数据库表
+# ==================== 数据库迁移 ====================
+# 表结构变更放在 migrations/ 目录下按版本号排序的SQL文件中（NNNN_说明.sql），
+# 由 `python complete_server.py migrate` 执行；服务启动只检查版本，不执行DDL
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_LOCK_KEY = 20251018  # 防止多个 migrate 命令同时执行的咨询锁
+
+def list_migrations():
+    """返回按版本号排序的 [(version, 文件名)]"""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        prefix = filename.split('_', 1)[0]
+        if filename.endswith('.sql') and prefix.isdigit():
+            migrations.append((int(prefix), filename))
+    return sorted(migrations)
+
+def get_schema_version(cursor):
+    """读取已执行的最新迁移版本，schema_version 表不存在时为0"""
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_class WHERE relname = 'schema_version' AND relkind = 'r' AND pg_table_is_visible(oid)
+        )
+    """)
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def split_sql_statements(sql):
+    """按行尾分号拆分非事务迁移中的语句（此类迁移不能包含 DO 块或函数定义）"""
+    statements = []
+    for chunk in re.split(r';[ \t]*$', sql, flags=re.M):
+        lines = [line for line in chunk.splitlines() if line.strip() and not line.strip().startswith('--')]
+        if lines:
+            statements.append('\n'.join(lines))
+    return statements
+
+def _run_migration(conn, version, filename):
+    with open(os.path.join(MIGRATIONS_DIR, filename), encoding='utf-8') as f:
+        sql = f.read()
+    cursor = conn.cursor()
     
-    cursor.execute(init_features_sql)
+    if not sql.startswith('-- migrate: no-transaction'):
+        # 普通迁移与版本记录在同一事务中提交，失败整体回滚
+        cursor.execute(sql)
+        cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, filename))
+        conn.commit()
+        return
     
-    conn.commit()
-    cursor.close()
-    conn.close()
+    # CREATE INDEX CONCURRENTLY 不能在事务块中执行：逐条自动提交。
+    # 中断的并发建索引会留下无效索引，IF NOT EXISTS 会跳过它，所以先删除
+    conn.set_session(autocommit=True)
+    try:
+        index_names = re.findall(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', sql, flags=re.I)
+        if index_names:
+            cursor.execute("""
+                SELECT c.relname FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = ANY(%s) AND NOT i.indisvalid AND pg_table_is_visible(c.oid)
+            """, (index_names,))
+            for (name,) in cursor.fetchall():
+                print(f"⚠️ 索引 {name} 无效，重新创建")
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        for statement in split_sql_statements(sql):
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, filename))
+    finally:
+        conn.set_session(autocommit=False)
+
+def migrate_database():
+    """按版本号顺序执行未执行的迁移，返回本次执行的文件名"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                name VARCHAR(200) NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            current = get_schema_version(cursor)
+            conn.commit()
+            applied = []
+            for version, filename in list_migrations():
+                if version <= current:
+                    continue
+                print(f"🔧 执行迁移 {filename}...")
+                _run_migration(conn, version, filename)
+                applied.append(filename)
+            return applied
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+    finally:
+        conn.close()
+
+def check_schema_version():
+    """启动时只做一次版本查询，返回 (数据库版本, 代码要求的版本)"""
+    migrations = list_migrations()
+    required = migrations[-1][0] if migrations else 0
+    conn = get_db_connection()
+    try:
+        current = get_schema_version(conn.cursor())
+        conn.rollback()
+    finally:
+        conn.close()
+    return current, required
 
 # ==================== 健康检查 ====================
 @app.route('/health')
@@ -498,14 +988,12 @@ def register():
         if role not in ['admin', 'manager', 'cashier']:
             return {'message': '角色必须是admin、manager或cashier'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查用户名是否已存在
         cursor.execute("SELECT user_id FROM users WHERE username = %s", (username,))
         if cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '用户名已存在'}, 400
         
         # 创建用户
@@ -517,8 +1005,6 @@ def register():
         user_id = cursor.fetchone()[0]
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'message': '用户注册成功',
@@ -540,20 +1026,20 @@ def login():
         if not all([username, password]):
             return {'message': '用户名和密码不能为空'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT user_id, username, password_hash, role, store_id FROM users WHERE username = %s", (username,))
+        cursor.execute("SELECT user_id, username, password_hash, role, store_id, token_version FROM users WHERE username = %s", (username,))
         user = cursor.fetchone()
         
-        cursor.close()
-        conn.close()
-        
         if not user or not check_password_hash(user[2], password):
             return {'message': '用户名或密码错误'}, 401
         
-        # 创建JWT token
-        access_token = create_access_token(identity=str(user[0]))
+        # 创建JWT token，角色和门店写入声明，后续请求无需再查询users表
+        access_token = create_access_token(
+            identity=str(user[0]),
+            additional_claims={'role': user[3], 'store_id': user[4], 'ver': user[5]}
+        )
         
         # 记录登录日志
         log_action(user[0], 'login', f'用户 {user[1]} 登录系统')
@@ -577,7 +1063,7 @@ def login():
 @jwt_required()
 def create_user():
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
         data = request.get_json()
         username = data.get('username')
@@ -600,44 +1086,25 @@ def create_user():
         
         db_role = role_mapping[role]
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 权限检查：门店经理只能创建收银员，且必须在自己的门店
         if current_role == 'store_manager':
             if db_role != 'cashier':
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理只能创建收银员账户'}, 403
             
             if store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理只能在自己的门店创建用户'}, 403
         
         # 系统管理员可以创建任何角色的用户
         # 收银员不能创建用户（这个检查可以在前端控制，但后端也应该有）
         elif current_role == 'cashier':
-            cursor.close()
-            conn.close()
             return {'message': '收银员无权创建用户'}, 403
         
         # 检查用户名是否已存在
         cursor.execute("SELECT user_id FROM users WHERE username = %s", (username,))
         if cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '用户名已存在'}, 400
         
         # 创建用户
@@ -660,8 +1127,6 @@ def create_user():
         user_id = cursor.fetchone()[0]
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'message': '用户创建成功',
@@ -673,83 +1138,45 @@ def create_user():
     except Exception as e:
         return {'message': f'用户创建失败: {str(e)}'}, 500
 
+def build_users_query(user_id, role, store_id):
+    """按当前用户的角色生成用户列表查询，返回 (sql, params)"""
+    # 角色名称转换为前端友好格式
+    select_sql = f"""
+        SELECT u.user_id, u.username,
+               CASE u.role WHEN 'system_admin' THEN 'admin' WHEN 'store_manager' THEN 'manager'
+                           ELSE u.role END AS role,
+               u.store_id, s.name as store_name,
+               {local_time_sql('u.created_at')} AS created_at, {local_time_sql('u.updated_at')} AS updated_at
+        FROM users u
+        LEFT JOIN stores s ON u.store_id = s.store_id
+    """
+    
+    # 根据角色权限过滤用户
+    if role == 'system_admin':
+        # 系统管理员可以看到所有用户
+        return select_sql + " ORDER BY u.user_id DESC", ()
+    if role == 'store_manager':
+        # 门店经理只能看到自己门店的收银员和自己
+        return select_sql + """
+            WHERE (u.store_id = %s AND u.role IN ('cashier', 'store_manager'))
+               OR u.user_id = %s
+            ORDER BY u.user_id DESC
+        """, (store_id, user_id)
+    # 收银员只能看到自己
+    return select_sql + " WHERE u.user_id = %s ORDER BY u.user_id DESC", (user_id,)
+
 @app.route('/api/users/', methods=['GET'])
 @jwt_required()
 def get_users():
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 获取当前用户信息
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
-        # 根据角色权限过滤用户
-        if current_role == 'system_admin':
-            # 系统管理员可以看到所有用户
-            cursor.execute("""
-                SELECT u.user_id, u.username, u.role, u.store_id, s.name as store_name,
-                       u.created_at, u.updated_at
-                FROM users u
-                LEFT JOIN stores s ON u.store_id = s.store_id
-                ORDER BY u.user_id DESC
-            """)
-        elif current_role == 'store_manager':
-            # 门店经理只能看到自己门店的收银员和自己
-            cursor.execute("""
-                SELECT u.user_id, u.username, u.role, u.store_id, s.name as store_name,
-                       u.created_at, u.updated_at
-                FROM users u
-                LEFT JOIN stores s ON u.store_id = s.store_id
-                WHERE (u.store_id = %s AND u.role IN ('cashier', 'store_manager')) 
-                   OR u.user_id = %s
-                ORDER BY u.user_id DESC
-            """, (current_store_id, current_user_id))
-        else:
-            # 收银员只能看到自己
-            cursor.execute("""
-                SELECT u.user_id, u.username, u.role, u.store_id, s.name as store_name,
-                       u.created_at, u.updated_at
-                FROM users u
-                LEFT JOIN stores s ON u.store_id = s.store_id
-                WHERE u.user_id = %s
-                ORDER BY u.user_id DESC
-            """, (current_user_id,))
-        
-        users = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        users_list = []
-        for user in users:
-            # 转换角色名称为前端友好格式
-            role_display = {
-                'system_admin': 'admin',
-                'store_manager': 'manager',
-                'cashier': 'cashier'
-            }.get(user[2], user[2])
-            
-            users_list.append({
-                'user_id': user[0],
-                'username': user[1],
-                'role': role_display,
-                'store_id': user[3],
-                'store_name': user[4],
-                'created_at': format_datetime_with_timezone(user[5]),
-                'updated_at': format_datetime_with_timezone(user[6])
-            })
+        cursor.execute(*build_users_query(current_user_id, current_role, current_store_id))
         
-        return {'users': users_list}, 200
+        return {'users': fetch_rowset(cursor)}, 200
         
     except Exception as e:
         return {'message': f'获取用户列表失败: {str(e)}'}, 500
@@ -758,7 +1185,7 @@ def get_users():
 @jwt_required()
 def update_user(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
         data = request.get_json()
         username = data.get('username')
@@ -781,26 +1208,13 @@ def update_user(user_id):
         
         db_role = role_mapping[role]
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 检查要更新的用户是否存在，并获取其信息
         cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (user_id,))
         target_user = cursor.fetchone()
         if not target_user:
-            cursor.close()
-            conn.close()
             return {'message': '用户不存在'}, 404
         
         target_role, target_store_id = target_user
@@ -809,64 +1223,56 @@ def update_user(user_id):
         if current_role == 'store_manager':
             # 不能更新系统管理员
             if target_role == 'system_admin':
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理无权更新系统管理员'}, 403
             
             # 只能更新自己门店的用户
             if target_store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理只能更新自己门店的用户'}, 403
             
             # 只能将用户设置为收银员角色
             if db_role != 'cashier' and user_id != current_user_id:
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理只能将其他用户设置为收银员'}, 403
             
             # 只能在自己的门店内操作
             if store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理只能在自己的门店内操作'}, 403
         
         # 收银员只能更新自己的信息
         elif current_role == 'cashier':
             if user_id != current_user_id:
-                cursor.close()
-                conn.close()
                 return {'message': '收银员只能更新自己的信息'}, 403
         
         # 检查用户名是否被其他用户使用
         cursor.execute("SELECT user_id FROM users WHERE username = %s AND user_id != %s", (username, user_id))
         if cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '用户名已被其他用户使用'}, 400
         
         # 如果是系统管理员，自动分配到总店（ID: 1）
         if db_role == 'system_admin':
             store_id = 1  # 总店ID
         
+        # 角色或门店变化时递增token_version，使该用户已签发的令牌失效
+        version_bump = 1 if (db_role != target_role or store_id != target_store_id) else 0
+        
         # 更新用户信息
         if password:
             password_hash = generate_password_hash(password)
             cursor.execute("""
                 UPDATE users 
-                SET username = %s, password_hash = %s, role = %s, store_id = %s
+                SET username = %s, password_hash = %s, role = %s, store_id = %s,
+                    token_version = token_version + %s, updated_at = CURRENT_TIMESTAMP
                 WHERE user_id = %s
-            """, (username, password_hash, db_role, store_id, user_id))
+            """, (username, password_hash, db_role, store_id, version_bump, user_id))
         else:
             cursor.execute("""
                 UPDATE users 
-                SET username = %s, role = %s, store_id = %s
+                SET username = %s, role = %s, store_id = %s, token_version = token_version + %s,
+                    updated_at = CURRENT_TIMESTAMP
                 WHERE user_id = %s
-            """, (username, db_role, store_id, user_id))
+            """, (username, db_role, store_id, version_bump, user_id))
         
         conn.commit()
-        cursor.close()
-        conn.close()
+        invalidate_token_version(user_id)
         
         return {
             'message': '用户更新成功',
@@ -878,36 +1284,25 @@ def update_user(user_id):
     except Exception as e:
         return {'message': f'用户更新失败: {str(e)}'}, 500
 
+USER_WORK_LOGS_COUNT_SQL = "SELECT COUNT(*) FROM work_logs WHERE user_id = %s"
+
 @app.route('/api/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
 def delete_user(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
         # 不能删除自己
         if current_user_id == user_id:
             return {'message': '不能删除自己的账户'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 检查要删除的用户是否存在，并获取其信息
         cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (user_id,))
         target_user = cursor.fetchone()
         if not target_user:
-            cursor.close()
-            conn.close()
             return {'message': '用户不存在'}, 404
         
         target_role, target_store_id = target_user
@@ -916,45 +1311,34 @@ def delete_user(user_id):
         if current_role == 'store_manager':
             # 不能删除系统管理员
             if target_role == 'system_admin':
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理无权删除系统管理员'}, 403
             
             # 不能删除其他门店经理
             if target_role == 'store_manager':
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理无权删除其他门店经理'}, 403
             
             # 只能删除自己门店的收银员
             if target_store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '门店经理只能删除自己门店的收银员'}, 403
         
         # 收银员不能删除任何用户
         elif current_role == 'cashier':
-            cursor.close()
-            conn.close()
             return {'message': '收银员无权删除用户'}, 403
         
         # 检查是否有关联数据
         cursor.execute("SELECT COUNT(*) FROM sales WHERE cashier_id = %s", (user_id,))
         sales_count = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM work_logs WHERE user_id = %s", (user_id,))
+        cursor.execute(USER_WORK_LOGS_COUNT_SQL, (user_id,))
         logs_count = cursor.fetchone()[0]
         
         if sales_count > 0 or logs_count > 0:
-            cursor.close()
-            conn.close()
             return {'message': '无法删除：该用户存在销售记录或工作日志'}, 400
         
         cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
         
         conn.commit()
-        cursor.close()
-        conn.close()
+        invalidate_token_version(user_id)
         
         return {'message': '用户删除成功'}, 200
         
@@ -973,7 +1357,7 @@ def create_store():
         if not name:
             return {'message': '门店名称不能为空'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute(
@@ -983,9 +1367,6 @@ def create_store():
         store_id = cursor.fetchone()[0]
         conn.commit()
         
-        cursor.close()
-        conn.close()
-        
         return {
             'message': '门店创建成功',
             'store_id': store_id,
@@ -997,28 +1378,19 @@ def create_store():
         return {'message': f'门店创建失败: {str(e)}'}, 500
 
 @app.route('/api/stores/', methods=['GET'])
+@conditional_get('stores')
 def get_stores():
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT store_id, name, address, created_at, updated_at FROM stores ORDER BY store_id")
-        stores = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        stores_list = []
-        for store in stores:
-            stores_list.append({
-                'store_id': store[0],
-                'name': store[1],
-                'address': store[2],
-                'created_at': format_datetime_with_timezone(store[3]),
-                'updated_at': format_datetime_with_timezone(store[4])
-            })
+        cursor.execute(f"""
+            SELECT store_id, name, address,
+                   {local_time_sql('created_at')} AS created_at, {local_time_sql('updated_at')} AS updated_at
+            FROM stores ORDER BY store_id
+        """)
         
-        return {'stores': stores_list}, 200
+        return {'stores': fetch_rowset(cursor)}, 200
         
     except Exception as e:
         return {'message': f'获取门店列表失败: {str(e)}'}, 500
@@ -1034,14 +1406,12 @@ def update_store(store_id):
         if not all([name, address]):
             return {'message': '缺少必要参数'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查门店是否存在
         cursor.execute("SELECT store_id FROM stores WHERE store_id = %s", (store_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '门店不存在'}, 404
         
         cursor.execute(
@@ -1050,8 +1420,6 @@ def update_store(store_id):
         )
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'message': '门店更新成功',
@@ -1066,14 +1434,12 @@ def update_store(store_id):
 @jwt_required()
 def delete_store(store_id):
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查门店是否存在
         cursor.execute("SELECT store_id FROM stores WHERE store_id = %s", (store_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '门店不存在'}, 404
         
         # 检查是否有关联数据
@@ -1084,15 +1450,11 @@ def delete_store(store_id):
         sales_count = cursor.fetchone()[0]
         
         if inventory_count > 0 or sales_count > 0:
-            cursor.close()
-            conn.close()
             return {'message': '无法删除：该门店存在库存或销售记录'}, 400
         
         cursor.execute("DELETE FROM stores WHERE store_id = %s", (store_id,))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {'message': '门店删除成功'}, 200
         
@@ -1111,7 +1473,7 @@ def create_category():
         if not name:
             return {'message': '分类名称不能为空'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute(
@@ -1121,9 +1483,6 @@ def create_category():
         category_id = cursor.fetchone()[0]
         conn.commit()
         
-        cursor.close()
-        conn.close()
-        
         return {
             'message': '分类创建成功',
             'category_id': category_id,
@@ -1134,27 +1493,19 @@ def create_category():
         return {'message': f'分类创建失败: {str(e)}'}, 500
 
 @app.route('/api/categories/', methods=['GET'])
+@conditional_get('product_categories')
 def get_categories():
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT category_id, name, created_at, updated_at FROM product_categories ORDER BY category_id")
-        categories = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        categories_list = []
-        for category in categories:
-            categories_list.append({
-                'category_id': category[0],
-                'name': category[1],
-                'created_at': format_datetime_with_timezone(category[2]),
-                'updated_at': format_datetime_with_timezone(category[3])
-            })
+        cursor.execute(f"""
+            SELECT category_id, name,
+                   {local_time_sql('created_at')} AS created_at, {local_time_sql('updated_at')} AS updated_at
+            FROM product_categories ORDER BY category_id
+        """)
         
-        return {'categories': categories_list}, 200
+        return {'categories': fetch_rowset(cursor)}, 200
         
     except Exception as e:
         return {'message': f'获取分类列表失败: {str(e)}'}, 500
@@ -1170,14 +1521,12 @@ def update_category(category_id):
         if not name:
             return {'message': '缺少分类名称'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查分类是否存在
         cursor.execute("SELECT category_id FROM product_categories WHERE category_id = %s", (category_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '分类不存在'}, 404
         
         cursor.execute(
@@ -1186,8 +1535,6 @@ def update_category(category_id):
         )
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'message': '分类更新成功',
@@ -1202,14 +1549,12 @@ def update_category(category_id):
 @jwt_required()
 def delete_category(category_id):
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查分类是否存在
         cursor.execute("SELECT category_id FROM product_categories WHERE category_id = %s", (category_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '分类不存在'}, 404
         
         # 检查是否有关联商品
@@ -1217,15 +1562,11 @@ def delete_category(category_id):
         product_count = cursor.fetchone()[0]
         
         if product_count > 0:
-            cursor.close()
-            conn.close()
             return {'message': '无法删除：该分类下存在商品'}, 400
         
         cursor.execute("DELETE FROM product_categories WHERE category_id = %s", (category_id,))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {'message': '分类删除成功'}, 200
         
@@ -1246,7 +1587,7 @@ def create_work_log():
         if not all([store_id, action]):
             return {'message': '缺少必要参数'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         if action == 'clock_in':
@@ -1270,9 +1611,6 @@ def create_work_log():
         log_id = result[0]
         conn.commit()
         
-        cursor.close()
-        conn.close()
-        
         return {
             'message': f'{"上班" if action == "clock_in" else "下班"}打卡成功',
             'log_id': log_id
@@ -1281,59 +1619,34 @@ def create_work_log():
     except Exception as e:
         return {'message': f'打卡失败: {str(e)}'}, 500
 
+def build_work_logs_query(limit=1000):
+    """最新工作日志查询，返回 (sql, params)"""
+    return f"""
+        SELECT w.log_id, w.user_id, w.action, w.details, {local_time_sql('w.timestamp')} AS timestamp,
+               u.username
+        FROM work_logs w
+        JOIN users u ON w.user_id = u.user_id
+        ORDER BY w.timestamp DESC
+        LIMIT %s
+    """, (limit,)
+
 @app.route('/api/work-logs/', methods=['GET'])
 @jwt_required()
 def get_work_logs():
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 获取当前用户信息
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '用户不存在'}, 404
-        
-        current_role = current_user[0]
+        current_user_id, current_role, current_store_id = get_current_user()
         
         # 只有系统管理员可以查看工作日志
         if current_role != 'system_admin':
-            cursor.close()
-            conn.close()
             return {'message': '您没有权限查看工作日志'}, 403
         
-        # 查询所有工作日志
-            cursor.execute("""
-            SELECT w.log_id, w.user_id, w.action, w.details, w.timestamp,
-                   u.username
-                FROM work_logs w
-                JOIN users u ON w.user_id = u.user_id
-            ORDER BY w.timestamp DESC
-            LIMIT 1000
-        """)
-        
-        logs = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        conn = get_db()
+        cursor = conn.cursor()
         
-        logs_list = []
-        for log in logs:
-            logs_list.append({
-                'log_id': log[0],
-                'user_id': log[1],
-                'action': log[2],
-                'details': log[3],
-                'timestamp': format_datetime_with_timezone(log[4]),
-                'username': log[5]
-            })
+        # 查询最新的工作日志
+        cursor.execute(*build_work_logs_query())
         
-        return {'work_logs': logs_list}, 200
+        return {'work_logs': fetch_rowset(cursor)}, 200
         
     except Exception as e:
         return {'message': f'获取工作日志失败: {str(e)}'}, 500
@@ -1350,7 +1663,7 @@ def create_supplier():
         if not name:
             return {'message': '供应商名称不能为空'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute(
@@ -1360,9 +1673,6 @@ def create_supplier():
         supplier_id = cursor.fetchone()[0]
         conn.commit()
         
-        cursor.close()
-        conn.close()
-        
         return {
             'message': '供应商创建成功',
             'supplier_id': supplier_id,
@@ -1374,28 +1684,19 @@ def create_supplier():
         return {'message': f'供应商创建失败: {str(e)}'}, 500
 
 @app.route('/api/suppliers/', methods=['GET'])
+@conditional_get('suppliers')
 def get_suppliers():
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT supplier_id, name, contact_info, created_at, updated_at FROM suppliers ORDER BY supplier_id")
-        suppliers = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        suppliers_list = []
-        for supplier in suppliers:
-            suppliers_list.append({
-                'supplier_id': supplier[0],
-                'name': supplier[1],
-                'contact_info': supplier[2],
-                'created_at': format_datetime_with_timezone(supplier[3]),
-                'updated_at': format_datetime_with_timezone(supplier[4])
-            })
+        cursor.execute(f"""
+            SELECT supplier_id, name, contact_info,
+                   {local_time_sql('created_at')} AS created_at, {local_time_sql('updated_at')} AS updated_at
+            FROM suppliers ORDER BY supplier_id
+        """)
         
-        return {'suppliers': suppliers_list}, 200
+        return {'suppliers': fetch_rowset(cursor)}, 200
         
     except Exception as e:
         return {'message': f'获取供应商列表失败: {str(e)}'}, 500
@@ -1411,14 +1712,12 @@ def update_supplier(supplier_id):
         if not name:
             return {'message': '缺少必要参数'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查供应商是否存在
         cursor.execute("SELECT supplier_id FROM suppliers WHERE supplier_id = %s", (supplier_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '供应商不存在'}, 404
         
         cursor.execute("""
@@ -1428,8 +1727,6 @@ def update_supplier(supplier_id):
         """, (name, contact_info, supplier_id))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'message': '供应商更新成功',
@@ -1444,14 +1741,12 @@ def update_supplier(supplier_id):
 @jwt_required()
 def delete_supplier(supplier_id):
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查供应商是否存在
         cursor.execute("SELECT supplier_id FROM suppliers WHERE supplier_id = %s", (supplier_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '供应商不存在'}, 404
         
         # 检查是否有关联商品
@@ -1459,15 +1754,11 @@ def delete_supplier(supplier_id):
         product_count = cursor.fetchone()[0]
         
         if product_count > 0:
-            cursor.close()
-            conn.close()
             return {'message': '无法删除：该供应商下存在商品'}, 400
         
         cursor.execute("DELETE FROM suppliers WHERE supplier_id = %s", (supplier_id,))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {'message': '供应商删除成功'}, 200
         
@@ -1489,7 +1780,7 @@ def create_product():
         if not all([name, sku]):
             return {'message': '商品名称和SKU不能为空'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute(
@@ -1499,9 +1790,6 @@ def create_product():
         product_id = cursor.fetchone()[0]
         conn.commit()
         
-        cursor.close()
-        conn.close()
-        
         return {
             'message': '商品创建成功',
             'product_id': product_id,
@@ -1513,39 +1801,23 @@ def create_product():
         return {'message': f'商品创建失败: {str(e)}'}, 500
 
 @app.route('/api/products/', methods=['GET'])
+@conditional_get('products', 'product_categories', 'suppliers')
 def get_products():
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT p.product_id, p.sku, p.name, p.description,
                    c.name as category_name, s.name as supplier_name,
-                   p.created_at, p.updated_at
+                   {local_time_sql('p.created_at')} AS created_at, {local_time_sql('p.updated_at')} AS updated_at
             FROM products p
             LEFT JOIN product_categories c ON p.category_id = c.category_id
             LEFT JOIN suppliers s ON p.supplier_id = s.supplier_id
             ORDER BY p.product_id
         """)
-        products = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
         
-        products_list = []
-        for product in products:
-            products_list.append({
-                'product_id': product[0],
-                'sku': product[1],
-                'name': product[2],
-                'description': product[3],
-                'category_name': product[4],
-                'supplier_name': product[5],
-                'created_at': format_datetime_with_timezone(product[6]),
-                'updated_at': format_datetime_with_timezone(product[7])
-            })
-        
-        return {'products': products_list}, 200
+        return {'products': fetch_rowset(cursor)}, 200
         
     except Exception as e:
         return {'message': f'获取商品列表失败: {str(e)}'}, 500
@@ -1563,14 +1835,12 @@ def update_product(product_id):
         if not all([name, category_id, supplier_id]):
             return {'message': '缺少必要参数'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查商品是否存在
         cursor.execute("SELECT product_id FROM products WHERE product_id = %s", (product_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '商品不存在'}, 404
         
         cursor.execute("""
@@ -1580,8 +1850,6 @@ def update_product(product_id):
         """, (name, description, category_id, supplier_id, product_id))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'message': '商品更新成功',
@@ -1592,30 +1860,28 @@ def update_product(product_id):
     except Exception as e:
         return {'message': f'商品更新失败: {str(e)}'}, 500
 
+PRODUCT_SALE_ITEMS_COUNT_SQL = "SELECT COUNT(*) FROM sale_items WHERE product_id = %s"
+
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
 @jwt_required()
 def delete_product(product_id):
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 检查商品是否存在
         cursor.execute("SELECT product_id FROM products WHERE product_id = %s", (product_id,))
         if not cursor.fetchone():
-            cursor.close()
-            conn.close()
             return {'message': '商品不存在'}, 404
         
         # 检查是否有关联数据
         cursor.execute("SELECT COUNT(*) FROM inventory WHERE product_id = %s", (product_id,))
         inventory_count = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM sale_items WHERE product_id = %s", (product_id,))
+        cursor.execute(PRODUCT_SALE_ITEMS_COUNT_SQL, (product_id,))
         sales_count = cursor.fetchone()[0]
         
         if inventory_count > 0 or sales_count > 0:
-            cursor.close()
-            conn.close()
             return {'message': '无法删除：该商品存在库存或销售记录'}, 400
         
         # 删除促销关联
@@ -1625,8 +1891,6 @@ def delete_product(product_id):
         cursor.execute("DELETE FROM products WHERE product_id = %s", (product_id,))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {'message': '商品删除成功'}, 200
         
@@ -1638,7 +1902,7 @@ def delete_product(product_id):
 @jwt_required()
 def update_inventory():
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
         data = request.get_json()
         store_id = data.get('store_id')
@@ -1649,25 +1913,12 @@ def update_inventory():
         if not all([store_id, product_id, quantity is not None, price is not None]):
             return {'message': '缺少必要参数'}, 400
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 权限检查：门店经理和收银员只能更新自己门店的库存
         if current_role in ['store_manager', 'cashier']:
             if store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能管理自己门店的库存'}, 403
         
         # 先检查是否已存在该商品的库存记录
@@ -1697,9 +1948,6 @@ def update_inventory():
         inventory_id = cursor.fetchone()[0]
         conn.commit()
         
-        cursor.close()
-        conn.close()
-        
         return {
             'message': '库存更新成功',
             'inventory_id': inventory_id,
@@ -1712,144 +1960,564 @@ def update_inventory():
     except Exception as e:
         return {'message': f'库存更新失败: {str(e)}'}, 500
 
+app.config['INVENTORY_PAGE_SIZE'] = int(os.getenv('INVENTORY_PAGE_SIZE', 50))
+app.config['INVENTORY_PAGE_SIZE_MAX'] = int(os.getenv('INVENTORY_PAGE_SIZE_MAX', 500))
+app.config['LOW_STOCK_THRESHOLD'] = int(os.getenv('LOW_STOCK_THRESHOLD', 10))
+
+# 库存列表允许的排序字段：(排序表达式, 游标值的SQL类型)，表达式不能为NULL，否则游标比较失效
+INVENTORY_SORT_COLUMNS = {
+    'inventory_id': ('i.inventory_id', 'int'),
+    'product_name': ('p.name', 'text'),
+    'sku': ('p.sku', 'text'),
+    'store_name': ('s.name', 'text'),
+    'quantity': ('i.quantity', 'int'),
+    'price': ('i.price', 'numeric'),
+    'updated_at': ("COALESCE(i.updated_at, TIMESTAMP WITH TIME ZONE '1970-01-01 00:00:00+00')", 'timestamptz')
+}
+
+def encode_inventory_cursor(sort_value, inventory_id):
+    """把最后一行的 (排序值, inventory_id) 编码为不透明的分页游标"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    elif isinstance(sort_value, Decimal):
+        sort_value = str(sort_value)
+    raw = json.dumps([sort_value, inventory_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_inventory_cursor(value):
+    raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    sort_value, inventory_id = json.loads(raw)
+    return sort_value, int(inventory_id)
+
+def parse_bool_arg(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def escape_like(value):
+    """转义LIKE通配符，用于前缀匹配"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# ==================== 促销定价 ====================
+app.config['PROMOTION_ENGINE_CHECK_INTERVAL'] = float(os.getenv('PROMOTION_ENGINE_CHECK_INTERVAL', 5))  # 检查其他进程修改促销的间隔（秒）
+
+CENT = Decimal('0.01')
+
+class PromotionPricingEngine:
+    """进程内促销定价索引
+
+    按 (门店ID或None表示全系统, product_id) 索引未过期促销的规则，查询时按日期过滤，
+    多个促销同时有效时取最终价最低者，价格相同取 promotion_id 最小者，结果确定。
+    本进程内的促销增删改在写事务中通过 lock_versions/load_promotion 读取，提交后由
+    apply_promotion 增量更新；其他进程的修改通过 table_versions 版本号发现后整体重建；
+    跨营业日时也整体重建以剔除过期规则。所有查询都使用调用方的连接，不另外借用连接。
+    """
+
+    VERSIONS_SQL = "SELECT table_name, version FROM table_versions WHERE table_name IN ('promotions', 'promotion_items')"
+    RULES_SQL = """
+        SELECT pr.promotion_id, pr.store_id, pi.product_id, pr.start_date, pr.end_date,
+               pr.discount_type, pr.discount_value
+        FROM promotions pr
+        JOIN promotion_items pi ON pi.promotion_id = pr.promotion_id
+        WHERE pr.end_date >= %s
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._rules = {}         # (store_id或None, product_id) -> [(promotion_id, start_date, end_date, discount_type, discount_value)]
+        self._by_promotion = {}  # promotion_id -> {索引键}
+        self._versions = None
+        self._built_for = None
+        self._checked_at = 0.0
+        self._loading = False
+        self._generation = 0     # 每次增量更新加1，重建期间发生过增量更新则丢弃重建结果
+        self._counters = {'rebuilds': 0, 'incremental_updates': 0, 'priced_rows': 0}
+
+    def price_rows(self, rows, on_date=None):
+        """批量定价：rows 为 [(store_id, product_id, 原价)]，返回 [(最终价, promotion_id或None)]
+
+        调用前先用 ensure_fresh 检查索引（结账在锁库存行之前检查）。
+        """
+        on_date = on_date or business_today()
+        rules = self._rules
+        results = []
+        for store_id, product_id, base_price in rows:
+            base_price = Decimal(base_price or 0)
+            best_price, best_promotion = base_price.quantize(CENT, rounding=ROUND_HALF_UP), None
+            for key in ((store_id, product_id), (None, product_id)):
+                for promotion_id, start_date, end_date, discount_type, discount_value in rules.get(key, ()):
+                    if not (start_date <= on_date <= end_date):
+                        continue
+                    if discount_type == 'percentage':
+                        final_price = base_price * (1 - discount_value / 100)
+                    else:
+                        final_price = max(Decimal('0'), base_price - discount_value)
+                    final_price = final_price.quantize(CENT, rounding=ROUND_HALF_UP)
+                    if best_promotion is None or (final_price, promotion_id) < (best_price, best_promotion):
+                        best_price, best_promotion = final_price, promotion_id
+            results.append((best_price, best_promotion))
+        with self._lock:
+            self._counters['priced_rows'] += len(results)
+        return results
+
+    def lock_versions(self, cursor):
+        """促销写事务的第一条语句：锁住促销相关的版本号行，返回写入前的版本号
+
+        锁持有到提交，期间其他事务不能修改促销，因此提交时版本号的变化全部来自本事务。
+        """
+        cursor.execute(self.VERSIONS_SQL + " ORDER BY table_name FOR UPDATE")
+        return dict(cursor.fetchall())
+
+    def load_promotion(self, cursor, promotion_id, versions_before):
+        """写事务提交前调用：读取该促销的规则（已删除时为空）和写入后的版本号"""
+        cursor.execute(self.RULES_SQL + " AND pr.promotion_id = %s", (business_today(), promotion_id))
+        rows = cursor.fetchall()
+        cursor.execute(self.VERSIONS_SQL)
+        return promotion_id, rows, versions_before, dict(cursor.fetchall())
+
+    def apply_promotion(self, update):
+        """写事务提交后调用，只更新这一个促销
+
+        索引在写入前是最新的，则同时推进版本号，本进程自己的修改不会再触发整体重建。
+        """
+        promotion_id, rows, versions_before, versions_after = update
+        with self._lock:
+            if self._built_for is None:
+                return
+            self._remove_locked(promotion_id)
+            self._add_rules(self._rules, self._by_promotion, rows)
+            if self._versions == versions_before:
+                self._versions = versions_after
+            self._generation += 1
+            self._counters['incremental_updates'] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._built_for = None
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data['indexed_keys'] = len(self._rules)
+            data['indexed_promotions'] = len(self._by_promotion)
+            data['built_for'] = self._built_for.isoformat() if self._built_for else None
+        return data
+
+    def ensure_fresh(self, conn):
+        """按间隔检查其他进程的促销修改，需要时整体重建
+
+        使用调用方的连接，不提交也不回滚；查询在锁外执行，锁内只替换索引。
+        已有索引时同一时间只有一个线程检查，其余线程继续使用现有索引。
+        """
+        today = business_today()
+        if self._built_for == today and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._loading and self._built_for is not None:
+                return
+            self._loading = True
+            generation = self._generation
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.VERSIONS_SQL)
+            versions = dict(cursor.fetchall())
+            if self._built_for == today and versions == self._versions:
+                self._checked_at = time.monotonic()
+                return
+            # 先读版本号再读规则：两次查询之间提交的修改只会让下一次检查再重建一次
+            cursor.execute(self.RULES_SQL, (today,))
+            rules, by_promotion = {}, {}
+            self._add_rules(rules, by_promotion, cursor.fetchall())
+            with self._lock:
+                if self._generation != generation:
+                    return  # 重建期间有增量更新，结果可能缺少它，留给下一次调用重新检查
+                self._rules, self._by_promotion = rules, by_promotion
+                self._versions = versions
+                self._built_for = today
+                self._counters['rebuilds'] += 1
+            self._checked_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._loading = False
+
+    @staticmethod
+    def _add_rules(rules, by_promotion, rows):
+        for promotion_id, store_id, product_id, start_date, end_date, discount_type, discount_value in rows:
+            key = (store_id, product_id)
+            # 规则列表整体替换，读线程无需加锁
+            rules[key] = rules.get(key, []) + [
+                (promotion_id, start_date, end_date, discount_type, Decimal(discount_value))
+            ]
+            by_promotion.setdefault(promotion_id, set()).add(key)
+
+    def _remove_locked(self, promotion_id):
+        for key in self._by_promotion.pop(promotion_id, ()):
+            remaining = [rule for rule in self._rules.get(key, []) if rule[0] != promotion_id]
+            if remaining:
+                self._rules[key] = remaining
+            else:
+                self._rules.pop(key, None)
+
+promotion_engine = PromotionPricingEngine(app.config['PROMOTION_ENGINE_CHECK_INTERVAL'])
+
+# price 为最终价格（含促销），name 是收银台需要的字段名
+INVENTORY_COLUMNS = ('inventory_id', 'product_id', 'store_id', 'quantity', 'original_price', 'price',
+                     'has_promotion', 'promotion_id', 'product_name', 'name', 'product_sku', 'store_name',
+                     'updated_at')
+
+def format_inventory_rows(rows, today):
+    """格式化库存行，价格由促销定价引擎一次批量计算
+
+    rows 为 (inventory_id, product_id, store_id, quantity, price, product_name, store_name, updated_at, sku)，
+    updated_at 由 local_time_sql 选出
+    """
+    prices = promotion_engine.price_rows([(item[2], item[1], item[4]) for item in rows], today)
+    # 价格在构建行时直接转换，比交给 json_default 逐个回调快
+    return RowSet(INVENTORY_COLUMNS, [
+        (item[0], item[1], item[2], item[3], float(item[4] or 0), float(final_price),
+         promotion_id is not None, promotion_id, item[5], item[5], item[8], item[6], item[7])
+        for item, (final_price, promotion_id) in zip(rows, prices)
+    ])
+
+INVENTORY_FROM_SQL = """
+    FROM inventory i
+    JOIN products p ON i.product_id = p.product_id
+    JOIN stores s ON i.store_id = s.store_id
+"""
+
+def build_inventory_query(filters, sort='inventory_id', order='asc', limit=None, cursor=None):
+    """生成库存列表查询，get_inventory 和 benchmarks/explain_baseline.py 共用
+
+    filters 可包含 store_id、category_id、supplier_id、low_stock_threshold、keyword、
+    has_promotion（True/False，同时需要 today）。limit 为 None 时不分页，否则多取一行判断 has_more；
+    cursor 为 decode_inventory_cursor 的结果。
+    返回 (sql, params, count_sql, count_params)：sql 的最后一列是排序值，count_sql 不含游标条件。
+    """
+    conditions = []
+    params = []
+    if filters.get('store_id'):
+        conditions.append("i.store_id = %s")
+        params.append(filters['store_id'])
+    if filters.get('category_id'):
+        conditions.append("p.category_id = %s")
+        params.append(filters['category_id'])
+    if filters.get('supplier_id'):
+        conditions.append("p.supplier_id = %s")
+        params.append(filters['supplier_id'])
+    if filters.get('low_stock_threshold') is not None:
+        conditions.append("i.quantity <= %s")
+        params.append(filters['low_stock_threshold'])
+    if filters.get('has_promotion') is not None:
+        conditions.append(("" if filters['has_promotion'] else "NOT ") + """EXISTS (
+            SELECT 1 FROM promotion_items pi
+            JOIN promotions pr ON pi.promotion_id = pr.promotion_id
+            WHERE pi.product_id = i.product_id
+              AND pr.start_date <= %s AND pr.end_date >= %s
+              AND (pr.store_id IS NULL OR pr.store_id = i.store_id)
+        )""")
+        params.extend([filters['today'], filters['today']])
+    if filters.get('keyword'):
+        # 拆成两个前缀查询，分别走 name/sku 的 text_pattern_ops 索引；写成 OR 时只能扫描全部商品
+        conditions.append("""i.product_id IN (
+            SELECT product_id FROM products WHERE name LIKE %s
+            UNION ALL
+            SELECT product_id FROM products WHERE sku LIKE %s
+        )""")
+        params.extend([escape_like(filters['keyword']) + '%'] * 2)
+    
+    sort_column, sort_type = INVENTORY_SORT_COLUMNS[sort]
+    sort_order = 'DESC' if order == 'desc' else 'ASC'
+    page_conditions = list(conditions)
+    page_params = list(params)
+    if cursor:
+        sort_value, last_id = cursor
+        operator = '<' if sort_order == 'DESC' else '>'
+        if sort_column == 'i.inventory_id':
+            # 单列比较才能和 store_id 一起用上 (store_id, inventory_id) 索引
+            page_conditions.append(f"i.inventory_id {operator} %s")
+            page_params.append(last_id)
+        else:
+            page_conditions.append(f"({sort_column}, i.inventory_id) {operator} (%s::{sort_type}, %s)")
+            page_params.extend([sort_value, last_id])
+    
+    where_sql = ("WHERE " + " AND ".join(page_conditions)) if page_conditions else ""
+    limit_sql = ""
+    if limit is not None:
+        limit_sql = "LIMIT %s"
+        page_params.append(limit + 1)
+    sql = f"""
+        SELECT i.inventory_id, i.product_id, i.store_id, i.quantity, i.price,
+               p.name as product_name, s.name as store_name, {local_time_sql('i.updated_at')}, p.sku,
+               {sort_column}
+        {INVENTORY_FROM_SQL}
+        {where_sql}
+        ORDER BY {sort_column} {sort_order}, i.inventory_id {sort_order}
+        {limit_sql}
+    """
+    count_where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    # 库存行的商品和门店由外键保证存在，总数只在按分类/供应商筛选时才需要连接商品表
+    count_from = "FROM inventory i"
+    if filters.get('category_id') or filters.get('supplier_id'):
+        count_from += " JOIN products p ON i.product_id = p.product_id"
+    return sql, page_params, f"SELECT 1 {count_from} {count_where}", params
+
 @app.route('/api/inventory/', methods=['GET'])
 @jwt_required()
 def get_inventory():
+    """库存列表
+
+    查询参数：store_id、category_id、supplier_id、low_stock（可配合low_stock_threshold）、
+    has_promotion、q（商品名称或SKU前缀）、sort/order、limit/cursor（上一页返回的next_cursor）、
+    count（estimate 或 exact，返回总数）。
+    系统管理员查看全部门店时强制分页，其他情况传入limit或cursor才分页。
+    分页按 (排序字段, inventory_id) 游标取下一页，不使用 OFFSET；默认不计算总数。
+    """
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         store_id = request.args.get('store_id')
+        today = business_today()
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        try:
+            # 权限检查：门店经理和收银员只能查看自己门店的库存
+            if current_role in ['store_manager', 'cashier']:
+                # 强制使用当前用户的门店ID，忽略请求参数中的store_id
+                store_id = current_store_id
+            elif store_id:
+                store_id = int(store_id)
+            filters = {'store_id': store_id, 'today': today, 'keyword': request.args.get('q', '').strip()}
+            
+            if request.args.get('category_id'):
+                filters['category_id'] = int(request.args['category_id'])
+            if request.args.get('supplier_id'):
+                filters['supplier_id'] = int(request.args['supplier_id'])
+            if parse_bool_arg(request.args.get('low_stock', '')):
+                filters['low_stock_threshold'] = int(request.args.get('low_stock_threshold',
+                                                                      app.config['LOW_STOCK_THRESHOLD']))
+            if request.args.get('has_promotion', '') != '':
+                filters['has_promotion'] = parse_bool_arg(request.args['has_promotion'])
+            
+            sort = request.args.get('sort', 'inventory_id')
+            if sort not in INVENTORY_SORT_COLUMNS:
+                return {'message': '不支持的排序字段'}, 400
+            
+            paginate = (current_role == 'system_admin' and not store_id) or \
+                'limit' in request.args or 'cursor' in request.args
+            limit = min(max(int(request.args.get('limit', app.config['INVENTORY_PAGE_SIZE'])), 1),
+                        app.config['INVENTORY_PAGE_SIZE_MAX'])
+            page_cursor = None
+            if paginate and request.args.get('cursor'):
+                page_cursor = decode_inventory_cursor(request.args['cursor'])
+            sql, page_params, count_sql, params = build_inventory_query(
+                filters, sort, request.args.get('order', '').lower(), limit if paginate else None, page_cursor
+            )
+        except (ValueError, TypeError, binascii.Error):
+            return {'message': '查询参数格式错误'}, 400
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
+        conn = get_db()
+        cursor = conn.cursor()
+        promotion_engine.ensure_fresh(conn)
         
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
+        # 最后一列是排序值，只用于生成游标
+        cursor.execute(sql, page_params)
         
-        current_role, current_store_id = current_user
+        inventory = cursor.fetchall()
+        has_more = paginate and len(inventory) > limit
+        if paginate:
+            inventory = inventory[:limit]
+        
+        result = {'inventory': format_inventory_rows(inventory, today)}
+        if paginate:
+            result.update({
+                'limit': limit,
+                'has_more': has_more,
+                'next_cursor': encode_inventory_cursor(inventory[-1][9], inventory[-1][0]) if has_more else None
+            })
         
-        # 权限检查：门店经理和收银员只能查看自己门店的库存
-        if current_role in ['store_manager', 'cashier']:
-            # 强制使用当前用户的门店ID，忽略请求参数中的store_id
-            store_id = current_store_id
-            cursor.execute("""
-                SELECT i.inventory_id, i.product_id, i.store_id, i.quantity, i.price,
-                       p.name as product_name, s.name as store_name, i.updated_at
-                FROM inventory i
-                JOIN products p ON i.product_id = p.product_id
-                JOIN stores s ON i.store_id = s.store_id
-                WHERE i.store_id = %s
-                ORDER BY i.inventory_id
-            """, (store_id,))
-        else:
-            # 系统管理员可以查看所有门店或指定门店的库存
-            if store_id:
-                cursor.execute("""
-                    SELECT i.inventory_id, i.product_id, i.store_id, i.quantity, i.price,
-                               p.name as product_name, s.name as store_name, i.updated_at
-                    FROM inventory i
-                    JOIN products p ON i.product_id = p.product_id
-                    JOIN stores s ON i.store_id = s.store_id
-                    WHERE i.store_id = %s
-                    ORDER BY i.inventory_id
-                """, (store_id,))
+        # 可选的总数：estimate 读取执行计划估算，exact 执行 COUNT(*)
+        count_mode = request.args.get('count')
+        if count_mode in ('estimate', 'exact'):
+            if count_mode == 'exact':
+                cursor.execute(f"SELECT COUNT(*) FROM ({count_sql}) AS c", params)
+                result['total'] = cursor.fetchone()[0]
             else:
-                cursor.execute("""
-                    SELECT i.inventory_id, i.product_id, i.store_id, i.quantity, i.price,
-                               p.name as product_name, s.name as store_name, i.updated_at
-                    FROM inventory i
-                    JOIN products p ON i.product_id = p.product_id
-                    JOIN stores s ON i.store_id = s.store_id
-                    ORDER BY i.inventory_id
-                """)
+                result['total'] = estimate_row_count(cursor, count_sql, params)
+            result['total_is_estimate'] = count_mode == 'estimate'
         
-        inventory = cursor.fetchall()
+        return result, 200
         
-        # 获取当前有效的促销信息
-        current_date = date.today()  # 使用真实当前日期
-        cursor.execute("""
-            SELECT pi.product_id, pr.discount_type, pr.discount_value
-            FROM promotion_items pi
+    except Exception as e:
+        return {'message': f'获取库存失败: {str(e)}'}, 500
+
+app.config['INVENTORY_SYNC_RETENTION_TXIDS'] = int(os.getenv('INVENTORY_SYNC_RETENTION_TXIDS', 5000000))  # 墓碑保留的事务号窗口
+app.config['INVENTORY_SYNC_PURGE_INTERVAL'] = int(os.getenv('INVENTORY_SYNC_PURGE_INTERVAL', 3600))        # 清理墓碑的最小间隔（秒）
+
+_last_sync_purge = 0.0
+
+def purge_inventory_sync_log(conn, force=False):
+    """删除超出保留窗口的库存墓碑和促销商品墓碑，返回新的清理水位（未执行时返回 None）
+
+    水位与删除在同一事务中提交；since 早于水位的同步请求会收到全量数据（full=true）。
+    """
+    global _last_sync_purge
+    now = time.monotonic()
+    if not force and now - _last_sync_purge < app.config['INVENTORY_SYNC_PURGE_INTERVAL']:
+        return None
+    _last_sync_purge = now
+    cursor = conn.cursor()
+    cursor.execute("SELECT txid_current() - %s", (app.config['INVENTORY_SYNC_RETENTION_TXIDS'],))
+    horizon = cursor.fetchone()[0]
+    if horizon <= 0:
+        conn.rollback()
+        return None
+    cursor.execute("""
+        UPDATE inventory_sync_horizon SET purged_before_txid = GREATEST(purged_before_txid, %s) WHERE id = 1
+    """, (horizon,))
+    cursor.execute("DELETE FROM inventory_tombstones WHERE deleted_txid < %s", (horizon,))
+    cursor.execute("DELETE FROM promotion_item_tombstones WHERE deleted_txid < %s", (horizon,))
+    conn.commit()
+    return horizon
+
+def encode_sync_version(txid, as_of):
+    return f"{txid}.{as_of.strftime('%Y%m%d')}"
+
+def decode_sync_version(value):
+    txid, as_of = value.split('.')
+    return int(txid), datetime.strptime(as_of, '%Y%m%d').date()
+
+def build_inventory_sync_query(store_id, since_txid=None, since_date=None, today=None):
+    """生成收银台同步查询，返回 (sql, params)；since_txid 为 None 时是门店全量库存
+
+    增量查询返回 since 之后库存行本身变化的商品，以及本门店或全系统促销中
+    加入/移出的商品、被修改促销的商品；since_date 不是 today 时还包括跨天生效或失效的促销商品。
+    """
+    sql = f"""
+        SELECT i.inventory_id, i.product_id, i.store_id, i.quantity, i.price,
+               p.name as product_name, s.name as store_name, {local_time_sql('i.updated_at')}, p.sku
+        {INVENTORY_FROM_SQL}
+        WHERE i.store_id = %s
+    """
+    params = [store_id]
+    if since_txid is None:
+        return sql + " ORDER BY i.product_id", params
+    
+    # 变化的商品由各分支分别按索引查出后再回表：写成 change_txid >= since OR ... 时
+    # 只能读出门店全部库存行逐行判断
+    changed_sql = """
+        SELECT product_id FROM inventory
+        WHERE store_id = %s AND change_txid >= %s
+        UNION ALL
+        SELECT pi.product_id FROM promotion_items pi
+        JOIN promotions pr ON pi.promotion_id = pr.promotion_id
+        WHERE pi.change_txid >= %s AND (pr.store_id IS NULL OR pr.store_id = %s)
+        UNION ALL
+        SELECT pi.product_id FROM promotions pr
+        JOIN promotion_items pi ON pi.promotion_id = pr.promotion_id
+        WHERE pr.change_txid >= %s AND (pr.store_id IS NULL OR pr.store_id = %s)
+        UNION ALL
+        SELECT t.product_id FROM promotion_item_tombstones t
+        WHERE t.deleted_txid >= %s AND (t.store_id IS NULL OR t.store_id = %s)
+    """
+    params.extend([store_id, since_txid])
+    params.extend([since_txid, store_id] * 3)
+    
+    if since_date != today:
+        changed_sql += """
+            UNION ALL
+            SELECT pi.product_id FROM promotion_items pi
             JOIN promotions pr ON pi.promotion_id = pr.promotion_id
-            WHERE pr.start_date <= %s AND pr.end_date >= %s
-        """, (current_date, current_date))
+            WHERE (pr.store_id IS NULL OR pr.store_id = %s)
+              AND ((pr.start_date > %s AND pr.start_date <= %s)
+                   OR (pr.end_date >= %s AND pr.end_date < %s))
+        """
+        params.extend([store_id, since_date, today, since_date, today])
+    return sql + f" AND i.product_id IN ({changed_sql}) ORDER BY i.product_id", params
+
+@app.route('/api/inventory/changes', methods=['GET'])
+@jwt_required()
+def get_inventory_changes():
+    """收银台增量同步：返回 since 之后变化的库存行（数量、价格或有效促销）和已删除的行
+
+    不带 since 时返回门店全量库存。响应中的 version 作为下一次请求的 since；
+    同一行可能被重复下发，客户端按 product_id 覆盖即可。
+    促销变化在读取时按门店计算（促销商品的增删、促销修改），不改写库存行。
+    删除记录只保留 INVENTORY_SYNC_RETENTION_TXIDS 个事务号：since 早于清理水位时
+    返回全量数据且 full 为 true，客户端应整体替换本地库存。
+    """
+    try:
+        current_user_id, current_role, current_store_id = get_current_user()
+        store_id = request.args.get('store_id')
         
-        promotions = cursor.fetchall()
-        promotion_dict = {}
-        for promo in promotions:
-            product_id, discount_type, discount_value = promo
-            promotion_dict[product_id] = {
-                'discount_type': discount_type,
-                'discount_value': float(discount_value)
-            }
+        if current_role in ['store_manager', 'cashier']:
+            store_id = current_store_id
+        if not store_id:
+            return {'message': '缺少门店ID'}, 400
         
-        cursor.close()
-        conn.close()
+        since = request.args.get('since')
+        try:
+            store_id = int(store_id)
+            since_txid, since_date = decode_sync_version(since) if since else (None, None)
+        except ValueError:
+            return {'message': '无效的同步版本号'}, 400
         
-        inventory_list = []
-        for item in inventory:
-            original_price = float(item[4]) if item[4] else 0
-            final_price = original_price
-            has_promotion = False
+        conn = get_db()
+        cursor = conn.cursor()
+        today = business_today()
+        promotion_engine.ensure_fresh(conn)
+        
+        # 先取水位：快照中最早的未结束事务号。小于它的事务都已可见，
+        # 大于等于它的修改会在下一次同步中再次检查，保证不漏数据
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        version = cursor.fetchone()[0]
+        
+        deleted = []
+        if since_txid is not None:
+            cursor.execute(*build_inventory_sync_query(store_id, since_txid, since_date, today))
+            rows = cursor.fetchall()
             
-            # 计算促销价格
-            if item[1] in promotion_dict:  # product_id
-                promo = promotion_dict[item[1]]
-                has_promotion = True
-                if promo['discount_type'] == 'percentage':
-                    final_price = original_price * (1 - promo['discount_value'] / 100)
-                elif promo['discount_type'] == 'fixed':
-                    final_price = max(0, original_price - promo['discount_value'])
+            cursor.execute("""
+                SELECT inventory_id, product_id FROM inventory_tombstones
+                WHERE store_id = %s AND deleted_txid >= %s
+                ORDER BY deleted_txid
+            """, (store_id, since_txid))
+            deleted = [{'inventory_id': row[0], 'product_id': row[1]} for row in cursor.fetchall()]
             
-            inventory_list.append({
-                'inventory_id': item[0],
-                'product_id': item[1],
-                'store_id': item[2],
-                'quantity': item[3],
-                'original_price': original_price,
-                'price': round(final_price, 2),  # 最终价格（含促销），保留两位小数
-                'has_promotion': has_promotion,
-                'product_name': item[5],
-                'name': item[5],  # 收银台需要的字段名
-                'store_name': item[6],
-                'updated_at': format_datetime_with_timezone(item[7]) if item[7] else None
-            })
+            # 在读完墓碑之后检查水位：清理与水位同一事务提交，这里看到的水位不会早于上面读到的墓碑
+            cursor.execute("SELECT purged_before_txid FROM inventory_sync_horizon WHERE id = 1")
+            horizon = cursor.fetchone()
+            if horizon and since_txid < horizon[0]:
+                since_txid = None
+                deleted = []
+        if since_txid is None:
+            cursor.execute(*build_inventory_sync_query(store_id))
+            rows = cursor.fetchall()
+        
+        result = {
+            'version': encode_sync_version(version, today),
+            'full': since_txid is None,
+            'changes': format_inventory_rows(rows, today),
+            'deleted': deleted
+        }
+        
+        try:
+            purge_inventory_sync_log(conn)
+        except Exception as purge_error:
+            conn.rollback()
+            app.logger.warning("清理同步墓碑失败: %s", purge_error)
         
-        return {'inventory': inventory_list}, 200
+        return result, 200
         
     except Exception as e:
-        return {'message': f'获取库存失败: {str(e)}'}, 500
+        return {'message': f'获取库存变化失败: {str(e)}'}, 500
 
 # ==================== 促销管理 ====================
 @app.route('/api/promotions/', methods=['POST'])
 @jwt_required()
-def create_promotion():
-    try:
-        current_user_id = int(get_jwt_identity())
-        
-        # 首先检查用户是否有创建促销的权限
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 检查用户权限
-        cursor.execute("""
-            SELECT rp.can_create
-            FROM role_permissions rp
-            JOIN system_features sf ON rp.feature_id = sf.feature_id
-            JOIN users u ON u.role = rp.role
-            WHERE u.user_id = %s AND sf.feature_code = 'promotion_management'
-        """, (current_user_id,))
+@require_permission('promotion_management', 'create', '您没有权限创建促销活动')
+def create_promotion():
+    try:
+        current_user_id, current_role, current_store_id = get_current_user()
         
-        permission_result = cursor.fetchone()
-        if not permission_result or not permission_result[0]:
-            cursor.close()
-            conn.close()
-            return {'message': '您没有权限创建促销活动'}, 403
+        conn = get_db()
+        cursor = conn.cursor()
         
         data = request.get_json()
         name = data.get('name')
@@ -1862,31 +2530,20 @@ def create_promotion():
         store_id = data.get('store_id')  # 门店ID，可选
         
         if not all([name, discount_type, discount_value, start_date, end_date]):
-            cursor.close()
-            conn.close()
             return {'message': '缺少必要参数'}, 400
         
         if not product_ids:
-            cursor.close()
-            conn.close()
             return {'message': '请选择参与促销的商品'}, 400
         
+        try:
+            # 去重并保持顺序，重复的商品ID只关联一次
+            product_ids = list(dict.fromkeys(int(product_id) for product_id in product_ids))
+        except (TypeError, ValueError):
+            return {'message': '商品ID格式错误'}, 400
+        
         if discount_type not in ['percentage', 'fixed']:
-            cursor.close()
-            conn.close()
             return {'message': '折扣类型必须是percentage或fixed'}, 400
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 权限检查和门店ID设置
         if current_role == 'system_admin':
             # 系统管理员可以创建全系统促销（store_id为NULL）或指定门店促销
@@ -1895,33 +2552,29 @@ def create_promotion():
             # 门店经理只能为自己的门店创建促销
             final_store_id = current_store_id
             if store_id and store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能为自己的门店创建促销活动'}, 403
         else:
             # 收银员不能创建促销
-            cursor.close()
-            conn.close()
             return {'message': '您没有权限创建促销活动'}, 403
         
         # 创建促销活动
+        versions_before = promotion_engine.lock_versions(cursor)
         cursor.execute(
             "INSERT INTO promotions (name, description, discount_type, discount_value, start_date, end_date, store_id, created_by) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING promotion_id",
             (name, description, discount_type, discount_value, start_date, end_date, final_store_id, current_user_id)
         )
         promotion_id = cursor.fetchone()[0]
         
-        # 添加促销商品关联
-        for product_id in product_ids:
-            cursor.execute(
-                "INSERT INTO promotion_items (promotion_id, product_id) VALUES (%s, %s)",
-                (promotion_id, product_id)
-            )
+        # 一条语句添加全部促销商品关联
+        cursor.execute("""
+            INSERT INTO promotion_items (promotion_id, product_id)
+            SELECT %s, product_id FROM unnest(%s::int[]) AS product_id
+            ON CONFLICT (promotion_id, product_id) DO NOTHING
+        """, (promotion_id, product_ids))
         
+        engine_update = promotion_engine.load_promotion(cursor, promotion_id, versions_before)
         conn.commit()
-        
-        cursor.close()
-        conn.close()
+        promotion_engine.apply_promotion(engine_update)
         
         return {
             'message': '促销活动创建成功',
@@ -1934,87 +2587,125 @@ def create_promotion():
     except Exception as e:
         return {'message': f'促销活动创建失败: {str(e)}'}, 500
 
+app.config['PROMOTION_PAGE_SIZE'] = int(os.getenv('PROMOTION_PAGE_SIZE', 50))
+app.config['PROMOTION_PAGE_SIZE_MAX'] = int(os.getenv('PROMOTION_PAGE_SIZE_MAX', 200))
+
+PROMOTION_STATUSES = ('pending', 'active', 'expired')
+
+def build_promotions_query(filters, today, limit, offset):
+    """生成促销列表查询，get_promotions 和 benchmarks/explain_baseline.py 共用
+
+    filters 可包含 visible_store_id（只看全系统促销和该门店促销）、store_id（门店ID或 'global'）、
+    status（PROMOTION_STATUSES 之一）。返回 (sql, params, count_sql, count_params)。
+    """
+    conditions = []
+    params = []
+    if filters.get('visible_store_id') is not None:
+        conditions.append("(p.store_id IS NULL OR p.store_id = %s)")
+        params.append(filters['visible_store_id'])
+    if filters.get('store_id') == 'global':
+        conditions.append("p.store_id IS NULL")
+    elif filters.get('store_id'):
+        conditions.append("p.store_id = %s")
+        params.append(filters['store_id'])
+    
+    status = filters.get('status')
+    if status == 'pending':
+        conditions.append("p.start_date > %s")
+        params.append(today)
+    elif status == 'active':
+        conditions.append("p.start_date <= %s AND p.end_date >= %s")
+        params.extend([today, today])
+    elif status == 'expired':
+        conditions.append("p.end_date < %s")
+        params.append(today)
+    
+    where_sql = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    # 商品列表用相关子查询按本页每个促销读取，走 (promotion_id, product_id) 唯一索引，
+    # 不对整个 promotion_items 做聚合；子查询在 LIMIT 之后只对本页的行执行
+    sql = f"""
+        SELECT p.promotion_id, p.name, p.description, p.discount_type, p.discount_value,
+               p.start_date, p.end_date, p.store_id, s.name as store_name, p.created_by,
+               CASE
+                   WHEN p.start_date IS NULL OR p.end_date IS NULL THEN 'inactive'
+                   WHEN p.start_date > %s THEN 'pending'
+                   WHEN p.end_date >= %s THEN 'active'
+                   ELSE 'expired'
+               END AS status,
+               ARRAY(
+                   SELECT pi.product_id FROM promotion_items pi
+                   JOIN products pd ON pi.product_id = pd.product_id
+                   WHERE pi.promotion_id = p.promotion_id
+                   ORDER BY pi.product_id
+               ) AS product_ids,
+               ARRAY(
+                   SELECT pd.name FROM promotion_items pi
+                   JOIN products pd ON pi.product_id = pd.product_id
+                   WHERE pi.promotion_id = p.promotion_id
+                   ORDER BY pi.product_id
+               ) AS product_names
+        FROM promotions p
+        LEFT JOIN stores s ON p.store_id = s.store_id
+        {where_sql}
+        ORDER BY p.promotion_id DESC
+        LIMIT %s OFFSET %s
+    """
+    return (sql, [today, today] + params + [limit, offset],
+            f"SELECT COUNT(*) FROM promotions p {where_sql}", params)
+
 @app.route('/api/promotions/', methods=['GET'])
 @jwt_required()
 def get_promotions():
+    """促销活动列表：一条语句返回本页促销及其商品，状态在SQL中计算
+
+    查询参数：status（pending/active/expired）、store_id（系统管理员可用，global 表示全系统促销）、page/limit
+    """
     try:
-        from datetime import datetime, date
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        current_user_id, current_role, current_store_id = get_current_user()
+        current_date = business_today()
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
+        try:
+            filters = {}
+            
+            # 根据用户角色查询不同的促销活动
+            if current_role != 'system_admin':
+                # 门店经理和收银员只能查看全系统促销和自己门店的促销
+                filters['visible_store_id'] = current_store_id
+            else:
+                # 系统管理员可以查看所有促销活动，可按门店筛选
+                store_id = request.args.get('store_id')
+                if store_id == 'global':
+                    filters['store_id'] = 'global'
+                elif store_id:
+                    filters['store_id'] = int(store_id)
+            
+            status = request.args.get('status')
+            if status and status not in PROMOTION_STATUSES:
+                return {'message': '无效的促销状态'}, 400
+            filters['status'] = status
+            
+            page = max(int(request.args.get('page', 1)), 1)
+            limit = min(max(int(request.args.get('limit', app.config['PROMOTION_PAGE_SIZE'])), 1),
+                        app.config['PROMOTION_PAGE_SIZE_MAX'])
+        except (ValueError, TypeError):
+            return {'message': '查询参数格式错误'}, 400
         
-        # 根据用户角色查询不同的促销活动
-        if current_role == 'system_admin':
-            # 系统管理员可以查看所有促销活动
-            cursor.execute("""
-                SELECT p.promotion_id, p.name, p.description, p.discount_type, p.discount_value, 
-                       p.start_date, p.end_date, p.store_id, s.name as store_name, p.created_by
-                FROM promotions p
-                LEFT JOIN stores s ON p.store_id = s.store_id
-                ORDER BY p.promotion_id DESC
-            """)
-        else:
-            # 门店经理和收银员只能查看全系统促销和自己门店的促销
-            cursor.execute("""
-                SELECT p.promotion_id, p.name, p.description, p.discount_type, p.discount_value, 
-                       p.start_date, p.end_date, p.store_id, s.name as store_name, p.created_by
-                FROM promotions p
-                LEFT JOIN stores s ON p.store_id = s.store_id
-                WHERE p.store_id IS NULL OR p.store_id = %s
-                ORDER BY p.promotion_id DESC
-            """, (current_store_id,))
+        conn = get_db()
+        cursor = conn.cursor()
         
+        sql, page_params, count_sql, params = build_promotions_query(filters, current_date, limit, (page - 1) * limit)
+        cursor.execute(sql, page_params)
         promotions = cursor.fetchall()
         
-        promotions_list = []
-        current_date = date.today()
+        cursor.execute(count_sql, params)
+        total = cursor.fetchone()[0]
         
+        promotions_list = []
         for promotion in promotions:
-            # 获取参与促销的商品
-            cursor.execute("""
-                SELECT p.product_id, p.name
-                FROM promotion_items pi
-                JOIN products p ON pi.product_id = p.product_id
-                WHERE pi.promotion_id = %s
-            """, (promotion[0],))
-            products = cursor.fetchall()
-            
-            # 处理日期格式
             start_date = promotion[5]
             end_date = promotion[6]
-            
-            # 判断促销状态
-            status = 'inactive'
-            if start_date and end_date:
-                # 确保日期类型一致，都转换为date类型
-                if hasattr(start_date, 'date'):
-                    start_date_cmp = start_date.date()
-                else:
-                    start_date_cmp = start_date
-                    
-                if hasattr(end_date, 'date'):
-                    end_date_cmp = end_date.date()
-                else:
-                    end_date_cmp = end_date
-                
-                if current_date < start_date_cmp:
-                    status = 'pending'  # 未开始
-                elif start_date_cmp <= current_date <= end_date_cmp:
-                    status = 'active'   # 进行中
-                else:
-                    status = 'expired'  # 已过期
+            product_ids = promotion[11] or []
+            product_names = promotion[12] or []
             
             promotions_list.append({
                 'promotion_id': promotion[0],
@@ -2027,43 +2718,31 @@ def get_promotions():
                 'store_id': promotion[7],
                 'store_name': promotion[8] if promotion[8] else '全系统',
                 'created_by': promotion[9],
-                'status': status,
-                'products': [{'product_id': p[0], 'name': p[1]} for p in products]
+                'status': promotion[10],
+                'products': [{'product_id': product_id, 'name': name}
+                             for product_id, name in zip(product_ids, product_names)]
             })
         
-        cursor.close()
-        conn.close()
-        
-        return {'promotions': promotions_list}, 200
+        return {
+            'promotions': promotions_list,
+            'page': page,
+            'limit': limit,
+            'total': total
+        }, 200
         
     except Exception as e:
         return {'message': f'获取促销活动失败: {str(e)}'}, 500
 
 @app.route('/api/promotions/<int:promotion_id>', methods=['PUT'])
 @jwt_required()
+@require_permission('promotion_management', 'edit', '您没有权限编辑促销活动')
 def update_promotion(promotion_id):
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
-        # 首先检查用户是否有编辑促销的权限
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 检查用户权限
-        cursor.execute("""
-            SELECT rp.can_edit
-            FROM role_permissions rp
-            JOIN system_features sf ON rp.feature_id = sf.feature_id
-            JOIN users u ON u.role = rp.role
-            WHERE u.user_id = %s AND sf.feature_code = 'promotion_management'
-        """, (current_user_id,))
-        
-        permission_result = cursor.fetchone()
-        if not permission_result or not permission_result[0]:
-            cursor.close()
-            conn.close()
-            return {'message': '您没有权限编辑促销活动'}, 403
-        
         data = request.get_json()
         name = data.get('name')
         description = data.get('description', '')
@@ -2074,37 +2753,24 @@ def update_promotion(promotion_id):
         product_ids = data.get('product_ids', [])
         
         if not all([name, discount_type, discount_value, start_date, end_date]):
-            cursor.close()
-            conn.close()
             return {'message': '缺少必要参数'}, 400
         
         if not product_ids:
-            cursor.close()
-            conn.close()
             return {'message': '请选择参与促销的商品'}, 400
         
+        try:
+            # 去重并保持顺序，重复的商品ID只关联一次
+            product_ids = list(dict.fromkeys(int(product_id) for product_id in product_ids))
+        except (TypeError, ValueError):
+            return {'message': '商品ID格式错误'}, 400
+        
         if discount_type not in ['percentage', 'fixed']:
-            cursor.close()
-            conn.close()
             return {'message': '折扣类型必须是percentage或fixed'}, 400
         
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 检查促销活动是否存在并获取其信息
         cursor.execute("SELECT store_id, created_by FROM promotions WHERE promotion_id = %s", (promotion_id,))
         promotion_info = cursor.fetchone()
         if not promotion_info:
-            cursor.close()
-            conn.close()
             return {'message': '促销活动不存在'}, 404
         
         promotion_store_id, promotion_created_by = promotion_info
@@ -2116,20 +2782,15 @@ def update_promotion(promotion_id):
         elif current_role == 'store_manager':
             # 门店经理只能修改自己门店的促销活动或自己创建的全系统促销
             if promotion_store_id is not None and promotion_store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能修改自己门店的促销活动'}, 403
             if promotion_store_id is None and promotion_created_by != current_user_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能修改自己创建的全系统促销活动'}, 403
         else:
             # 收银员不能修改促销
-            cursor.close()
-            conn.close()
             return {'message': '您没有权限修改促销活动'}, 403
         
         # 更新促销活动
+        versions_before = promotion_engine.lock_versions(cursor)
         cursor.execute("""
             UPDATE promotions 
             SET name = %s, description = %s, discount_type = %s, discount_value = %s, 
@@ -2137,19 +2798,23 @@ def update_promotion(promotion_id):
             WHERE promotion_id = %s
         """, (name, description, discount_type, discount_value, start_date, end_date, promotion_id))
         
-        # 删除旧的商品关联
-        cursor.execute("DELETE FROM promotion_items WHERE promotion_id = %s", (promotion_id,))
+        # 只删除移出促销的商品关联
+        cursor.execute("""
+            DELETE FROM promotion_items
+            WHERE promotion_id = %s AND NOT (product_id = ANY(%s::int[]))
+        """, (promotion_id, product_ids))
         
-        # 添加新的商品关联
-        for product_id in product_ids:
-            cursor.execute(
-                "INSERT INTO promotion_items (promotion_id, product_id) VALUES (%s, %s)",
-                (promotion_id, product_id)
-            )
+        # 只添加新加入促销的商品关联；已有的关联由唯一约束 uq_promotion_items_promotion_product 跳过，
+        # 并发编辑同一促销时不会因为先查后插而重复插入报错
+        cursor.execute("""
+            INSERT INTO promotion_items (promotion_id, product_id)
+            SELECT %s, product_id FROM unnest(%s::int[]) AS product_id
+            ON CONFLICT (promotion_id, product_id) DO NOTHING
+        """, (promotion_id, product_ids))
         
+        engine_update = promotion_engine.load_promotion(cursor, promotion_id, versions_before)
         conn.commit()
-        cursor.close()
-        conn.close()
+        promotion_engine.apply_promotion(engine_update)
         
         return {
             'message': '促销活动更新成功',
@@ -2163,45 +2828,18 @@ def update_promotion(promotion_id):
 
 @app.route('/api/promotions/<int:promotion_id>', methods=['DELETE'])
 @jwt_required()
+@require_permission('promotion_management', 'delete', '您没有权限删除促销活动')
 def delete_promotion(promotion_id):
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 首先检查用户是否有删除促销的权限
-        cursor.execute("""
-            SELECT rp.can_delete
-            FROM role_permissions rp
-            JOIN system_features sf ON rp.feature_id = sf.feature_id
-            JOIN users u ON u.role = rp.role
-            WHERE u.user_id = %s AND sf.feature_code = 'promotion_management'
-        """, (current_user_id,))
-        
-        permission_result = cursor.fetchone()
-        if not permission_result or not permission_result[0]:
-            cursor.close()
-            conn.close()
-            return {'message': '您没有权限删除促销活动'}, 403
-        
-        # 获取当前用户信息以进行权限检查
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 检查促销活动是否存在并获取其信息
         cursor.execute("SELECT store_id, created_by FROM promotions WHERE promotion_id = %s", (promotion_id,))
         promotion_info = cursor.fetchone()
         if not promotion_info:
-            cursor.close()
-            conn.close()
             return {'message': '促销活动不存在'}, 404
         
         promotion_store_id, promotion_created_by = promotion_info
@@ -2213,152 +2851,333 @@ def delete_promotion(promotion_id):
         elif current_role == 'store_manager':
             # 门店经理只能删除自己门店的促销活动或自己创建的全系统促销
             if promotion_store_id is not None and promotion_store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能删除自己门店的促销活动'}, 403
             if promotion_store_id is None and promotion_created_by != current_user_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能删除自己创建的全系统促销活动'}, 403
         else:
             # 收银员不能删除促销
-            cursor.close()
-            conn.close()
             return {'message': '您没有权限删除促销活动'}, 403
         
         # 删除商品关联
+        versions_before = promotion_engine.lock_versions(cursor)
         cursor.execute("DELETE FROM promotion_items WHERE promotion_id = %s", (promotion_id,))
         
         # 删除促销活动
         cursor.execute("DELETE FROM promotions WHERE promotion_id = %s", (promotion_id,))
         
+        engine_update = promotion_engine.load_promotion(cursor, promotion_id, versions_before)
         conn.commit()
-        cursor.close()
-        conn.close()
+        promotion_engine.apply_promotion(engine_update)
         
         return {'message': '促销活动删除成功'}, 200
         
     except Exception as e:
         return {'message': f'促销活动删除失败: {str(e)}'}, 500
 
+# ==================== 销售日汇总 ====================
+# 营业日按北京时间划分
+BUSINESS_DATE_SQL = "(sale_timestamp AT TIME ZONE 'Asia/Shanghai')::date"
+
+def apply_sales_rollup(cursor, store_id, rows, sign=1):
+    """在调用方事务中累加（sign=-1 时扣减）日汇总
+
+    rows 为 [(business_date, product_id, units, revenue, sale_count)]。调用方需已锁定
+    对应 (store_id, product_id) 的库存行，同一汇总行的并发更新因此串行，先UPDATE再INSERT不会冲突。
+    """
+    if not rows:
+        return
+    values = values_list(
+        cursor, '(%s::date, %s::int, %s::bigint, %s::numeric, %s::int)',
+        [(business_date, product_id, sign * units, sign * revenue, sign * sale_count)
+         for business_date, product_id, units, revenue, sale_count in rows]
+    )
+    cursor.execute(f"""
+        UPDATE sales_daily_rollup AS r
+        SET units = r.units + d.units, revenue = r.revenue + d.revenue, sale_count = r.sale_count + d.sale_count
+        FROM (VALUES {values}) AS d(business_date, product_id, units, revenue, sale_count)
+        WHERE r.store_id = %s AND r.business_date = d.business_date AND r.product_id = d.product_id
+    """, (store_id,))
+    if sign > 0:
+        cursor.execute(f"""
+            INSERT INTO sales_daily_rollup (store_id, business_date, product_id, units, revenue, sale_count)
+            SELECT %s, d.business_date, d.product_id, d.units, d.revenue, d.sale_count
+            FROM (VALUES {values}) AS d(business_date, product_id, units, revenue, sale_count)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM sales_daily_rollup r
+                WHERE r.store_id = %s AND r.business_date = d.business_date AND r.product_id = d.product_id
+            )
+        """, (store_id, store_id))
+    else:
+        cursor.execute("""
+            DELETE FROM sales_daily_rollup
+            WHERE store_id = %s AND business_date = ANY(%s) AND sale_count <= 0
+        """, (store_id, list({row[0] for row in rows})))
+
+def rebuild_sales_rollup(conn, start_date=None, end_date=None):
+    """从 sales/sale_items 重建日汇总（可限定营业日范围），返回写入的行数
+
+    重建期间对汇总表加排他锁，并发结账会等待重建完成后再累加，结果一致。
+    """
+    cursor = conn.cursor()
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("business_date >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("business_date <= %s")
+        params.append(end_date)
+    where_sql = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    
+    cursor.execute("LOCK TABLE sales_daily_rollup IN EXCLUSIVE MODE")
+    cursor.execute(f"DELETE FROM sales_daily_rollup {where_sql}", params)
+    cursor.execute(f"""
+        INSERT INTO sales_daily_rollup (store_id, business_date, product_id, units, revenue, sale_count)
+        SELECT store_id, business_date, product_id, SUM(quantity), SUM(quantity * price_per_unit), COUNT(DISTINCT sale_id)
+        FROM (
+            SELECT s.store_id, (s.sale_timestamp AT TIME ZONE 'Asia/Shanghai')::date AS business_date,
+                   s.sale_id, si.product_id, si.quantity, si.price_per_unit
+            FROM sales s
+            JOIN sale_items si ON si.sale_id = s.sale_id
+        ) AS lines
+        {where_sql}
+        GROUP BY store_id, business_date, product_id
+    """, params)
+    written = cursor.rowcount
+    conn.commit()
+    return written
+
+def sale_rollup_rows(business_date, lines):
+    """把一笔销售的明细 [(product_id, quantity, price)] 汇总为日汇总增量行"""
+    per_product = {}
+    for product_id, quantity, price in lines:
+        units, revenue = per_product.get(product_id, (0, Decimal('0')))
+        per_product[product_id] = (units + quantity, revenue + quantity * Decimal(price))
+    return [(business_date, product_id, units, revenue, 1)
+            for product_id, (units, revenue) in sorted(per_product.items())]
+
 # ==================== 销售管理 ====================
+# ==================== 结账幂等 ====================
+app.config['IDEMPOTENCY_KEY_TTL'] = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))          # 幂等键保留时间（秒）
+app.config['IDEMPOTENCY_PURGE_INTERVAL'] = int(os.getenv('IDEMPOTENCY_PURGE_INTERVAL', 300))  # 清理过期键的最小间隔（秒）
+
+_last_idempotency_purge = 0.0
+
+def request_fingerprint(data):
+    """计算请求体摘要，同一个幂等键只能用于相同的购物车"""
+    payload = json.dumps({'store_id': data.get('store_id'), 'items': data.get('items')},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def find_idempotent_sale(conn, idempotency_key, user_id):
+    """查询未过期的幂等记录，返回 (request_hash, sale_id, total_amount, items_count) 或 None"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT request_hash, sale_id, total_amount, items_count FROM idempotency_keys
+        WHERE idempotency_key = %s AND user_id = %s AND expires_at > CURRENT_TIMESTAMP
+    """, (idempotency_key, user_id))
+    row = cursor.fetchone()
+    conn.commit()
+    return row
+
+def replay_idempotent_sale(record, request_hash):
+    """根据幂等记录构造响应：返回原销售单，不再重复执行结账"""
+    stored_hash, sale_id, total_amount, items_count = record
+    if stored_hash != request_hash:
+        return {'message': '该幂等键已用于不同的销售请求'}, 422
+    return {
+        'message': '销售记录创建成功',
+        'sale_id': sale_id,
+        'total_amount': float(total_amount),
+        'items_count': items_count
+    }, 201, {'Idempotent-Replayed': 'true'}
+
+def purge_expired_idempotency_keys(conn):
+    """按间隔清理过期幂等键（每个进程最多每 IDEMPOTENCY_PURGE_INTERVAL 秒一次）"""
+    global _last_idempotency_purge
+    now = time.monotonic()
+    if now - _last_idempotency_purge < app.config['IDEMPOTENCY_PURGE_INTERVAL']:
+        return
+    _last_idempotency_purge = now
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP")
+    conn.commit()
+
+CHECKOUT_LOCK_INVENTORY_SQL = """
+    SELECT product_id, quantity, price FROM inventory
+    WHERE store_id = %s AND product_id = ANY(%s)
+    ORDER BY product_id
+    FOR UPDATE
+"""
+
+def _checkout(conn, store_id, cashier_id, cart, needed, idempotency=None):
+    """结账事务：返回 (sale_id, 总金额, None)，库存不足时回滚并返回 (None, None, 不足商品列表)
+
+    cart 为 [(product_id, quantity)]，成交价由服务端按门店库存价和当前促销计算，
+    不使用客户端提交的价格。
+
+    idempotency 为 (幂等键, 请求摘要) 时，先在同一事务中插入幂等键：
+    并发的重复请求会在主键上等待，前一个提交后以唯一约束冲突结束。
+    """
+    cursor = conn.cursor()
+    product_ids = sorted(needed)
+    
+    if idempotency:
+        idempotency_key, request_hash = idempotency
+        cursor.execute("""
+            DELETE FROM idempotency_keys
+            WHERE idempotency_key = %s AND user_id = %s AND expires_at <= CURRENT_TIMESTAMP
+        """, (idempotency_key, cashier_id))
+        cursor.execute("""
+            INSERT INTO idempotency_keys (idempotency_key, user_id, request_hash, expires_at)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+        """, (idempotency_key, cashier_id, request_hash, app.config['IDEMPOTENCY_KEY_TTL']))
+    
+    # 按product_id顺序锁定库存行，并发结账以相同顺序加锁，避免死锁
+    cursor.execute(CHECKOUT_LOCK_INVENTORY_SQL, (store_id, product_ids))
+    stock = {}
+    base_prices = {}
+    for product_id, quantity, price in cursor.fetchall():
+        stock[product_id] = quantity
+        base_prices[product_id] = price
+    
+    insufficient = [{
+        'product_id': product_id,
+        'available': stock.get(product_id, 0),
+        'required': needed[product_id]
+    } for product_id in product_ids if stock.get(product_id, 0) < needed[product_id]]
+    if insufficient:
+        conn.rollback()
+        return None, None, insufficient
+    
+    # 整个购物车一次批量定价（索引已在加锁前由 create_sale 检查）
+    prices = promotion_engine.price_rows([(store_id, product_id, base_prices[product_id]) for product_id, _ in cart])
+    lines = [(product_id, quantity, final_price) for (product_id, quantity), (final_price, _) in zip(cart, prices)]
+    total_amount = sum((quantity * final_price for _, quantity, final_price in lines), Decimal('0'))
+    
+    # 一条语句扣减所有商品库存，行已加锁，条件仍保留作为防超卖保护
+    cursor.execute(f"""
+        UPDATE inventory AS i
+        SET quantity = i.quantity - n.quantity, updated_at = CURRENT_TIMESTAMP
+        FROM (VALUES {values_list(cursor, '(%s::int, %s::int)', [(p, needed[p]) for p in product_ids])}) AS n(product_id, quantity)
+        WHERE i.store_id = %s AND i.product_id = n.product_id AND i.quantity >= n.quantity
+    """, (store_id,))
+    if cursor.rowcount != len(product_ids):
+        raise CheckoutConflict(f'门店 {store_id} 库存扣减 {cursor.rowcount} 行，购物车有 {len(product_ids)} 种商品')
+    
+    cursor.execute(
+        f"INSERT INTO sales (store_id, cashier_id, total_amount) VALUES (%s, %s, %s) RETURNING sale_id, {BUSINESS_DATE_SQL}",
+        (store_id, cashier_id, total_amount)
+    )
+    sale_id, business_date = cursor.fetchone()
+    
+    # 一条多行INSERT写入全部销售明细
+    cursor.execute(f"""
+        INSERT INTO sale_items (sale_id, product_id, quantity, price_per_unit)
+        SELECT %s, l.product_id, l.quantity, l.price_per_unit
+        FROM (VALUES {values_list(cursor, '(%s::int, %s::int, %s::numeric)', lines)}) AS l(product_id, quantity, price_per_unit)
+    """, (sale_id,))
+    
+    apply_sales_rollup(cursor, store_id, sale_rollup_rows(business_date, lines))
+    
+    if idempotency:
+        cursor.execute("""
+            UPDATE idempotency_keys SET sale_id = %s, total_amount = %s, items_count = %s
+            WHERE idempotency_key = %s AND user_id = %s
+        """, (sale_id, total_amount, len(lines), idempotency_key, cashier_id))
+    
+    # 提交销售、库存更新和幂等记录
+    conn.commit()
+    return sale_id, total_amount, None
+
 @app.route('/api/sales/', methods=['POST'])
 @jwt_required()
 def create_sale():
-    conn = None
-    cursor = None
     try:
         data = request.get_json()
         store_id = data.get('store_id')
         items = data.get('items', [])
         payment_method = data.get('payment_method', 'cash')
         
-        # 调试信息 - 打印接收到的数据
-        print(f"收到销售请求数据: store_id={store_id}, items={items}")
+        app.logger.debug("收到销售请求: store_id=%s, items=%s", store_id, items)
         
         if not all([store_id, items]):
             return {'message': '缺少必要参数'}, 400
         
-        current_user_id = int(get_jwt_identity())
-        print(f"当前用户ID: {current_user_id}")
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 查询当前用户信息进行调试
-        cursor.execute("SELECT user_id, username, role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        user_info = cursor.fetchone()
-        if user_info:
-            print(f"用户信息: ID={user_info[0]}, 用户名={user_info[1]}, 角色={user_info[2]}, 门店ID={user_info[3]}")
-            
-            # 检查用户门店ID与请求门店ID是否匹配
-            user_store_id = user_info[3]
-            if user_store_id is None:
-                print(f"❌ 警告: 用户 {user_info[1]} 没有分配门店ID!")
-            elif user_store_id != store_id:
-                print(f"⚠️ 注意: 用户门店ID ({user_store_id}) 与请求门店ID ({store_id}) 不匹配")
-        else:
-            print(f"❌ 找不到用户ID {current_user_id} 的信息")
-        
-        # 计算总金额，支持unit_price或price_per_unit字段
-        total_amount = 0
-        for item in items:
-            quantity = item['quantity']
-            # 兼容两种价格字段名
-            unit_price = item.get('unit_price') or item.get('price_per_unit', 0)
-            total_amount += quantity * unit_price
-        
-        cursor.execute(
-            "INSERT INTO sales (store_id, cashier_id, total_amount) VALUES (%s, %s, %s) RETURNING sale_id",
-            (store_id, current_user_id, total_amount)
-        )
-        sale_id = cursor.fetchone()[0]
-        
-        # 处理每个销售项目
+        current_user_id, current_role, current_store_id = get_current_user()
+        app.logger.debug("当前用户ID=%s, 角色=%s, 门店ID=%s", current_user_id, current_role, current_store_id)
+        
+        # 幂等键：重试的请求直接返回原销售单
+        idempotency = None
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+        if idempotency_key:
+            if len(idempotency_key) > 100:
+                return {'message': 'Idempotency-Key 长度不能超过100'}, 400
+            request_hash = request_fingerprint(data)
+            record = find_idempotent_sale(get_db(), idempotency_key, current_user_id)
+            if record:
+                return replay_idempotent_sale(record, request_hash)
+            idempotency = (idempotency_key, request_hash)
+        
+        if current_store_id is None:
+            app.logger.debug("用户 %s 没有分配门店ID", current_user_id)
+        elif current_store_id != store_id:
+            app.logger.debug("用户门店ID (%s) 与请求门店ID (%s) 不匹配", current_store_id, store_id)
+        
+        # 解析购物车（客户端的unit_price仅供显示，成交价由服务端计算）
+        cart = []
+        needed = {}  # product_id -> 需要扣减的总数量（同一商品可能出现在多行）
         for item in items:
-            product_id = item['product_id']
-            quantity = item['quantity']
-            unit_price = item.get('unit_price') or item.get('price_per_unit', 0)
-            
-            # 检查库存是否足够
-            cursor.execute(
-                "SELECT quantity FROM inventory WHERE store_id = %s AND product_id = %s",
-                (store_id, product_id)
-            )
-            stock_result = cursor.fetchone()
-            
-            if not stock_result or stock_result[0] < quantity:
-                conn.rollback()
-                cursor.close()
-                conn.close()
-                return {'message': f'商品ID {product_id} 库存不足，当前库存: {stock_result[0] if stock_result else 0}，需要: {quantity}'}, 400
-            
-            # 插入销售明细
-            cursor.execute(
-                "INSERT INTO sale_items (sale_id, product_id, quantity, price_per_unit) VALUES (%s, %s, %s, %s)",
-                (sale_id, product_id, quantity, unit_price)
-            )
-            
-            # 更新库存 - 添加调试信息
-            print(f"更新库存: 商品ID {product_id}, 门店ID {store_id}, 减少数量 {quantity}")
-            cursor.execute(
-                "UPDATE inventory SET quantity = quantity - %s WHERE store_id = %s AND product_id = %s",
-                (quantity, store_id, product_id)
-            )
-            
-            # 检查UPDATE语句影响的行数
-            affected_rows = cursor.rowcount
-            print(f"UPDATE影响的行数: {affected_rows}")
-            
-            if affected_rows == 0:
-                print(f"❌ 警告: 没有找到匹配的库存记录! 门店ID: {store_id}, 商品ID: {product_id}")
-                # 查询是否存在该商品的库存记录
-                cursor.execute(
-                    "SELECT store_id, product_id, quantity FROM inventory WHERE product_id = %s",
-                    (product_id,)
-                )
-                all_inventory = cursor.fetchall()
-                print(f"该商品的所有库存记录: {all_inventory}")
-            
-            # 验证更新结果
-            cursor.execute(
-                "SELECT quantity FROM inventory WHERE store_id = %s AND product_id = %s",
-                (store_id, product_id)
-            )
-            new_quantity = cursor.fetchone()
-            print(f"库存更新后: 商品ID {product_id}, 新库存 {new_quantity[0] if new_quantity else 'NULL'}")
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+            if quantity <= 0:
+                return {'message': f'商品ID {product_id} 的数量必须大于0'}, 400
+            cart.append((product_id, quantity))
+            needed[product_id] = needed.get(product_id, 0) + quantity
         
-        # 先提交销售和库存更新
-        conn.commit()
+        # 在锁库存行之前检查促销索引，需要重建时不占用行锁
+        promotion_engine.ensure_fresh(get_db())
+        get_db().rollback()
         
-        # 记录销售日志（单独处理，避免日志错误影响主事务）
+        try:
+            sale_id, total_amount, insufficient = run_in_transaction(_checkout, store_id, current_user_id, cart,
+                                                                     needed, idempotency)
+        except psycopg2.Error as e:
+            # 库存CHECK约束兜底（例如与手工调整库存并发），按库存不足处理而不是500
+            if e.pgcode == errorcodes.CHECK_VIOLATION:
+                return {'message': '库存不足，请刷新后重试'}, 409
+            # 相同幂等键的并发请求已先提交，返回其结果
+            if e.pgcode == errorcodes.UNIQUE_VIOLATION and idempotency:
+                record = find_idempotent_sale(get_db(), idempotency_key, current_user_id)
+                if record:
+                    return replay_idempotent_sale(record, idempotency[1])
+                return {'message': '相同的销售请求正在处理中，请稍后重试'}, 409
+            raise
+        except CheckoutConflict:
+            return {'message': '库存正在被其他订单修改，请稍后重试'}, 409
+        
+        if insufficient:
+            return {
+                'message': '；'.join(
+                    f"商品ID {entry['product_id']} 库存不足，当前库存: {entry['available']}，需要: {entry['required']}"
+                    for entry in insufficient
+                ),
+                'insufficient': insufficient
+            }, 400
+        
+        dashboard_cache.invalidate_store(store_id)
+        
+        # 记录销售日志（交给后台线程批量写入，日志错误不影响已提交的销售）
         try:
             log_action(current_user_id, 'create_sale', f'创建销售订单 #{sale_id}，金额: ¥{total_amount:.2f}')
         except Exception as log_error:
             print(f"记录销售日志失败，但销售已成功: {log_error}")
         
-        cursor.close()
-        conn.close()
+        if idempotency:
+            try:
+                purge_expired_idempotency_keys(get_db())
+            except Exception as purge_error:
+                app.logger.warning("清理过期幂等键失败: %s", purge_error)
         
         return {
             'message': '销售记录创建成功',
@@ -2369,128 +3188,521 @@ def create_sale():
         
     except Exception as e:
         print(f"销售创建异常: {str(e)}")
-        if conn:
-            conn.rollback()
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
         return {'message': f'销售记录创建失败: {str(e)}'}, 500
 
+app.config['SALES_BATCH_MAX_SIZE'] = int(os.getenv('SALES_BATCH_MAX_SIZE', 2000))  # 单次补传最多销售单数
+
+def parse_offline_sale(sale):
+    """校验一条离线销售单，返回 (client_sale_id, sale_timestamp, lines, 错误原因)"""
+    client_sale_id = str(sale.get('client_sale_id') or '').strip()
+    if not client_sale_id:
+        return None, None, None, '缺少client_sale_id'
+    if len(client_sale_id) > 100:
+        return client_sale_id, None, None, 'client_sale_id 长度不能超过100'
+    
+    sale_timestamp = sale.get('sale_timestamp')
+    if sale_timestamp:
+        try:
+            sale_timestamp = datetime.fromisoformat(str(sale_timestamp).replace('Z', '+00:00'))
+        except ValueError:
+            return client_sale_id, None, None, '销售时间格式错误'
+        if sale_timestamp.tzinfo is None:
+            # 收银端未带时区时按北京时间处理
+            sale_timestamp = sale_timestamp.replace(tzinfo=BEIJING_TZ)
+    else:
+        sale_timestamp = None
+    
+    items = sale.get('items') or []
+    if not items:
+        return client_sale_id, None, None, '销售单没有商品'
+    lines = []
+    try:
+        for item in items:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+            if quantity <= 0:
+                return client_sale_id, None, None, f'商品ID {product_id} 的数量必须大于0'
+            # 离线单价是收银端实际收取的价格，缺失或不为正数时整单拒绝，不能按0元入账
+            unit_price = item.get('unit_price')
+            if unit_price is None:
+                unit_price = item.get('price_per_unit')
+            if unit_price is None or unit_price == '':
+                return client_sale_id, None, None, f'商品ID {product_id} 缺少单价'
+            unit_price = Decimal(str(unit_price))
+            if not unit_price.is_finite() or unit_price <= 0:
+                return client_sale_id, None, None, f'商品ID {product_id} 的单价必须大于0'
+            lines.append((product_id, quantity, unit_price))
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return client_sale_id, None, None, '商品明细格式错误'
+    return client_sale_id, sale_timestamp, lines, None
+
+def _apply_sales_batch(conn, store_id, cashier_id, sales):
+    """批量补传事务：去重、锁库存逐单判断、COPY到临时表后集合化写入
+
+    sales 为 [(client_sale_id, sale_timestamp, lines)]，按上传顺序处理，
+    返回 {client_sale_id: 结果字典}。
+    """
+    cursor = conn.cursor()
+    results = {}
+    
+    # 已经上传过的销售单直接返回原sale_id
+    cursor.execute(
+        "SELECT client_sale_id, sale_id FROM sales WHERE store_id = %s AND client_sale_id = ANY(%s)",
+        (store_id, [client_sale_id for client_sale_id, _, _ in sales])
+    )
+    for client_sale_id, sale_id in cursor.fetchall():
+        results[client_sale_id] = {'client_sale_id': client_sale_id, 'status': 'duplicate', 'sale_id': sale_id}
+    pending = [sale for sale in sales if sale[0] not in results]
+    if not pending:
+        conn.rollback()
+        return results
+    
+    # 按product_id顺序锁定涉及的库存行，与单笔结账的加锁顺序一致
+    product_ids = sorted({line[0] for _, _, lines in pending for line in lines})
+    cursor.execute("""
+        SELECT product_id, quantity FROM inventory
+        WHERE store_id = %s AND product_id = ANY(%s)
+        ORDER BY product_id
+        FOR UPDATE
+    """, (store_id, product_ids))
+    stock = dict(cursor.fetchall())
+    
+    # 按上传顺序逐单扣减，库存不足的整单拒绝
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    accepted = 0
+    seq = 0  # 明细行号，保证写入顺序与上传顺序一致
+    for client_sale_id, sale_timestamp, lines in pending:
+        needed = {}
+        for product_id, quantity, _ in lines:
+            needed[product_id] = needed.get(product_id, 0) + quantity
+        short = [{
+            'product_id': product_id,
+            'available': stock.get(product_id, 0),
+            'required': quantity
+        } for product_id, quantity in needed.items() if stock.get(product_id, 0) < quantity]
+        if short:
+            results[client_sale_id] = {
+                'client_sale_id': client_sale_id,
+                'status': 'rejected',
+                'reason': '库存不足',
+                'insufficient': short
+            }
+            continue
+        for product_id, quantity in needed.items():
+            stock[product_id] -= quantity
+        for product_id, quantity, unit_price in lines:
+            seq += 1
+            writer.writerow([seq, client_sale_id, sale_timestamp.isoformat() if sale_timestamp else '',
+                             product_id, quantity, unit_price])
+        accepted += 1
+    
+    if not accepted:
+        conn.rollback()
+        return results
+    
+    # 通过COPY装载到会话临时表（提交后自动清空），再一次性写入销售单、明细和库存
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS sales_batch_staging (
+            seq INT NOT NULL,
+            client_sale_id VARCHAR(100) NOT NULL,
+            sale_timestamp TIMESTAMP WITH TIME ZONE,
+            product_id INT NOT NULL,
+            quantity INT NOT NULL,
+            price_per_unit DECIMAL(10, 2) NOT NULL
+        ) ON COMMIT DELETE ROWS
+    """)
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY sales_batch_staging (seq, client_sale_id, sale_timestamp, product_id, quantity, price_per_unit) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    
+    cursor.execute("""
+        INSERT INTO sales (store_id, cashier_id, total_amount, sale_timestamp, client_sale_id)
+        SELECT %s, %s, SUM(quantity * price_per_unit),
+               COALESCE(MIN(sale_timestamp), CURRENT_TIMESTAMP), client_sale_id
+        FROM sales_batch_staging
+        GROUP BY client_sale_id
+        ORDER BY MIN(seq)
+        RETURNING client_sale_id, sale_id, total_amount
+    """, (store_id, cashier_id))
+    for client_sale_id, sale_id, total_amount in cursor.fetchall():
+        results[client_sale_id] = {
+            'client_sale_id': client_sale_id,
+            'status': 'accepted',
+            'sale_id': sale_id,
+            'total_amount': float(total_amount)
+        }
+    
+    cursor.execute("""
+        INSERT INTO sale_items (sale_id, product_id, quantity, price_per_unit)
+        SELECT s.sale_id, st.product_id, st.quantity, st.price_per_unit
+        FROM sales_batch_staging st
+        JOIN sales s ON s.store_id = %s AND s.client_sale_id = st.client_sale_id
+        ORDER BY st.seq
+    """, (store_id,))
+    
+    cursor.execute("""
+        UPDATE inventory AS i
+        SET quantity = i.quantity - d.quantity, updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT product_id, SUM(quantity) AS quantity
+            FROM sales_batch_staging
+            GROUP BY product_id
+        ) AS d
+        WHERE i.store_id = %s AND i.product_id = d.product_id
+    """, (store_id,))
+    
+    cursor.execute(f"""
+        SELECT {BUSINESS_DATE_SQL.replace('sale_timestamp', 's.sale_timestamp')}, st.product_id,
+               SUM(st.quantity), SUM(st.quantity * st.price_per_unit), COUNT(DISTINCT s.sale_id)
+        FROM sales_batch_staging st
+        JOIN sales s ON s.store_id = %s AND s.client_sale_id = st.client_sale_id
+        GROUP BY 1, 2
+    """, (store_id,))
+    apply_sales_rollup(cursor, store_id, cursor.fetchall())
+    
+    conn.commit()
+    return results
+
+@app.route('/api/sales/batch', methods=['POST'])
+@jwt_required()
+def create_sales_batch():
+    """离线销售批量补传：按client_sale_id去重，返回逐单的接受/拒绝结果"""
+    try:
+        data = request.get_json() or {}
+        store_id = data.get('store_id')
+        sales = data.get('sales') or []
+        
+        if not store_id or not sales:
+            return {'message': '缺少必要参数'}, 400
+        try:
+            store_id = int(store_id)
+        except (TypeError, ValueError):
+            return {'message': '门店ID格式错误'}, 400
+        if len(sales) > app.config['SALES_BATCH_MAX_SIZE']:
+            return {'message': f"单次最多上传 {app.config['SALES_BATCH_MAX_SIZE']} 条销售记录"}, 400
+        
+        current_user_id, current_role, current_store_id = get_current_user()
+        if current_role != 'system_admin' and current_store_id != store_id:
+            return {'message': '您只能上传自己门店的销售记录'}, 403
+        
+        report = [None] * len(sales)
+        positions = {}  # client_sale_id -> 在report中的位置
+        valid = []
+        for index, sale in enumerate(sales):
+            client_sale_id, sale_timestamp, lines, error = parse_offline_sale(sale if isinstance(sale, dict) else {})
+            if error:
+                report[index] = {'client_sale_id': client_sale_id, 'status': 'rejected', 'reason': error}
+            elif client_sale_id in positions:
+                report[index] = {'client_sale_id': client_sale_id, 'status': 'rejected',
+                                 'reason': '同一批次中client_sale_id重复'}
+            else:
+                positions[client_sale_id] = index
+                valid.append((client_sale_id, sale_timestamp, lines))
+        
+        if valid:
+            try:
+                applied = run_in_transaction(_apply_sales_batch, store_id, current_user_id, valid)
+            except psycopg2.Error as e:
+                # 另一个补传请求同时写入了相同的client_sale_id，重新执行一次即可按重复处理
+                if e.pgcode != errorcodes.UNIQUE_VIOLATION:
+                    raise
+                applied = run_in_transaction(_apply_sales_batch, store_id, current_user_id, valid)
+            for client_sale_id, result in applied.items():
+                report[positions[client_sale_id]] = result
+            dashboard_cache.invalidate_store(store_id)
+        
+        summary = {status: sum(1 for r in report if r['status'] == status)
+                   for status in ('accepted', 'duplicate', 'rejected')}
+        
+        try:
+            log_action(current_user_id, 'create_sales_batch',
+                       f"批量补传销售 {len(report)} 条：接受 {summary['accepted']}，重复 {summary['duplicate']}，拒绝 {summary['rejected']}")
+        except Exception as log_error:
+            app.logger.warning("记录批量补传日志失败: %s", log_error)
+        
+        return {
+            'message': '批量补传完成',
+            **summary,
+            'results': report
+        }, 200
+        
+    except Exception as e:
+        app.logger.exception("批量补传销售异常: %s", e)
+        return {'message': f'批量补传失败: {str(e)}'}, 500
+
+app.config['SALES_PAGE_SIZE'] = int(os.getenv('SALES_PAGE_SIZE', 50))
+app.config['SALES_PAGE_SIZE_MAX'] = int(os.getenv('SALES_PAGE_SIZE_MAX', 200))
+
+def encode_sales_cursor(sale_timestamp, sale_id):
+    """把最后一行的 (sale_timestamp, sale_id) 编码为不透明的分页游标"""
+    raw = json.dumps([sale_timestamp.isoformat(), sale_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_sales_cursor(value):
+    raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    sale_timestamp, sale_id = json.loads(raw)
+    return datetime.fromisoformat(sale_timestamp), int(sale_id)
+
+def parse_local_date(value):
+    """把 YYYY-MM-DD 解析为北京时间当天0点"""
+    return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=BEIJING_TZ)
+
+def estimate_row_count(cursor, sql, params):
+    """读取执行计划的估算行数，代替 COUNT(*) 全量扫描"""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+SALES_LIST_COLUMNS = ('sale_id', 'store_id', 'total_amount', 'sale_date', 'sale_timestamp',
+                      'store_name', 'user_name', 'cashier_name')
+
+def build_sales_query(filters, limit, cursor=None):
+    """生成销售列表查询，get_sales 和 benchmarks/explain_baseline.py 共用
+
+    filters 可包含 store_id、cashier_id、start/end（北京时间 datetime，end 不含）、min_amount/max_amount；
+    cursor 为 decode_sales_cursor 的结果。多取一行判断 has_more。
+    返回 (sql, params, count_sql, count_params)，count_sql 不含游标条件。
+    """
+    conditions = []
+    params = []
+    for key, condition in (('store_id', "s.store_id = %s"), ('cashier_id', "s.cashier_id = %s"),
+                           ('start', "s.sale_timestamp >= %s"), ('end', "s.sale_timestamp < %s"),
+                           ('min_amount', "s.total_amount >= %s"), ('max_amount', "s.total_amount <= %s")):
+        if filters.get(key) is not None:
+            conditions.append(condition)
+            params.append(filters[key])
+    
+    page_conditions = list(conditions)
+    page_params = list(params)
+    if cursor:
+        page_conditions.append("(s.sale_timestamp, s.sale_id) < (%s, %s)")
+        page_params.extend(cursor)
+    
+    where_sql = ("WHERE " + " AND ".join(page_conditions)) if page_conditions else ""
+    sql = f"""
+        SELECT s.sale_id, s.store_id, s.total_amount, s.sale_timestamp,
+               st.name as store_name, COALESCE(u.username, '未知') as cashier_name,
+               {local_time_sql('s.sale_timestamp')}
+        FROM sales s
+        LEFT JOIN stores st ON s.store_id = st.store_id
+        LEFT JOIN users u ON s.cashier_id = u.user_id
+        {where_sql}
+        ORDER BY s.sale_timestamp DESC, s.sale_id DESC
+        LIMIT %s
+    """
+    count_where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    return sql, page_params + [limit + 1], f"SELECT 1 FROM sales s {count_where}", params
+
 @app.route('/api/sales/', methods=['GET'])
 @jwt_required()
 def get_sales():
+    """销售记录列表：按 (sale_timestamp, sale_id) 倒序游标分页
+
+    查询参数：limit、cursor（上一页返回的next_cursor）、start_date/end_date（YYYY-MM-DD）、
+    cashier_id、store_id、min_amount/max_amount、count（estimate 或 exact，返回总数）
+    """
     try:
-        store_id = request.args.get('store_id')
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        current_user_id, current_role, current_store_id = get_current_user()
         
-        # 获取当前用户信息
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
+        try:
+            limit = min(max(int(request.args.get('limit', app.config['SALES_PAGE_SIZE'])), 1),
+                        app.config['SALES_PAGE_SIZE_MAX'])
+            filters = {}
+            
+            # 根据角色权限过滤销售记录
+            if current_role == 'system_admin':
+                # 系统管理员可以看到所有销售记录
+                if request.args.get('store_id'):
+                    filters['store_id'] = int(request.args['store_id'])
+            elif current_role == 'store_manager':
+                # 门店经理只能看到自己门店的销售记录
+                filters['store_id'] = current_store_id
+            else:
+                # 收银员只能看到自己的销售记录
+                filters['cashier_id'] = current_user_id
+            
+            if request.args.get('cashier_id') and current_role != 'cashier':
+                filters['cashier_id'] = int(request.args['cashier_id'])
+            if request.args.get('start_date'):
+                filters['start'] = parse_local_date(request.args['start_date'])
+            if request.args.get('end_date'):
+                filters['end'] = parse_local_date(request.args['end_date']) + timedelta(days=1)
+            if request.args.get('min_amount'):
+                filters['min_amount'] = Decimal(request.args['min_amount'])
+            if request.args.get('max_amount'):
+                filters['max_amount'] = Decimal(request.args['max_amount'])
+            
+            page_cursor = decode_sales_cursor(request.args['cursor']) if request.args.get('cursor') else None
+            sql, page_params, count_sql, params = build_sales_query(filters, limit, page_cursor)
+        except (ValueError, TypeError, ArithmeticError, binascii.Error):
+            return {'message': '查询参数格式错误'}, 400
         
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '用户不存在'}, 404
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute(sql, page_params)
         
-        current_role, current_store_id = current_user
+        sales = cursor.fetchall()
+        has_more = len(sales) > limit
+        sales = sales[:limit]
+        
+        # sale_date/sale_timestamp、user_name/cashier_name 为兼容前端的同值字段；
+        # 原始 sale_timestamp（第4列）只用于游标
+        result = {
+            'sales': RowSet(SALES_LIST_COLUMNS, [
+                (sale[0], sale[1], float(sale[2]), sale[6], sale[6], sale[4], sale[5], sale[5])
+                for sale in sales
+            ]),
+            'limit': limit,
+            'has_more': has_more,
+            'next_cursor': encode_sales_cursor(sales[-1][3], sales[-1][0]) if has_more else None
+        }
         
-        # 根据角色权限过滤销售记录
-        if current_role == 'system_admin':
-            # 系统管理员可以看到所有销售记录
-            if store_id:
-                cursor.execute("""
-                    SELECT s.sale_id, s.store_id, s.total_amount, s.sale_timestamp,
-                           st.name as store_name, COALESCE(u.username, '未知') as cashier_name
-                    FROM sales s
-                    LEFT JOIN stores st ON s.store_id = st.store_id
-                    LEFT JOIN users u ON s.cashier_id = u.user_id
-                    WHERE s.store_id = %s
-                    ORDER BY s.sale_timestamp DESC
-                """, (store_id,))
+        # 可选的总数：estimate 读取执行计划估算，exact 执行 COUNT(*)
+        count_mode = request.args.get('count')
+        if count_mode in ('estimate', 'exact'):
+            if count_mode == 'exact':
+                cursor.execute(f"SELECT COUNT(*) FROM ({count_sql}) AS c", params)
+                result['total'] = cursor.fetchone()[0]
             else:
-                cursor.execute("""
-                    SELECT s.sale_id, s.store_id, s.total_amount, s.sale_timestamp,
-                           st.name as store_name, COALESCE(u.username, '未知') as cashier_name
-                    FROM sales s
-                    LEFT JOIN stores st ON s.store_id = st.store_id
-                    LEFT JOIN users u ON s.cashier_id = u.user_id
-                    ORDER BY s.sale_timestamp DESC
-                """)
-        elif current_role == 'store_manager':
-            # 门店经理只能看到自己门店的销售记录
-            cursor.execute("""
-                SELECT s.sale_id, s.store_id, s.total_amount, s.sale_timestamp,
-                       st.name as store_name, COALESCE(u.username, '未知') as cashier_name
-                FROM sales s
-                LEFT JOIN stores st ON s.store_id = st.store_id
-                LEFT JOIN users u ON s.cashier_id = u.user_id
-                WHERE s.store_id = %s
-                ORDER BY s.sale_timestamp DESC
-            """, (current_store_id,))
-        else:
-            # 收银员只能看到自己的销售记录
-            cursor.execute("""
-                SELECT s.sale_id, s.store_id, s.total_amount, s.sale_timestamp,
-                       st.name as store_name, COALESCE(u.username, '未知') as cashier_name
-                FROM sales s
-                LEFT JOIN stores st ON s.store_id = st.store_id
-                LEFT JOIN users u ON s.cashier_id = u.user_id
-                WHERE s.cashier_id = %s
-                ORDER BY s.sale_timestamp DESC
-            """, (current_user_id,))
+                result['total'] = estimate_row_count(cursor, count_sql, params)
+            result['total_is_estimate'] = count_mode == 'estimate'
         
-        sales = cursor.fetchall()
+        return result, 200
         
-        cursor.close()
-        conn.close()
+    except Exception as e:
+        return {'message': f'获取销售记录失败: {str(e)}'}, 500
+
+app.config['SALES_EXPORT_CHUNK_SIZE'] = int(os.getenv('SALES_EXPORT_CHUNK_SIZE', 2000))  # 导出时每批从服务端游标读取的行数
+
+# 每个销售明细一行，销售单字段在同一单的各明细行上重复
+SALES_EXPORT_COLUMNS = ('sale_id', 'sale_time', 'store_id', 'store_name', 'cashier_id', 'cashier_name',
+                        'total_amount', 'item_id', 'product_id', 'sku', 'product_name', 'quantity',
+                        'price_per_unit', 'subtotal')
+
+def encode_export_chunk(rows, export_format):
+    """把一批导出行编码为字节串：csv 为逗号分隔行，ndjson 为每行一个 JSON 对象"""
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+    return b''.join(json_dumps_bytes(dict(zip(SALES_EXPORT_COLUMNS, row))) + b'\n' for row in rows)
+
+@app.route('/api/sales/export', methods=['GET'])
+@jwt_required()
+def export_sales():
+    """流式导出销售明细：销售单、明细、商品一次关联查询，按批从服务端游标读取
+
+    查询参数：from/to（YYYY-MM-DD，北京时间，含当天）、store_id（仅系统管理员）、format（csv 或 ndjson）。
+    使用独立的连接池连接，响应发送完毕后归还；内存占用只与批大小有关，与导出行数无关。
+    """
+    try:
+        current_user_id, current_role, current_store_id = get_current_user()
+        
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            return {'message': 'format 只支持 csv 或 ndjson'}, 400
         
-        sales_list = []
-        for sale in sales:
-            # 使用时区转换函数格式化时间
-            timestamp_str = format_datetime_with_timezone(sale[3])
+        try:
+            conditions = []
+            params = []
             
-            sales_list.append({
-                'sale_id': sale[0],
-                'store_id': sale[1],
-                'total_amount': float(sale[2]) if sale[2] else 0,
-                'sale_date': timestamp_str,
-                'sale_timestamp': timestamp_str,
-                'store_name': sale[4],
-                'user_name': sale[5],
-                'cashier_name': sale[5]
-            })
+            # 与销售记录列表相同的角色范围
+            if current_role == 'system_admin':
+                if request.args.get('store_id'):
+                    conditions.append("s.store_id = %s")
+                    params.append(int(request.args['store_id']))
+            elif current_role == 'store_manager':
+                conditions.append("s.store_id = %s")
+                params.append(current_store_id)
+            else:
+                conditions.append("s.cashier_id = %s")
+                params.append(current_user_id)
+            
+            if request.args.get('from'):
+                conditions.append("s.sale_timestamp >= %s")
+                params.append(parse_local_date(request.args['from']))
+            if request.args.get('to'):
+                conditions.append("s.sale_timestamp < %s")
+                params.append(parse_local_date(request.args['to']) + timedelta(days=1))
+        except (ValueError, TypeError):
+            return {'message': '查询参数格式错误'}, 400
+        
+        where_sql = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        sql = f"""
+            SELECT s.sale_id, {local_time_sql('s.sale_timestamp')}, s.store_id, st.name, s.cashier_id,
+                   COALESCE(u.username, '未知'), s.total_amount,
+                   si.item_id, si.product_id, p.sku, p.name, si.quantity, si.price_per_unit,
+                   si.quantity * si.price_per_unit
+            FROM sales s
+            JOIN sale_items si ON si.sale_id = s.sale_id
+            JOIN products p ON si.product_id = p.product_id
+            LEFT JOIN stores st ON s.store_id = st.store_id
+            LEFT JOIN users u ON s.cashier_id = u.user_id
+            {where_sql}
+            ORDER BY s.sale_timestamp, s.sale_id, si.item_id
+        """
         
-        return {'sales': sales_list}, 200
+        # 请求连接在返回响应时就会归还，流式读取使用单独借出的连接
+        conn = get_db_connection(outlive_request=True)
+        try:
+            cursor = conn.cursor(name='sales_export')
+            cursor.itersize = app.config['SALES_EXPORT_CHUNK_SIZE']
+            cursor.execute(sql, params)
+        except Exception:
+            conn.close()
+            raise
+        
+        def generate():
+            # Excel 需要 BOM 才能识别 UTF-8 的中文
+            if export_format == 'csv':
+                yield b'\xef\xbb\xbf' + encode_export_chunk([SALES_EXPORT_COLUMNS], 'csv')
+            while True:
+                rows = cursor.fetchmany(app.config['SALES_EXPORT_CHUNK_SIZE'])
+                if not rows:
+                    break
+                yield encode_export_chunk(rows, export_format)
+        
+        if export_format == 'csv':
+            mimetype, extension = 'text/csv', 'csv'
+        else:
+            mimetype, extension = 'application/x-ndjson', 'ndjson'
+        filename = f"sales_{request.args.get('from', 'all')}_{request.args.get('to', 'all')}.{extension}"
+        response = app.response_class(generate(), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        # 客户端断开或发送完毕时关闭游标并归还连接（未提交的只读事务由连接池回滚）
+        response.call_on_close(conn.close)
+        return response
         
     except Exception as e:
-        return {'message': f'获取销售记录失败: {str(e)}'}, 500
+        return {'message': f'导出销售记录失败: {str(e)}'}, 500
+
+SALE_ITEMS_SQL = """
+    SELECT si.quantity, si.price_per_unit, p.name as product_name,
+           (si.quantity * si.price_per_unit) as subtotal
+    FROM sale_items si
+    JOIN products p ON si.product_id = p.product_id
+    WHERE si.sale_id = %s
+    ORDER BY si.item_id
+"""
 
 @app.route('/api/sales/<int:sale_id>/items', methods=['GET'])
 @jwt_required()
 def get_sale_items(sale_id):
     try:
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 获取销售详情项目
-        cursor.execute("""
-            SELECT si.quantity, si.price_per_unit, p.name as product_name,
-                   (si.quantity * si.price_per_unit) as subtotal
-            FROM sale_items si
-            JOIN products p ON si.product_id = p.product_id
-            WHERE si.sale_id = %s
-            ORDER BY si.item_id
-        """, (sale_id,))
+        cursor.execute(SALE_ITEMS_SQL, (sale_id,))
         
         items = cursor.fetchall()
         
-        cursor.close()
-        conn.close()
-        
         items_list = []
         for item in items:
             items_list.append({
@@ -2508,53 +3720,26 @@ def get_sale_items(sale_id):
 
 @app.route('/api/sales/<int:sale_id>', methods=['DELETE'])
 @jwt_required()
+@require_permission('sales_management', 'delete', '您没有权限删除销售记录')
 def delete_sale(sale_id):
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 首先检查用户是否有删除销售记录的权限
-        cursor.execute("""
-            SELECT rp.can_delete
-            FROM role_permissions rp
-            JOIN system_features sf ON rp.feature_id = sf.feature_id
-            JOIN users u ON u.role = rp.role
-            WHERE u.user_id = %s AND sf.feature_code = 'sales_management'
-        """, (current_user_id,))
-        
-        permission_result = cursor.fetchone()
-        if not permission_result or not permission_result[0]:
-            cursor.close()
-            conn.close()
-            return {'message': '您没有权限删除销售记录'}, 403
-        
-        # 获取当前用户信息
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 检查销售记录是否存在并获取其信息
-        cursor.execute("""
-            SELECT store_id, cashier_id, total_amount 
+        cursor.execute(f"""
+            SELECT store_id, cashier_id, total_amount, {BUSINESS_DATE_SQL}
             FROM sales 
             WHERE sale_id = %s
         """, (sale_id,))
         sale_info = cursor.fetchone()
         
         if not sale_info:
-            cursor.close()
-            conn.close()
             return {'message': '销售记录不存在'}, 404
         
-        sale_store_id, sale_cashier_id, total_amount = sale_info
+        sale_store_id, sale_cashier_id, total_amount, business_date = sale_info
         
         # 权限检查
         if current_role == 'system_admin':
@@ -2563,21 +3748,18 @@ def delete_sale(sale_id):
         elif current_role == 'store_manager':
             # 门店经理只能删除自己门店的销售记录
             if sale_store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能删除自己门店的销售记录'}, 403
         else:
             # 收银员只能删除自己的销售记录
             if sale_cashier_id != current_user_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能删除自己的销售记录'}, 403
         
         # 获取销售项目用于恢复库存
         cursor.execute("""
-            SELECT product_id, quantity 
+            SELECT product_id, quantity, price_per_unit
             FROM sale_items 
             WHERE sale_id = %s
+            ORDER BY product_id
         """, (sale_id,))
         sale_items = cursor.fetchall()
         
@@ -2588,16 +3770,18 @@ def delete_sale(sale_id):
         cursor.execute("DELETE FROM sales WHERE sale_id = %s", (sale_id,))
         
         # 恢复库存
-        for product_id, quantity in sale_items:
+        for product_id, quantity, _ in sale_items:
             cursor.execute("""
                 UPDATE inventory 
                 SET quantity = quantity + %s, updated_at = CURRENT_TIMESTAMP
                 WHERE store_id = %s AND product_id = %s
             """, (quantity, sale_store_id, product_id))
         
+        # 扣减日汇总
+        apply_sales_rollup(cursor, sale_store_id, sale_rollup_rows(business_date, sale_items), sign=-1)
+        
         conn.commit()
-        cursor.close()
-        conn.close()
+        dashboard_cache.invalidate_store(sale_store_id)
         
         return {'message': '销售记录删除成功，库存已恢复'}, 200
         
@@ -2606,39 +3790,14 @@ def delete_sale(sale_id):
 
 @app.route('/api/inventory/<int:inventory_id>', methods=['DELETE'])
 @jwt_required()
+@require_permission('inventory_management', 'delete', '您没有权限删除库存记录')
 def delete_inventory(inventory_id):
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, current_role, current_store_id = get_current_user()
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 首先检查用户是否有删除库存记录的权限
-        cursor.execute("""
-            SELECT rp.can_delete
-            FROM role_permissions rp
-            JOIN system_features sf ON rp.feature_id = sf.feature_id
-            JOIN users u ON u.role = rp.role
-            WHERE u.user_id = %s AND sf.feature_code = 'inventory_management'
-        """, (current_user_id,))
-        
-        permission_result = cursor.fetchone()
-        if not permission_result or not permission_result[0]:
-            cursor.close()
-            conn.close()
-            return {'message': '您没有权限删除库存记录'}, 403
-        
-        # 获取当前用户信息
-        cursor.execute("SELECT role, store_id FROM users WHERE user_id = %s", (current_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        current_role, current_store_id = current_user
-        
         # 检查库存记录是否存在并获取其信息
         cursor.execute("""
             SELECT store_id, product_id, quantity
@@ -2648,8 +3807,6 @@ def delete_inventory(inventory_id):
         inventory_info = cursor.fetchone()
         
         if not inventory_info:
-            cursor.close()
-            conn.close()
             return {'message': '库存记录不存在'}, 404
         
         inventory_store_id, product_id, quantity = inventory_info
@@ -2661,200 +3818,307 @@ def delete_inventory(inventory_id):
         elif current_role in ['store_manager', 'cashier']:
             # 门店经理和收银员只能删除自己门店的库存记录
             if inventory_store_id != current_store_id:
-                cursor.close()
-                conn.close()
                 return {'message': '您只能删除自己门店的库存记录'}, 403
         
         # 删除库存记录
         cursor.execute("DELETE FROM inventory WHERE inventory_id = %s", (inventory_id,))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {'message': '库存记录删除成功'}, 200
         
     except Exception as e:
         return {'message': f'库存记录删除失败: {str(e)}'}, 500
 
+# ==================== 仪表盘 ====================
+app.config['DASHBOARD_CACHE_TTL'] = float(os.getenv('DASHBOARD_CACHE_TTL', 30))  # 仪表盘统计缓存时间（秒），0为不缓存
+app.config['DASHBOARD_CACHE_WAIT_TIMEOUT'] = float(os.getenv('DASHBOARD_CACHE_WAIT_TIMEOUT', 10))  # 等待其他请求计算的最长时间（秒）
+
+class DashboardStatsCache:
+    """按数据范围（'all' 或门店ID）缓存仪表盘统计结果
+
+    同一范围的并发未命中只由一个请求计算，其余请求等待其结果；等待超过 wait_timeout
+    （计算的请求卡在慢查询上）时不再等待，各自直接计算且不写入缓存。本进程内的销售增删会使
+    对应门店和 'all' 失效；其他进程的修改最多在 TTL 后可见。
+    """
+
+    def __init__(self, ttl, wait_timeout):
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._entries = {}      # 范围 -> (过期时间, 统计结果)
+        self._inflight = {}     # 范围 -> 正在计算的 threading.Event
+        self._generations = {}  # 范围 -> 失效次数，计算期间被失效的结果不写入缓存
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'wait_timeouts': 0, 'invalidations': 0}
+
+    def get(self, scope, compute):
+        if self.ttl <= 0:
+            return compute()
+        while True:
+            with self._lock:
+                entry = self._entries.get(scope)
+                if entry and entry[0] > time.monotonic():
+                    self._counters['hits'] += 1
+                    return entry[1]
+                event = self._inflight.get(scope)
+                if event is None:
+                    event = self._inflight[scope] = threading.Event()
+                    generation = self._generations.get(scope, 0)
+                    self._counters['misses'] += 1
+                    break
+                self._counters['coalesced'] += 1
+            # 等待正在计算的请求；它失败或结果已失效时重新检查，由某个等待者接手计算
+            if not event.wait(self.wait_timeout):
+                with self._lock:
+                    self._counters['wait_timeouts'] += 1
+                app.logger.warning("等待仪表盘统计超过 %s 秒（范围 %s），直接计算", self.wait_timeout, scope)
+                return compute()
+        
+        try:
+            value = compute()
+        except Exception:
+            with self._lock:
+                self._inflight.pop(scope, None)
+            event.set()
+            raise
+        with self._lock:
+            self._inflight.pop(scope, None)
+            if self._generations.get(scope, 0) == generation:
+                self._entries[scope] = (time.monotonic() + self.ttl, value)
+        event.set()
+        return value
+
+    def invalidate_store(self, store_id):
+        """门店销售数据变化后调用，同时失效全系统范围"""
+        with self._lock:
+            for scope in (int(store_id), 'all'):
+                self._entries.pop(scope, None)
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+            self._counters['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, 'ttl': self.ttl, 'cached_scopes': len(self._entries)}
+
+dashboard_cache = DashboardStatsCache(app.config['DASHBOARD_CACHE_TTL'], app.config['DASHBOARD_CACHE_WAIT_TIMEOUT'])
+
+def build_sales_trend_query(today, store_id=None):
+    """最近7个营业日（北京时间）的销售额在数据库中汇总，没有销售的日期补0；返回 (sql, params)"""
+    store_filter = "AND store_id = %s" if store_id is not None else ""
+    return f"""
+        SELECT days.day, COALESCE(t.amount, 0)
+        FROM (SELECT %s::date - n AS day FROM generate_series(0, 6) AS n) AS days
+        LEFT JOIN (
+            SELECT {BUSINESS_DATE_SQL} AS day, SUM(total_amount) AS amount
+            FROM sales
+            WHERE {BUSINESS_DATE_SQL} BETWEEN %s::date - 6 AND %s::date {store_filter}
+            GROUP BY 1
+        ) AS t ON t.day = days.day
+        ORDER BY days.day
+    """, [today, today, today] + ([store_id] if store_id is not None else [])
+
+def compute_dashboard_stats(conn, store_id=None):
+    """计算仪表盘统计数据，store_id 为 None 时统计全部门店"""
+    cursor = conn.cursor()
+    store_filter = ""
+    store_params = []
+    if store_id is not None:
+        store_filter = "AND store_id = %s"
+        store_params = [store_id]
+    
+    weekdays = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+    cursor.execute(*build_sales_trend_query(business_today(), store_id))
+    trend_rows = [(row[0], float(row[1])) for row in cursor.fetchall()]
+    max_amount = max((amount for _, amount in trend_rows), default=0)
+    
+    sales_trend = []
+    for day, amount in trend_rows:
+        sales_trend.append({
+            'date': day.isoformat(),
+            'label': weekdays[day.weekday()],
+            'value': amount,
+            'percentage': int((amount / max_amount * 100) if max_amount > 0 else 0)
+        })
+    
+    # 获取商品分类统计
+    cursor.execute("""
+        SELECT 
+            pc.name as category_name,
+            COUNT(DISTINCT p.product_id) as product_count
+        FROM product_categories pc
+        LEFT JOIN products p ON pc.category_id = p.category_id
+        GROUP BY pc.category_id, pc.name
+        ORDER BY product_count DESC
+    """)
+    
+    categories = []
+    total_products = 0
+    category_colors = ['#409EFF', '#67C23A', '#E6A23C', '#F56C6C', '#909399']
+    
+    for i, row in enumerate(cursor.fetchall()):
+        count = row[1] or 0
+        categories.append({
+            'name': row[0],
+            'count': count,
+            'color': category_colors[i % len(category_colors)]
+        })
+        total_products += count
+    
+    # 计算百分比
+    for cat in categories:
+        cat['value'] = round((cat['count'] / total_products * 100) if total_products > 0 else 0, 1)
+    
+    # 获取最近活动（带权限过滤）
+    # 修改store_filter中的字段名，加上表别名
+    activities_store_filter = store_filter.replace("store_id", "s.store_id") if store_filter else ""
+    
+    activities_query = f"""
+        SELECT 
+            'sale' as type,
+            'info' as status,
+            CONCAT('完成销售订单 #', s.sale_id, '，金额: ¥', s.total_amount) as description,
+            s.sale_timestamp as timestamp,
+            u.username as user_name
+        FROM sales s
+        LEFT JOIN users u ON s.cashier_id = u.user_id
+        WHERE 1=1 {activities_store_filter}
+        ORDER BY s.sale_timestamp DESC
+        LIMIT 10
+    """
+    cursor.execute(activities_query, store_params)
+    
+    activities = []
+    for row in cursor.fetchall():
+        timestamp = format_datetime_with_timezone(row[3])
+        activities.append({
+            'type': row[1],  # 使用status字段作为type
+            'description': row[2],
+            'time': timestamp,
+            'user': row[4] or '系统'
+        })
+    
+    return {
+        'salesTrend': sales_trend,
+        'categories': categories,
+        'activities': activities
+    }
+
 @app.route('/api/dashboard/stats', methods=['GET'])
 @jwt_required()
 def get_dashboard_stats():
-    """获取仪表盘统计数据"""
+    """获取仪表盘统计数据（按数据范围短时缓存）"""
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 获取当前用户的角色和门店信息
-        cursor.execute("""
-            SELECT role, store_id, username 
-            FROM users 
-            WHERE user_id = %s
-        """, (current_user_id,))
-        user_info = cursor.fetchone()
-        
-        if not user_info:
-            return {'message': '用户信息不存在'}, 404
-            
-        user_role = user_info[0]
-        user_store_id = user_info[1]
-        username = user_info[2]
+        current_user_id, user_role, user_store_id = get_current_user()
         
         # 根据用户角色决定查询范围
-        store_filter = ""
-        store_params = []
-        
         if user_role == 'system_admin':
             # 系统管理员可以看到所有门店数据
-            pass
-        else:
+            scope = 'all'
+        elif user_store_id:
             # 门店经理和收银员只能看到自己门店的数据
-            if user_store_id:
-                store_filter = "AND store_id = %s"
-                store_params = [user_store_id]
-            else:
-                return {'message': '用户未关联任何门店'}, 403
-        
-        # 检查总的销售记录数（带权限过滤）
-        total_query = f"SELECT COUNT(*) FROM sales WHERE 1=1 {store_filter}"
-        cursor.execute(total_query, store_params)
-        total_sales_count = cursor.fetchone()[0]
-        
-        # 检查最近7天的销售记录数（带权限过滤）
-        recent_query = f"""
-            SELECT COUNT(*) FROM sales 
-            WHERE sale_timestamp >= CURRENT_DATE - INTERVAL '7 days' {store_filter}
-        """
-        cursor.execute(recent_query, store_params)
-        recent_sales_count = cursor.fetchone()[0]
-        
-        # 直接按日期字符串分组汇总销售数据
-        from datetime import date, timedelta, datetime
-        weekdays = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
-        sales_by_date = {}
-        max_amount = 0
-        
-        # 获取所有销售记录并在Python中进行汇总（带权限过滤）
-        sales_query = f"""
-            SELECT sale_timestamp, total_amount
-            FROM sales
-            WHERE sale_timestamp >= CURRENT_DATE - INTERVAL '7 days' {store_filter}
-            ORDER BY sale_timestamp
-        """
-        cursor.execute(sales_query, store_params)
-        
-        all_sales = cursor.fetchall()
+            scope = user_store_id
+        else:
+            return {'message': '用户未关联任何门店'}, 403
         
-        # 在Python中按日期汇总
-        for row in all_sales:
-            timestamp = row[0]
-            amount = float(row[1]) if row[1] else 0
-            
-            # 提取日期部分
-            if isinstance(timestamp, datetime):
-                date_str = timestamp.date().isoformat()
-            else:
-                # 如果是字符串，解析后提取日期
-                try:
-                    dt = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
-                    date_str = dt.date().isoformat()
-                except:
-                    date_str = str(timestamp)[:10]  # 简单提取前10个字符
-            
-            if date_str in sales_by_date:
-                sales_by_date[date_str] += amount
-            else:
-                sales_by_date[date_str] = amount
-                
-            if sales_by_date[date_str] > max_amount:
-                max_amount = sales_by_date[date_str]
-        
-        # 生成最近7天的数据
-        sales_trend = []
-        for i in range(7):
-            target_date = date.today() - timedelta(days=6-i)
-            date_str = target_date.isoformat()
-            weekday = weekdays[target_date.weekday()]
-            amount = sales_by_date.get(date_str, 0)
-            
-            sales_trend.append({
-                'date': date_str,
-                'label': weekday,
-                'value': amount,
-                'percentage': int((amount / max_amount * 100) if max_amount > 0 else 0)
-            })
+        stats = dashboard_cache.get(
+            scope, lambda: compute_dashboard_stats(get_db(), None if scope == 'all' else scope)
+        )
+        return stats, 200
         
-        # 获取商品分类统计
-        cursor.execute("""
-            SELECT 
-                pc.name as category_name,
-                COUNT(DISTINCT p.product_id) as product_count
-            FROM product_categories pc
-            LEFT JOIN products p ON pc.category_id = p.category_id
-            GROUP BY pc.category_id, pc.name
-            ORDER BY product_count DESC
-        """)
+    except Exception as e:
+        print(f"获取统计数据失败: {str(e)}")
+        return {'message': '获取统计数据失败'}, 500
+
+# ==================== 销售报表 ====================
+def build_daily_sales_report_query(start_date, end_date, store_id=None, product_id=None):
+    """销售报表的按日汇总和按商品汇总查询，返回 (daily_sql, products_sql, params)，两条查询参数相同"""
+    conditions = ["r.business_date BETWEEN %s AND %s"]
+    params = [start_date, end_date]
+    if store_id:
+        conditions.append("r.store_id = %s")
+        params.append(store_id)
+    if product_id:
+        conditions.append("r.product_id = %s")
+        params.append(product_id)
+    where_sql = " AND ".join(conditions)
+    
+    daily_sql = f"""
+        SELECT r.business_date, SUM(r.units), SUM(r.revenue)
+        FROM sales_daily_rollup r
+        WHERE {where_sql}
+        GROUP BY r.business_date
+        ORDER BY r.business_date
+    """
+    # 一笔销售只属于一个营业日，按商品累加 sale_count 不会重复计数
+    products_sql = f"""
+        SELECT r.product_id, p.name, p.sku, SUM(r.units), SUM(r.revenue), SUM(r.sale_count)
+        FROM sales_daily_rollup r
+        JOIN products p ON p.product_id = r.product_id
+        WHERE {where_sql}
+        GROUP BY r.product_id, p.name, p.sku
+        ORDER BY SUM(r.revenue) DESC, r.product_id
+    """
+    return daily_sql, products_sql, params
+
+@app.route('/api/reports/daily-sales', methods=['GET'])
+@jwt_required()
+def get_daily_sales_report():
+    """按营业日的销售报表，只读 sales_daily_rollup
+
+    查询参数：start_date/end_date（YYYY-MM-DD，默认最近7天）、store_id（仅系统管理员）、product_id
+    """
+    try:
+        current_user_id, user_role, user_store_id = get_current_user()
         
-        categories = []
-        total_products = 0
-        category_colors = ['#409EFF', '#67C23A', '#E6A23C', '#F56C6C', '#909399']
+        try:
+            today = business_today()
+            end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() if request.args.get('end_date') else today
+            start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() if request.args.get('start_date') else end_date - timedelta(days=6)
+            product_id = int(request.args['product_id']) if request.args.get('product_id') else None
+            store_id = int(request.args['store_id']) if request.args.get('store_id') else None
+        except ValueError:
+            return {'message': '查询参数格式错误'}, 400
+        if start_date > end_date:
+            return {'message': '开始日期不能晚于结束日期'}, 400
+        
+        # 门店经理和收银员只能看到自己门店的数据
+        if user_role != 'system_admin':
+            if not user_store_id:
+                return {'message': '用户未关联任何门店'}, 403
+            store_id = user_store_id
+        daily_sql, products_sql, params = build_daily_sales_report_query(start_date, end_date, store_id, product_id)
         
-        for i, row in enumerate(cursor.fetchall()):
-            count = row[1] or 0
-            categories.append({
-                'name': row[0],
-                'count': count,
-                'color': category_colors[i % len(category_colors)]
-            })
-            total_products += count
-        
-        # 计算百分比
-        for cat in categories:
-            cat['value'] = round((cat['count'] / total_products * 100) if total_products > 0 else 0, 1)
-        
-        # 获取最近活动（带权限过滤）
-        # 修改store_filter中的字段名，加上表别名
-        activities_store_filter = store_filter.replace("store_id", "s.store_id") if store_filter else ""
-        
-        activities_query = f"""
-            SELECT 
-                'sale' as type,
-                'info' as status,
-                CONCAT('完成销售订单 #', s.sale_id, '，金额: ¥', s.total_amount) as description,
-                s.sale_timestamp as timestamp,
-                u.username as user_name
-            FROM sales s
-            LEFT JOIN users u ON s.cashier_id = u.user_id
-            WHERE 1=1 {activities_store_filter}
-            ORDER BY s.sale_timestamp DESC
-            LIMIT 10
-        """
-        cursor.execute(activities_query, store_params)
-        
-        activities = []
-        for row in cursor.fetchall():
-            timestamp = format_datetime_with_timezone(row[3])
-            activities.append({
-                'type': row[1],  # 使用status字段作为type
-                'description': row[2],
-                'time': timestamp,
-                'user': row[4] or '系统'
-            })
+        conn = get_db()
+        cursor = conn.cursor()
         
-        cursor.close()
-        conn.close()
+        cursor.execute(daily_sql, params)
+        daily = [{
+            'date': row[0].isoformat(),
+            'units': int(row[1]),
+            'revenue': float(row[2])
+        } for row in cursor.fetchall()]
+        
+        cursor.execute(products_sql, params)
+        products = [{
+            'product_id': row[0],
+            'product_name': row[1],
+            'sku': row[2],
+            'units': int(row[3]),
+            'revenue': float(row[4]),
+            'sale_count': int(row[5])
+        } for row in cursor.fetchall()]
         
         return {
-            'salesTrend': sales_trend,
-            'categories': categories,
-            'activities': activities
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'store_id': store_id,
+            'daily': daily,
+            'products': products
         }, 200
         
     except Exception as e:
-        print(f"获取统计数据失败: {str(e)}")
-        return {'message': '获取统计数据失败'}, 500
+        app.logger.exception("获取销售报表失败: %s", e)
+        return {'message': '获取销售报表失败'}, 500
 
 # ==================== 权限管理 ====================
 @app.route('/api/permissions/features', methods=['GET'])
@@ -2862,20 +4126,15 @@ def get_dashboard_stats():
 def get_system_features():
     """获取系统功能列表"""
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        current_user_id, current_role, current_store_id = get_current_user()
         
         # 检查当前用户是否为系统管理员
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (current_user_id,))
-        user_role = cursor.fetchone()
-        
-        if not user_role or user_role[0] != 'system_admin':
-            cursor.close()
-            conn.close()
+        if current_role != 'system_admin':
             return {'message': '只有系统管理员可以访问权限管理'}, 403
         
+        conn = get_db()
+        cursor = conn.cursor()
+        
         cursor.execute("""
             SELECT feature_id, feature_code, feature_name, description, module, is_active
             FROM system_features
@@ -2883,8 +4142,6 @@ def get_system_features():
         """)
         
         features = cursor.fetchall()
-        cursor.close()
-        conn.close()
         
         features_list = []
         for feature in features:
@@ -2907,20 +4164,15 @@ def get_system_features():
 def get_role_permissions():
     """获取角色权限配置"""
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        current_user_id, current_role, current_store_id = get_current_user()
         
         # 检查当前用户是否为系统管理员
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (current_user_id,))
-        user_role = cursor.fetchone()
-        
-        if not user_role or user_role[0] != 'system_admin':
-            cursor.close()
-            conn.close()
+        if current_role != 'system_admin':
             return {'message': '只有系统管理员可以访问权限管理'}, 403
         
+        conn = get_db()
+        cursor = conn.cursor()
+        
         cursor.execute("""
             SELECT rp.role, sf.feature_id, sf.feature_code, sf.feature_name, sf.module,
                    rp.can_view, rp.can_create, rp.can_edit, rp.can_delete
@@ -2931,8 +4183,6 @@ def get_role_permissions():
         """)
         
         permissions = cursor.fetchall()
-        cursor.close()
-        conn.close()
         
         # 按角色组织数据
         role_permissions = {}
@@ -2962,20 +4212,15 @@ def get_role_permissions():
 def update_role_permission(role, feature_id):
     """更新角色的功能权限"""
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        current_user_id, current_role, current_store_id = get_current_user()
         
         # 检查当前用户是否为系统管理员
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (current_user_id,))
-        user_role = cursor.fetchone()
-        
-        if not user_role or user_role[0] != 'system_admin':
-            cursor.close()
-            conn.close()
+        if current_role != 'system_admin':
             return {'message': '只有系统管理员可以修改权限配置'}, 403
         
+        conn = get_db()
+        cursor = conn.cursor()
+        
         data = request.get_json()
         can_view = data.get('can_view', False)
         can_create = data.get('can_create', False)
@@ -2985,22 +4230,16 @@ def update_role_permission(role, feature_id):
         # 验证角色是否有效
         valid_roles = ['system_admin', 'store_manager', 'cashier']
         if role not in valid_roles:
-            cursor.close()
-            conn.close()
             return {'message': '无效的角色'}, 400
         
         # 检查功能是否存在
         cursor.execute("SELECT feature_code FROM system_features WHERE feature_id = %s", (feature_id,))
         feature = cursor.fetchone()
         if not feature:
-            cursor.close()
-            conn.close()
             return {'message': '功能不存在'}, 404
         
         # 防止修改系统管理员的权限管理权限
         if role == 'system_admin' and feature[0] == 'permission_management':
-            cursor.close()
-            conn.close()
             return {'message': '不能修改系统管理员的权限管理权限'}, 400
         
         # 更新权限
@@ -3018,8 +4257,6 @@ def update_role_permission(role, feature_id):
             """, (role, feature_id, can_view, can_create, can_edit, can_delete))
         
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'message': '权限更新成功',
@@ -3041,32 +4278,20 @@ def update_role_permission(role, feature_id):
 def get_user_permissions(user_id):
     """获取用户的权限列表"""
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        current_user_id, current_role, current_store_id = get_current_user()
         
         # 检查权限：只能查看自己的权限，或者系统管理员可以查看所有用户权限
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (current_user_id,))
-        current_user_role = cursor.fetchone()
-        
-        if not current_user_role:
-            cursor.close()
-            conn.close()
-            return {'message': '当前用户不存在'}, 404
-        
-        if current_user_id != user_id and current_user_role[0] != 'system_admin':
-            cursor.close()
-            conn.close()
+        if current_user_id != user_id and current_role != 'system_admin':
             return {'message': '只能查看自己的权限'}, 403
         
+        conn = get_db()
+        cursor = conn.cursor()
+        
         # 获取目标用户的角色
         cursor.execute("SELECT role FROM users WHERE user_id = %s", (user_id,))
         target_user = cursor.fetchone()
         
         if not target_user:
-            cursor.close()
-            conn.close()
             return {'message': '用户不存在'}, 404
         
         target_role = target_user[0]
@@ -3082,8 +4307,6 @@ def get_user_permissions(user_id):
         """, (target_role,))
         
         permissions = cursor.fetchall()
-        cursor.close()
-        conn.close()
         
         permissions_list = []
         for perm in permissions:
@@ -3111,7 +4334,7 @@ def get_user_permissions(user_id):
 def check_permission():
     """检查用户是否有特定功能的权限"""
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id, role, current_store_id = get_current_user()
         data = request.get_json()
         
         feature_code = data.get('feature_code')
@@ -3120,34 +4343,11 @@ def check_permission():
         if not feature_code:
             return {'message': '缺少功能代码'}, 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 获取用户角色
-        cursor.execute("SELECT role FROM users WHERE user_id = %s", (current_user_id,))
-        user_role = cursor.fetchone()
-        
-        if not user_role:
-            cursor.close()
-            conn.close()
-            return {'message': '用户不存在'}, 404
-        
-        role = user_role[0]
-        
-        # 检查权限
-        permission_column = f'can_{action}'
-        cursor.execute(f"""
-            SELECT {permission_column}
-            FROM role_permissions rp
-            JOIN system_features sf ON rp.feature_id = sf.feature_id
-            WHERE rp.role = %s AND sf.feature_code = %s AND sf.is_active = TRUE
-        """, (role, feature_code))
-        
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        if action not in PERMISSION_BITS:
+            return {'message': '无效的操作类型'}, 400
         
-        has_permission = result[0] if result else False
+        # 检查权限（使用进程内缓存的权限矩阵）
+        has_permission = permission_matrix.has_permission(role, feature_code, action)
         
         return {
             'user_id': current_user_id,
@@ -3160,15 +4360,82 @@ def check_permission():
     except Exception as e:
         return {'message': f'权限检查失败: {str(e)}'}, 500
 
+# ==================== 系统监控 ====================
+@app.route('/api/system/stats', methods=['GET'])
+@jwt_required()
+def get_system_stats():
+    """获取连接池等运行时统计信息（用于容量评估）"""
+    try:
+        current_user_id, current_role, current_store_id = get_current_user()
+        
+        if current_role != 'system_admin':
+            return {'message': '只有系统管理员可以查看系统统计'}, 403
+        
+        return {
+            'db_pool': db_pool.stats(),
+            'audit_log': audit_log_writer.stats(),
+            'promotion_engine': promotion_engine.stats(),
+            'dashboard_cache': dashboard_cache.stats()
+        }, 200
+        
+    except Exception as e:
+        return {'message': f'获取系统统计失败: {str(e)}'}, 500
+
 # ==================== 启动服务器 ====================
 if __name__ == '__main__':
+    # 维护命令：python complete_server.py migrate
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        try:
+            db_pool.open()
+            applied = migrate_database()
+            print(f"✅ 数据库迁移完成，执行 {len(applied)} 个迁移")
+            sys.exit(0)
+        except Exception as e:
+            print(f"❌ 数据库迁移失败: {e}")
+            sys.exit(1)
+    
+    # 维护命令：python complete_server.py rebuild-sales-rollup [开始日期] [结束日期]
+    if len(sys.argv) > 1 and sys.argv[1] == 'rebuild-sales-rollup':
+        try:
+            db_pool.open()
+            conn = get_db_connection()
+            try:
+                written = rebuild_sales_rollup(conn, *sys.argv[2:4])
+            finally:
+                conn.close()
+            print(f"✅ 销售日汇总重建完成，写入 {written} 行")
+            sys.exit(0)
+        except Exception as e:
+            print(f"❌ 销售日汇总重建失败: {e}")
+            sys.exit(1)
+    
+    # 维护命令：python complete_server.py purge-sync-log（立即清理超出保留窗口的同步墓碑）
+    if len(sys.argv) > 1 and sys.argv[1] == 'purge-sync-log':
+        try:
+            db_pool.open()
+            conn = get_db_connection()
+            try:
+                horizon = purge_inventory_sync_log(conn, force=True)
+            finally:
+                conn.close()
+            print(f"✅ 同步墓碑清理完成，清理水位 {horizon}" if horizon else "✅ 没有超出保留窗口的同步墓碑")
+            sys.exit(0)
+        except Exception as e:
+            print(f"❌ 同步墓碑清理失败: {e}")
+            sys.exit(1)
+    
     print("🚀 启动完整版超市管理系统...")
     print("=" * 60)
     
     try:
-        print("📦 初始化数据库表...")
-        init_all_tables()
-        print("✅ 数据库表创建成功")
+        print("📦 检查数据库结构版本...")
+        db_pool.open()
+        current_version, required_version = check_schema_version()
+        if current_version < required_version:
+            print(f"❌ 数据库结构版本 {current_version} 低于要求的 {required_version}，"
+                  f"请先执行: python complete_server.py migrate")
+            sys.exit(1)
+        print(f"✅ 数据库结构版本 {current_version}")
         
         print("✅ Flask应用创建成功")
         print("💚 健康检查: http://localhost:5000/health")
@@ -3180,9 +4447,14 @@ if __name__ == '__main__':
         print("📊 库存API: /api/inventory/")
         print("💰 销售API: /api/sales/")
         print("=" * 60)
+        print("🏭 生产环境请使用: gunicorn -c gunicorn.conf.py wsgi:app")
         print("🔥 服务器启动中... (按 Ctrl+C 停止)")
         
-        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+        # 调试模式会开放 Werkzeug 交互式调试器，只在设置 FLASK_DEBUG=1 时开启
+        debug = parse_bool_arg(os.getenv('FLASK_DEBUG', ''))
+        if debug:
+            print("⚠️ 调试模式已开启（FLASK_DEBUG），不要在对外可访问的环境中使用")
+        app.run(host='0.0.0.0', port=5000, debug=debug, use_reloader=False)
         
     except Exception as e:
         print(f"❌ 启动失败: {e}")
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置：gunicorn -c gunicorn.conf.py wsgi:app
+
+所有参数可用环境变量覆盖。每个 worker 有独立的连接池，
+数据库需要的连接数约为 workers × DB_POOL_MAX_SIZE，注意不要超过数据库的 max_connections。
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# 默认每个CPU核心一个进程，进程内再用线程处理并发请求（请求大部分时间在等数据库）
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# 主进程预先导入应用（检查一次数据库版本），worker fork 后共享代码内存
+preload_app = True
+
+# 处理一定数量的请求后平滑重启 worker，避免内存缓慢增长；加随机抖动错开重启
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# 请求超时后 worker 被重启；收到停止信号后最多等待 graceful_timeout 秒处理完进行中的请求
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """worker 启动：重置从主进程继承的连接池状态并建立本进程的连接"""
+    from complete_server import db_pool
+    db_pool.reset_after_fork()
+    db_pool.open()
+
+
+def worker_exit(server, worker):
+    """worker 退出：写完排队中的操作日志并关闭连接"""
+    from complete_server import audit_log_writer, db_pool
+    audit_log_writer.close()
+    db_pool.close_all()
@@ -0,0 +1,410 @@
+-- 基础表结构、历史字段补齐、功能权限初始数据
+-- 所有语句均可在已有数据库上重复执行（IF NOT EXISTS / NOT EXISTS 判断）
+
+-- 门店表 (stores)
+CREATE TABLE IF NOT EXISTS stores (
+    store_id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    address VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 用户表 (users)
+CREATE TABLE IF NOT EXISTS users (
+    user_id SERIAL PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    role VARCHAR(20) NOT NULL CHECK (role IN ('system_admin', 'store_manager', 'cashier')),
+    store_id INT,
+    token_version INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (store_id) REFERENCES stores(store_id)
+);
+
+-- 员工工作日志表 (work_logs)
+CREATE TABLE IF NOT EXISTS work_logs (
+    log_id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL,
+    action VARCHAR(100) NOT NULL,
+    details TEXT,
+    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- 商品分类表 (product_categories)
+CREATE TABLE IF NOT EXISTS product_categories (
+    category_id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 供应商表 (suppliers)
+CREATE TABLE IF NOT EXISTS suppliers (
+    supplier_id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    contact_info TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 商品表 (products)
+CREATE TABLE IF NOT EXISTS products (
+    product_id SERIAL PRIMARY KEY,
+    sku VARCHAR(50) UNIQUE NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    description TEXT,
+    category_id INT,
+    supplier_id INT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (category_id) REFERENCES product_categories(category_id),
+    FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id)
+);
+
+-- 库存表 (inventory)
+CREATE TABLE IF NOT EXISTS inventory (
+    inventory_id SERIAL PRIMARY KEY,
+    product_id INT NOT NULL,
+    store_id INT NOT NULL,
+    quantity INT NOT NULL CHECK (quantity >= 0),
+    price DECIMAL(10, 2) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(product_id),
+    FOREIGN KEY (store_id) REFERENCES stores(store_id),
+    UNIQUE (product_id, store_id)
+);
+
+-- 促销活动表 (promotions)
+CREATE TABLE IF NOT EXISTS promotions (
+    promotion_id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    description TEXT,
+    discount_type VARCHAR(20) NOT NULL CHECK (discount_type IN ('percentage', 'fixed')),
+    discount_value DECIMAL(10, 2) NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    store_id INT,
+    created_by INT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (store_id) REFERENCES stores(store_id),
+    FOREIGN KEY (created_by) REFERENCES users(user_id)
+);
+
+-- 促销商品关联表 (promotion_items)
+CREATE TABLE IF NOT EXISTS promotion_items (
+    id SERIAL PRIMARY KEY,
+    promotion_id INT NOT NULL,
+    product_id INT NOT NULL,
+    FOREIGN KEY (promotion_id) REFERENCES promotions(promotion_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id)
+);
+
+-- 销售单主表 (sales)
+CREATE TABLE IF NOT EXISTS sales (
+    sale_id SERIAL PRIMARY KEY,
+    store_id INT NOT NULL,
+    cashier_id INT NOT NULL,
+    sale_timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    total_amount DECIMAL(10, 2) NOT NULL,
+    FOREIGN KEY (store_id) REFERENCES stores(store_id),
+    FOREIGN KEY (cashier_id) REFERENCES users(user_id)
+);
+
+-- 销售单详情表 (sale_items)
+CREATE TABLE IF NOT EXISTS sale_items (
+    item_id SERIAL PRIMARY KEY,
+    sale_id INT NOT NULL,
+    product_id INT NOT NULL,
+    quantity INT NOT NULL,
+    price_per_unit DECIMAL(10, 2) NOT NULL,
+    FOREIGN KEY (sale_id) REFERENCES sales(sale_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id)
+);
+
+-- 结账幂等键表 (idempotency_keys)，POS重试时按键返回原销售单
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key VARCHAR(100) NOT NULL,
+    user_id INT NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    sale_id INT,
+    total_amount DECIMAL(10, 2),
+    items_count INT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (idempotency_key, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
+
+-- 为现有表添加时间字段（如果不存在）
+-- 为stores表添加时间字段
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='stores' AND column_name='created_at') THEN
+        ALTER TABLE stores ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='stores' AND column_name='updated_at') THEN
+        ALTER TABLE stores ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END $$;
+
+-- 为product_categories表添加时间字段
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='product_categories' AND column_name='created_at') THEN
+        ALTER TABLE product_categories ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='product_categories' AND column_name='updated_at') THEN
+        ALTER TABLE product_categories ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END $$;
+
+-- 为suppliers表添加时间字段
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='suppliers' AND column_name='created_at') THEN
+        ALTER TABLE suppliers ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='suppliers' AND column_name='updated_at') THEN
+        ALTER TABLE suppliers ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END $$;
+
+-- 为products表添加时间字段
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='created_at') THEN
+        ALTER TABLE products ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='updated_at') THEN
+        ALTER TABLE products ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END $$;
+
+-- 为inventory表添加时间字段
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='inventory' AND column_name='created_at') THEN
+        ALTER TABLE inventory ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='inventory' AND column_name='updated_at') THEN
+        ALTER TABLE inventory ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END $$;
+
+-- 为users表添加令牌版本字段（角色/门店变更后使旧令牌失效）
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='users' AND column_name='token_version') THEN
+        ALTER TABLE users ADD COLUMN token_version INT NOT NULL DEFAULT 0;
+    END IF;
+END $$;
+
+-- 为promotions表添加门店和创建者字段
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotions' AND column_name='store_id') THEN
+        ALTER TABLE promotions ADD COLUMN store_id INT;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotions' AND column_name='created_by') THEN
+        ALTER TABLE promotions ADD COLUMN created_by INT;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotions' AND column_name='created_at') THEN
+        ALTER TABLE promotions ADD COLUMN created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END $$;
+
+-- 为sales表添加客户端销售单号（离线补传去重）
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sales' AND column_name='client_sale_id') THEN
+        ALTER TABLE sales ADD COLUMN client_sale_id VARCHAR(100);
+    END IF;
+END $$;
+-- (store_id, client_sale_id) 唯一索引在 0011 中 CONCURRENTLY 创建，不在这里锁住已有数据的 sales 表
+
+-- 为没有门店ID的用户分配默认门店ID（1）
+UPDATE users SET store_id = 1 WHERE store_id IS NULL AND role IN ('cashier', 'store_manager', 'system_admin');
+
+-- 检查并修复work_logs表结构
+DO $$ 
+BEGIN 
+    -- 如果action字段不存在，则添加它
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='work_logs' AND column_name='action') THEN
+        ALTER TABLE work_logs ADD COLUMN action VARCHAR(100);
+    END IF;
+
+    -- 如果details字段不存在，则添加它
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='work_logs' AND column_name='details') THEN
+        ALTER TABLE work_logs ADD COLUMN details TEXT;
+    END IF;
+
+    -- 如果timestamp字段不存在，则添加它
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='work_logs' AND column_name='timestamp') THEN
+        ALTER TABLE work_logs ADD COLUMN timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END $$;
+
+-- 促销商品关联唯一：先清理历史重复数据再建唯一索引
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'uq_promotion_items_promotion_product') THEN
+        DELETE FROM promotion_items WHERE id NOT IN (
+            SELECT MIN(id) FROM promotion_items GROUP BY promotion_id, product_id
+        );
+        CREATE UNIQUE INDEX uq_promotion_items_promotion_product ON promotion_items (promotion_id, product_id);
+    END IF;
+END $$;
+
+-- 功能权限管理表
+-- 系统功能表 (system_features)
+CREATE TABLE IF NOT EXISTS system_features (
+    feature_id SERIAL PRIMARY KEY,
+    feature_code VARCHAR(50) UNIQUE NOT NULL,
+    feature_name VARCHAR(100) NOT NULL,
+    description TEXT,
+    module VARCHAR(50) NOT NULL,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 角色权限表 (role_permissions)
+CREATE TABLE IF NOT EXISTS role_permissions (
+    permission_id SERIAL PRIMARY KEY,
+    role VARCHAR(20) NOT NULL,
+    feature_id INT NOT NULL,
+    can_view BOOLEAN DEFAULT FALSE,
+    can_create BOOLEAN DEFAULT FALSE,
+    can_edit BOOLEAN DEFAULT FALSE,
+    can_delete BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (feature_id) REFERENCES system_features(feature_id),
+    UNIQUE (role, feature_id)
+);
+
+-- 删除工作日志功能和仪表盘功能
+DELETE FROM role_permissions WHERE feature_id IN (
+    SELECT feature_id FROM system_features WHERE feature_code IN ('work_log_management', 'dashboard_view')
+);
+DELETE FROM system_features WHERE feature_code IN ('work_log_management', 'dashboard_view');
+
+-- 插入系统功能数据（如果不存在）
+DO $$
+BEGIN
+    -- 插入系统功能
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'user_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('user_management', '用户管理', '管理系统用户账号', 'user');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'store_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('store_management', '门店管理', '管理门店信息', 'store');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'category_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('category_management', '分类管理', '管理商品分类', 'category');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'supplier_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('supplier_management', '供应商管理', '管理供应商信息', 'supplier');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'product_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('product_management', '商品管理', '管理商品信息', 'product');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'inventory_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('inventory_management', '库存管理', '管理商品库存', 'inventory');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'promotion_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('promotion_management', '促销管理', '管理促销活动', 'promotion');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'sales_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('sales_management', '销售管理', '查看销售记录', 'sales');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'pos_system') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('pos_system', '收银系统', '收银台操作', 'pos');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM system_features WHERE feature_code = 'permission_management') THEN
+        INSERT INTO system_features (feature_code, feature_name, description, module) 
+        VALUES ('permission_management', '权限管理', '管理角色权限', 'permission');
+    END IF;
+END $$;
+
+-- 为system_admin角色初始化所有权限
+INSERT INTO role_permissions (role, feature_id, can_view, can_create, can_edit, can_delete)
+SELECT 'system_admin', feature_id, TRUE, TRUE, TRUE, TRUE
+FROM system_features
+WHERE NOT EXISTS (
+    SELECT 1 FROM role_permissions 
+    WHERE role = 'system_admin' AND feature_id = system_features.feature_id
+);
+
+-- 为store_manager角色初始化基本权限
+INSERT INTO role_permissions (role, feature_id, can_view, can_create, can_edit, can_delete)
+SELECT 'store_manager', sf.feature_id, 
+    CASE 
+        WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
+        WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
+        ELSE TRUE
+    END,
+    CASE 
+        WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
+        WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
+        WHEN sf.feature_code IN ('sales_management', 'promotion_management') THEN FALSE
+        ELSE TRUE
+    END,
+    CASE 
+        WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
+        WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
+        WHEN sf.feature_code IN ('sales_management', 'promotion_management') THEN FALSE
+        ELSE TRUE
+    END,
+    CASE 
+        WHEN sf.feature_code IN ('user_management', 'store_management', 'permission_management') THEN FALSE
+        WHEN sf.feature_code IN ('category_management', 'supplier_management') THEN FALSE
+        WHEN sf.feature_code IN ('sales_management', 'promotion_management') THEN FALSE
+        WHEN sf.feature_code IN ('product_management') THEN FALSE
+        ELSE TRUE
+    END
+FROM system_features sf
+WHERE NOT EXISTS (
+    SELECT 1 FROM role_permissions 
+    WHERE role = 'store_manager' AND feature_id = sf.feature_id
+);
+
+-- 为cashier角色初始化基本权限
+INSERT INTO role_permissions (role, feature_id, can_view, can_create, can_edit, can_delete)
+SELECT 'cashier', sf.feature_id,
+    CASE 
+        WHEN sf.feature_code IN ('pos_system', 'inventory_management', 'product_management') THEN TRUE
+        ELSE FALSE
+    END,
+    CASE 
+        WHEN sf.feature_code IN ('pos_system') THEN TRUE
+        ELSE FALSE
+    END,
+    CASE 
+        WHEN sf.feature_code IN ('inventory_management') THEN TRUE
+        ELSE FALSE
+    END,
+    FALSE
+FROM system_features sf
+WHERE NOT EXISTS (
+    SELECT 1 FROM role_permissions 
+    WHERE role = 'cashier' AND feature_id = sf.feature_id
+);
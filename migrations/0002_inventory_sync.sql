@@ -0,0 +1,66 @@
+-- 收银台增量同步：库存行记录最后修改的事务号，删除的行写入墓碑表
+-- 索引 idx_inventory_store_change_txid 见 0005（CONCURRENTLY 创建）
+
+DO $$ 
+BEGIN 
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='inventory' AND column_name='change_txid') THEN
+        ALTER TABLE inventory ADD COLUMN change_txid BIGINT NOT NULL DEFAULT 0;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS inventory_tombstones (
+    inventory_id INT NOT NULL,
+    product_id INT NOT NULL,
+    store_id INT NOT NULL,
+    deleted_txid BIGINT NOT NULL,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_inventory_tombstones_store_txid ON inventory_tombstones (store_id, deleted_txid);
+
+CREATE OR REPLACE FUNCTION inventory_stamp_change() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION inventory_record_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO inventory_tombstones (inventory_id, product_id, store_id, deleted_txid)
+    VALUES (OLD.inventory_id, OLD.product_id, OLD.store_id, txid_current());
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 促销商品增删、促销修改时标记相关库存行，使其促销价重新下发
+CREATE OR REPLACE FUNCTION promotion_items_touch_inventory() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE inventory SET change_txid = txid_current() WHERE product_id = OLD.product_id;
+        RETURN OLD;
+    END IF;
+    UPDATE inventory SET change_txid = txid_current() WHERE product_id = NEW.product_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION promotions_touch_inventory() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE inventory SET change_txid = txid_current()
+    WHERE product_id IN (SELECT product_id FROM promotion_items WHERE promotion_id = NEW.promotion_id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_inventory_stamp_change ON inventory;
+CREATE TRIGGER trg_inventory_stamp_change BEFORE INSERT OR UPDATE ON inventory
+    FOR EACH ROW EXECUTE PROCEDURE inventory_stamp_change();
+DROP TRIGGER IF EXISTS trg_inventory_tombstone ON inventory;
+CREATE TRIGGER trg_inventory_tombstone AFTER DELETE ON inventory
+    FOR EACH ROW EXECUTE PROCEDURE inventory_record_tombstone();
+DROP TRIGGER IF EXISTS trg_promotion_items_touch_inventory ON promotion_items;
+CREATE TRIGGER trg_promotion_items_touch_inventory AFTER INSERT OR DELETE ON promotion_items
+    FOR EACH ROW EXECUTE PROCEDURE promotion_items_touch_inventory();
+DROP TRIGGER IF EXISTS trg_promotions_touch_inventory ON promotions;
+CREATE TRIGGER trg_promotions_touch_inventory AFTER UPDATE ON promotions
+    FOR EACH ROW EXECUTE PROCEDURE promotions_touch_inventory();
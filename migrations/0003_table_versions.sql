@@ -0,0 +1,52 @@
+-- 表版本号：基础数据表每条写语句执行后递增，用于接口的ETag校验
+-- 表清单与 complete_server.py 中的 VERSIONED_TABLES 一致，新增表需要新的迁移
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1, updated_at = clock_timestamp()
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO table_versions (table_name)
+SELECT 'stores' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'stores');
+DROP TRIGGER IF EXISTS trg_stores_version ON stores;
+CREATE TRIGGER trg_stores_version AFTER INSERT OR UPDATE OR DELETE ON stores
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
+
+INSERT INTO table_versions (table_name)
+SELECT 'product_categories' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'product_categories');
+DROP TRIGGER IF EXISTS trg_product_categories_version ON product_categories;
+CREATE TRIGGER trg_product_categories_version AFTER INSERT OR UPDATE OR DELETE ON product_categories
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
+
+INSERT INTO table_versions (table_name)
+SELECT 'suppliers' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'suppliers');
+DROP TRIGGER IF EXISTS trg_suppliers_version ON suppliers;
+CREATE TRIGGER trg_suppliers_version AFTER INSERT OR UPDATE OR DELETE ON suppliers
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
+
+INSERT INTO table_versions (table_name)
+SELECT 'products' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'products');
+DROP TRIGGER IF EXISTS trg_products_version ON products;
+CREATE TRIGGER trg_products_version AFTER INSERT OR UPDATE OR DELETE ON products
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
+
+INSERT INTO table_versions (table_name)
+SELECT 'promotions' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'promotions');
+DROP TRIGGER IF EXISTS trg_promotions_version ON promotions;
+CREATE TRIGGER trg_promotions_version AFTER INSERT OR UPDATE OR DELETE ON promotions
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
+
+INSERT INTO table_versions (table_name)
+SELECT 'promotion_items' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'promotion_items');
+DROP TRIGGER IF EXISTS trg_promotion_items_version ON promotion_items;
+CREATE TRIGGER trg_promotion_items_version AFTER INSERT OR UPDATE OR DELETE ON promotion_items
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
@@ -0,0 +1,21 @@
+-- 销售日汇总表：门店/商品/北京时间营业日粒度，结账和删除销售时同步维护
+
+CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+    store_id INT NOT NULL,
+    business_date DATE NOT NULL,
+    product_id INT NOT NULL,
+    units BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    sale_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_id, business_date, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sales_daily_rollup_date ON sales_daily_rollup (business_date);
+
+-- 已有历史销售时回填（汇总表为空才执行；之后可用 rebuild-sales-rollup 命令重建）
+INSERT INTO sales_daily_rollup (store_id, business_date, product_id, units, revenue, sale_count)
+SELECT s.store_id, (s.sale_timestamp AT TIME ZONE 'Asia/Shanghai')::date, si.product_id,
+       SUM(si.quantity), SUM(si.quantity * si.price_per_unit), COUNT(DISTINCT s.sale_id)
+FROM sales s
+JOIN sale_items si ON si.sale_id = s.sale_id
+WHERE NOT EXISTS (SELECT 1 FROM sales_daily_rollup)
+GROUP BY 1, 2, 3;
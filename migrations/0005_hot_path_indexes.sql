@@ -0,0 +1,37 @@
+-- migrate: no-transaction
+-- 热点查询索引：CONCURRENTLY 创建，不阻塞业务读写；查询计划基线见 benchmarks/explain_baseline.txt
+-- 非事务迁移按分号逐条执行，不能包含 DO 块；中断后重新执行会先删除构建失败的无效索引
+
+-- 销售列表按 (sale_timestamp, sale_id) 游标分页，按门店/收银员过滤
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_timestamp_id ON sales (sale_timestamp DESC, sale_id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_store_timestamp_id ON sales (store_id, sale_timestamp DESC, sale_id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_cashier_timestamp_id ON sales (cashier_id, sale_timestamp DESC, sale_id DESC);
+
+-- 仪表盘按北京时间营业日汇总
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_business_date ON sales (((sale_timestamp AT TIME ZONE 'Asia/Shanghai')::date));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_store_business_date ON sales (store_id, ((sale_timestamp AT TIME ZONE 'Asia/Shanghai')::date));
+
+-- 销售明细按销售单读取/删除，删除商品前按商品检查
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sale_items_sale ON sale_items (sale_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sale_items_product ON sale_items (product_id);
+
+-- 收银台增量同步按门店读取变更
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventory_store_change_txid ON inventory (store_id, change_txid);
+
+-- 库存列表的筛选、排序和名称/SKU前缀搜索
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventory_store_quantity ON inventory (store_id, quantity);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_category ON products (category_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_supplier ON products (supplier_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_name_prefix ON products (name text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_sku_prefix ON products (sku text_pattern_ops);
+
+-- 促销：按商品查促销；按日期范围筛选
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_promotion_items_product ON promotion_items (product_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_promotions_dates ON promotions (start_date, end_date);
+
+-- 工作日志按时间倒序查看，删除用户前按用户检查
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_work_logs_timestamp ON work_logs (timestamp DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_work_logs_user ON work_logs (user_id);
+
+-- 门店经理查看本门店用户
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_store_role ON users (store_id, role);
@@ -0,0 +1,65 @@
+-- 收银台增量同步改为读时计算促销变化，不再由触发器改写库存行
+-- 0002 的促销触发器按商品更新所有门店的 inventory.change_txid：大促销会在同一事务里
+-- 逐行锁住大量库存行（顺序与结账的 product_id 顺序不一致，可能死锁），这里删除它们。
+-- 改为记录促销自身的变更事务号，由 get_inventory_changes 按门店查出受影响的商品。
+
+DROP TRIGGER IF EXISTS trg_promotion_items_touch_inventory ON promotion_items;
+DROP TRIGGER IF EXISTS trg_promotions_touch_inventory ON promotions;
+DROP FUNCTION IF EXISTS promotion_items_touch_inventory();
+DROP FUNCTION IF EXISTS promotions_touch_inventory();
+
+-- 促销商品关联、促销本身的最后修改事务号（新行由默认值记录，不需要逐行触发器）
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotion_items' AND column_name='change_txid') THEN
+        ALTER TABLE promotion_items ADD COLUMN change_txid BIGINT NOT NULL DEFAULT 0;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='promotions' AND column_name='change_txid') THEN
+        ALTER TABLE promotions ADD COLUMN change_txid BIGINT NOT NULL DEFAULT 0;
+    END IF;
+END $$;
+ALTER TABLE promotion_items ALTER COLUMN change_txid SET DEFAULT txid_current();
+ALTER TABLE promotions ALTER COLUMN change_txid SET DEFAULT txid_current();
+CREATE INDEX IF NOT EXISTS idx_promotion_items_change_txid ON promotion_items (change_txid);
+CREATE INDEX IF NOT EXISTS idx_promotions_change_txid ON promotions (change_txid);
+
+CREATE OR REPLACE FUNCTION promotions_stamp_change() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_promotions_stamp_change ON promotions;
+CREATE TRIGGER trg_promotions_stamp_change BEFORE UPDATE ON promotions
+    FOR EACH ROW EXECUTE PROCEDURE promotions_stamp_change();
+
+-- 移出促销的商品：只追加一行记录，不锁任何库存行；store_id 为空表示全系统促销
+CREATE TABLE IF NOT EXISTS promotion_item_tombstones (
+    product_id INT NOT NULL,
+    store_id INT,
+    deleted_txid BIGINT NOT NULL,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_promotion_item_tombstones_txid ON promotion_item_tombstones (deleted_txid);
+
+CREATE OR REPLACE FUNCTION promotion_items_record_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO promotion_item_tombstones (product_id, store_id, deleted_txid)
+    SELECT OLD.product_id, pr.store_id, txid_current()
+    FROM promotions pr WHERE pr.promotion_id = OLD.promotion_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_promotion_items_tombstone ON promotion_items;
+CREATE TRIGGER trg_promotion_items_tombstone AFTER DELETE ON promotion_items
+    FOR EACH ROW EXECUTE PROCEDURE promotion_items_record_tombstone();
+
+-- 墓碑清理水位：早于该事务号的墓碑可能已被删除，since 更早的客户端需要全量同步
+CREATE TABLE IF NOT EXISTS inventory_sync_horizon (
+    id INT PRIMARY KEY,
+    purged_before_txid BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO inventory_sync_horizon (id, purged_before_txid)
+SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM inventory_sync_horizon WHERE id = 1);
@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- 库存列表按 (store_id, inventory_id) 游标分页：门店内按 inventory_id 顺序取下一页
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventory_store_inventory_id ON inventory (store_id, inventory_id);
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- 未过期促销（end_date >= 今天）的查找：定价索引重建读取所有门店和全系统的促销（不按门店过滤），
+-- 促销列表按门店可见范围过滤后也由规划器选择这个单列索引，见 benchmarks/explain_baseline.txt
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_promotions_end_date ON promotions (end_date);
+
+-- 早期 0005 按门店/全系统拆分的 end_date 部分索引没有查询使用，只增加写入开销
+DROP INDEX CONCURRENTLY IF EXISTS idx_promotions_store_end_date;
+DROP INDEX CONCURRENTLY IF EXISTS idx_promotions_global_end_date;
@@ -0,0 +1,14 @@
+-- 权限表版本号：各进程的权限矩阵缓存在每次检查前比对版本号，
+-- 任一进程修改权限或停用功能后，所有进程的下一次权限检查立即生效
+
+INSERT INTO table_versions (table_name)
+SELECT 'role_permissions' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'role_permissions');
+DROP TRIGGER IF EXISTS trg_role_permissions_version ON role_permissions;
+CREATE TRIGGER trg_role_permissions_version AFTER INSERT OR UPDATE OR DELETE ON role_permissions
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
+
+INSERT INTO table_versions (table_name)
+SELECT 'system_features' WHERE NOT EXISTS (SELECT 1 FROM table_versions WHERE table_name = 'system_features');
+DROP TRIGGER IF EXISTS trg_system_features_version ON system_features;
+CREATE TRIGGER trg_system_features_version AFTER INSERT OR UPDATE OR DELETE ON system_features
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
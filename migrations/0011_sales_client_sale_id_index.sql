@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- 离线补传按 (store_id, client_sale_id) 去重：唯一索引保证并发补传同一销售单时只有一笔写入成功。
+-- 已有数据的 sales 表上普通 CREATE INDEX 会阻塞写入，这里 CONCURRENTLY 创建；
+-- 早期版本已在 0001 中建过同名索引的库会跳过
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_store_client_sale_id ON sales (store_id, client_sale_id);
@@ -71,6 +71,15 @@ echo Two new windows will be opened for the backend and frontend.
 echo Do not close these new windows.
 echo.
 
+REM Apply pending database migrations
+echo Applying database migrations...
+python complete_server.py migrate
+if %ERRORLEVEL% NEQ 0 (
+    echo [ERROR] Database migration failed. Check the database connection and try again.
+    goto :error_exit
+)
+echo.
+
 REM Start Backend Server
 echo Starting backend server (on port 5000)...
 start "Backend Server - Flask" cmd /k "title Backend Server (Flask) & python complete_server.py"
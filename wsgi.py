@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+生产环境 WSGI 入口
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+这里只检查数据库结构版本，不执行迁移；部署时先运行 python complete_server.py migrate。
+检查用的连接在返回前全部关闭，fork 出的 worker 在 post_fork 钩子中各自打开连接池。
+"""
+
+from complete_server import app, db_pool, check_schema_version
+
+db_pool.open()
+try:
+    current_version, required_version = check_schema_version()
+finally:
+    db_pool.close_all()
+
+if current_version < required_version:
+    raise RuntimeError(f'数据库结构版本 {current_version} 低于要求的 {required_version}，'
+                       f'请先执行: python complete_server.py migrate')
+
+__all__ = ['app']